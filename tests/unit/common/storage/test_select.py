@@ -64,3 +64,11 @@ class TestSelect(testtools.TestCase):
             fixed_gen = lambda x, y: i
             self.assertEqual(select.weighted(objs, generator=fixed_gen),
                              objs[i])
+
+    def test_pick_reuses_a_precomputed_spectrum(self):
+        objs = [{'weight': 1, 'name': str(i)} for i in range(3)]
+        table = select.spectrum(objs)
+        for i in range(len(objs)):
+            fixed_gen = lambda x, y: i
+            self.assertEqual(select.pick(table, generator=fixed_gen),
+                             objs[i])
@@ -136,3 +136,61 @@ class TestDecorators(base.TestBase):
 
             self.assertEqual(user, name)
             self.assertEqual(instance.user_gets, 2 + i)
+
+    def test_cached_with_ttl_func(self):
+        conf = cfg.ConfigOpts()
+        oslo_cache.register_oslo_configs(conf)
+        cache = oslo_cache.get_cache(conf.cache_url)
+
+        ttls = []
+
+        def get_ttl(value):
+            ttls.append(value)
+            return 60 if value else 1
+
+        class TestClass(object):
+
+            def __init__(self, cache):
+                self._cache = cache
+
+            @decorators.caches(lambda x: x, get_ttl)
+            def has_user(self, name):
+                return name == 'malini'
+
+        instance = TestClass(cache)
+
+        self.assertTrue(instance.has_user('malini'))
+        self.assertFalse(instance.has_user('kgriffs'))
+        self.assertEqual(ttls, [True, False])
+
+        # Should read both values from the cache this time
+        self.assertTrue(instance.has_user('malini'))
+        self.assertFalse(instance.has_user('kgriffs'))
+        self.assertEqual(ttls, [True, False])
+
+    def test_cached_disabled(self):
+
+        class TestClass(object):
+
+            def __init__(self):
+                self._cache = None
+                self.user_gets = 0
+                self.user_dels = 0
+
+            @decorators.caches(lambda x: x, 60)
+            def get_user(self, name):
+                self.user_gets += 1
+                return name
+
+            @get_user.purges
+            def del_user(self, name):
+                self.user_dels += 1
+
+        instance = TestClass()
+
+        for i in range(3):
+            self.assertEqual(instance.get_user('malini'), 'malini')
+            self.assertEqual(instance.user_gets, 1 + i)
+
+        instance.del_user('malini')
+        self.assertEqual(instance.user_dels, 1)
@@ -15,13 +15,16 @@
 
 import collections
 import datetime
+import threading
 import time
 import uuid
 
+from bson import objectid
 import mock
 from oslo_utils import timeutils
 from pymongo import cursor
 import pymongo.errors
+import pymongo.read_preferences
 import six
 from testtools import matchers
 
@@ -31,6 +34,7 @@ from zaqar import storage
 from zaqar.storage import errors
 from zaqar.storage import mongodb
 from zaqar.storage.mongodb import controllers
+from zaqar.storage.mongodb import notifications
 from zaqar.storage.mongodb import options
 from zaqar.storage.mongodb import utils
 from zaqar.storage import pooling
@@ -43,7 +47,9 @@ class MongodbSetupMixin(object):
         if isinstance(self.driver, mongodb.DataDriver):
             databases = (self.driver.message_databases +
                          [self.control.queues_database,
-                          self.driver.subscriptions_database])
+                          self.driver.subscriptions_database,
+                          self.driver.partitions_database,
+                          self.driver.notifications_database])
         else:
             databases = [self.driver.queues_database]
 
@@ -91,6 +97,19 @@ class MongodbUtilsTest(MongodbSetupMixin, testing.TestBase):
         self.assertEqual(utils.descope_queue_name('radiant/some-pig'),
                          'some-pig')
 
+    def test_observer_read_options(self):
+        self.assertEqual(utils.observer_read_options(self.mongodb_conf), {})
+
+        self.config(options.MESSAGE_MONGODB_GROUP,
+                    observer_read_preference='secondary_preferred',
+                    observer_acceptable_latency_ms=20)
+
+        preference = pymongo.read_preferences.ReadPreference
+        self.assertEqual(utils.observer_read_options(self.mongodb_conf), {
+            'read_preference': preference.SECONDARY_PREFERRED,
+            'secondary_acceptable_latency_ms': 20,
+        })
+
     def test_calculate_backoff(self):
         sec = utils.calculate_backoff(0, 10, 2, 0)
         self.assertEqual(sec, 0)
@@ -117,6 +136,86 @@ class MongodbUtilsTest(MongodbSetupMixin, testing.TestBase):
         self.assertRaises(ValueError, utils.calculate_backoff, 10, 10, 2, 0)
         self.assertRaises(ValueError, utils.calculate_backoff, 11, 10, 2, 0)
 
+    def test_connection_options(self):
+        self.assertEqual(utils.connection_options(self.mongodb_conf), {})
+
+        self.config(options.MESSAGE_MONGODB_GROUP,
+                    max_pool_size=200, wait_queue_timeout_ms=500,
+                    socket_timeout_ms=1000, write_concern='majority',
+                    write_timeout_ms=2000)
+
+        self.assertEqual(utils.connection_options(self.mongodb_conf), {
+            'max_pool_size': 200,
+            'waitQueueTimeoutMS': 500,
+            'socketTimeoutMS': 1000,
+            'w': 'majority',
+            'wtimeout': 2000,
+        })
+
+        self.assertEqual(utils.write_concern('2'), 2)
+        self.assertEqual(utils.write_concern('dc1'), 'dc1')
+
+    def test_operation_write_concern(self):
+        default = {'w': 'majority', 'j': False}
+
+        self.assertEqual(
+            utils.operation_write_concern(default, None, None), {})
+        self.assertEqual(
+            utils.operation_write_concern(default, '2', None),
+            {'w': 2, 'j': False})
+        self.assertEqual(
+            utils.operation_write_concern(default, None, 500),
+            {'w': 'majority', 'j': False, 'wtimeout': 500})
+
+    def test_raises_conn_error_counts_operations(self):
+        stats = utils.PoolStats()
+        in_flight = []
+
+        @utils.raises_conn_error
+        def _nested():
+            in_flight.append(stats.in_flight)
+
+        @utils.raises_conn_error
+        def _operation():
+            _nested()
+
+        @utils.raises_conn_error
+        def _raises_conn_failure():
+            raise pymongo.errors.ConnectionFailure()
+
+        with mock.patch.object(utils, 'POOL_STATS', stats):
+            _operation()
+            self.assertRaises(storage.errors.ConnectionError,
+                              _raises_conn_failure)
+
+        self.assertEqual(in_flight, [1])
+        self.assertEqual(stats.snapshot(), {
+            'operations_in_flight': 0,
+            'peak_operations_in_flight': 1,
+            'operations': 2,
+            'connection_errors': 1,
+        })
+
+    def test_partition_ring(self):
+        ring = utils.PartitionRing(4)
+        queues = ['queue-{0}'.format(i) for i in range(1000)]
+
+        partitions = [ring.get_partition(q, 'project') for q in queues]
+        self.assertEqual(partitions,
+                         [utils.PartitionRing(4).get_partition(q, 'project')
+                          for q in queues])
+        self.assertEqual(set(partitions), set(range(4)))
+
+        # NOTE: Adding a partition should only move the queues that
+        # now belong to it.
+        grown = utils.PartitionRing(5)
+        moved = [q for q, p in zip(queues, partitions)
+                 if grown.get_partition(q, 'project') != p]
+
+        self.assertLess(len(moved), len(queues) // 3)
+        for queue in moved:
+            self.assertEqual(grown.get_partition(queue, 'project'), 4)
+
     def test_retries_on_autoreconnect(self):
         num_calls = [0]
 
@@ -240,6 +339,16 @@ class MongodbDriverTest(MongodbSetupMixin, testing.TestBase):
             self.assertEqual(wc['w'], 'majority')
             self.assertEqual(wc['j'], False)
 
+    def test_unacknowledged_posts_are_refused(self):
+        cache = oslo_cache.get_cache()
+        self.config(options.MESSAGE_MONGODB_GROUP, post_write_concern='0')
+
+        with mock.patch('pymongo.MongoClient.is_mongos') as is_mongos:
+            is_mongos.__get__ = mock.Mock(return_value=True)
+            self.assertRaises(RuntimeError, mongodb.DataDriver,
+                              self.conf, cache,
+                              mongodb.ControlDriver(self.conf, cache))
+
 
 @testing.requires_mongodb
 class MongodbQueueTests(MongodbSetupMixin, base.QueueControllerTest):
@@ -281,10 +390,90 @@ class MongodbMessageTests(MongodbSetupMixin, base.MessageControllerTest):
     def test_indexes(self):
         for collection in self.controller._collections:
             indexes = collection.index_information()
-            self.assertIn('active', indexes)
+            self.assertIn('active_v2', indexes)
             self.assertIn('claimed', indexes)
             self.assertIn('queue_marker', indexes)
-            self.assertIn('counting', indexes)
+            self.assertIn('counting_v2', indexes)
+
+    def test_pop_batch(self):
+        messages = [{'ttl': 60, 'body': {'n': i}} for i in range(5)]
+        self.controller.post(self.queue_name, messages, 'uuid',
+                             project=self.project)
+
+        popped = self.controller.pop(self.queue_name, limit=3,
+                                     project=self.project)
+
+        self.assertEqual([m['body']['n'] for m in popped], [0, 1, 2])
+        for message in popped:
+            self.assertIsNone(message['claim_id'])
+
+        interaction = self.controller.list(self.queue_name, echo=True,
+                                           project=self.project,
+                                           include_claimed=True)
+        remaining = [m['body']['n'] for m in next(interaction)]
+        self.assertEqual(remaining, [3, 4])
+
+    def test_move_between_partitions(self):
+        self.controller.post(self.queue_name, [{'ttl': 60}] * 3, 'uuid',
+                             project=self.project)
+
+        source = self.controller._partition(self.queue_name, self.project)
+        target = (source + 1) % len(self.controller._collections)
+
+        with mock.patch('time.sleep'):
+            copied = self.controller._move(self.queue_name, self.project,
+                                           target)
+
+        self.assertEqual(copied, 3)
+        self.assertEqual(
+            self.controller._partition(self.queue_name, self.project),
+            target)
+        self.assertEqual(
+            self.controller._collections[source].find().count(), 0)
+
+        interaction = self.controller.list(self.queue_name, echo=True,
+                                           project=self.project)
+        self.assertEqual(len(list(next(interaction))), 3)
+
+        self.assertIsNone(self.controller._move(self.queue_name,
+                                                self.project, target))
+
+    def test_move_does_not_restore_deleted_messages(self):
+        ids = self.controller.post(self.queue_name, [{'ttl': 60}] * 3,
+                                   'uuid', project=self.project)
+
+        source = self.controller._partition(self.queue_name, self.project)
+        target = (source + 1) % len(self.controller._collections)
+
+        # NOTE: Delete a message from the target partition, and post
+        # another one to the source partition, while waiting for the
+        # cached mappings to expire.
+        def wait(seconds):
+            self.controller.delete(self.queue_name, ids[0],
+                                   project=self.project)
+            self.controller._collections[source].insert({
+                'p_q': utils.scope_queue_name(self.queue_name,
+                                              self.project),
+                't': 60,
+                'e': timeutils.utcnow() + datetime.timedelta(seconds=60),
+                'u': 'uuid',
+                'c': {'id': None, 'e': timeutils.utcnow_ts()},
+                'b': {},
+                'k': 100,
+                'tx': None,
+            })
+
+        with mock.patch('time.sleep', side_effect=wait):
+            copied = self.controller._move(self.queue_name, self.project,
+                                           target)
+
+        self.assertEqual(copied, 4)
+
+        interaction = self.controller.list(self.queue_name, echo=True,
+                                           project=self.project)
+        listed = [m['id'] for m in next(interaction)]
+        self.assertEqual(len(listed), 3)
+        self.assertNotIn(ids[0], listed)
 
     def test_message_counter(self):
         queue_name = self.queue_name
@@ -339,6 +528,7 @@ class MongodbMessageTests(MongodbSetupMixin, base.MessageControllerTest):
         self.assertIsNone(unchanged)
 
         timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
         timeutils.advance_time_delta(datetime.timedelta(seconds=10))
 
         changed = self.queue_controller._inc_counter(queue_name,
@@ -346,8 +536,6 @@ class MongodbMessageTests(MongodbSetupMixin, base.MessageControllerTest):
                                                      window=5)
         self.assertEqual(changed, reference_value + 1)
 
-        timeutils.clear_time_override()
-
 
 @testing.requires_mongodb
 class MongodbFIFOMessageTests(MongodbSetupMixin, base.MessageControllerTest):
@@ -360,72 +548,231 @@ class MongodbFIFOMessageTests(MongodbSetupMixin, base.MessageControllerTest):
     # NOTE(kgriffs): MongoDB's TTL scavenger only runs once a minute
     gc_interval = 60
 
-    def test_race_condition_on_post(self):
-        queue_name = self.queue_name
-
-        expected_messages = [
-            {
-                'ttl': 60,
-                'body': {
-                    'event': 'BackupStarted',
-                    'backupId': 'c378813c-3f0b-11e2-ad92-7823d2b0f3ce',
-                },
-            },
+    def _contended(self):
+        # NOTE: Simulate another producer taking markers at the same
+        # time, so that posts have to go through a pending transaction.
+        return mock.patch.object(controllers.FIFOMessageController,
+                                 '_post_uncontended', autospec=True,
+                                 return_value=None)
+
+    def _post_pending(self, messages, uuid):
+        # NOTE: Patch _finalize so it is a noop, leaving the messages
+        # pending. This simulates what happens when a producer has
+        # reserved its markers and inserted its messages, but is
+        # slower to finalize them than a competing producer.
+        with self._contended():
+            with mock.patch.object(controllers.FIFOMessageController,
+                                   '_finalize', autospec=True) as method:
+
+                method.return_value = True
+                return self.controller.post(self.queue_name, messages,
+                                            uuid, project=self.project)
+
+    def _list_ids(self, uuid):
+        interaction = self.controller.list(self.queue_name,
+                                           client_uuid=uuid, echo=True,
+                                           project=self.project)
+
+        return [m['body']['backupId'] for m in next(interaction)]
+
+    def _messages(self, count):
+        backup_ids = ('c378813c-3f0b-11e2-ad92-7823d2b0f3ce',
+                      'd378813c-3f0b-11e2-ad92-7823d2b0f3ce',
+                      'e378813c-3f0b-11e2-ad92-7823d2b0f3ce')
+
+        return [
             {
                 'ttl': 60,
                 'body': {
                     'event': 'BackupStarted',
-                    'backupId': 'd378813c-3f0b-11e2-ad92-7823d2b0f3ce',
+                    'backupId': backup_id,
                 },
-            },
-            {
-                'ttl': 60,
-                'body': {
-                    'event': 'BackupStarted',
-                    'backupId': 'e378813c-3f0b-11e2-ad92-7823d2b0f3ce',
-                },
-            },
+            }
+            for backup_id in backup_ids[:count]
         ]
 
+    def test_pending_post_holds_up_listing(self):
+        expected_messages = self._messages(3)
+        uuid = '97b64000-2526-11e3-b088-d85c1300734c'
+
+        self._post_pending(expected_messages[:1], uuid)
+        created = self.controller.post(self.queue_name,
+                                       expected_messages[1:],
+                                       uuid, project=self.project)
+        self.assertEqual(len(created), 2)
+
+        # NOTE: The later messages must not be listed before the
+        # pending one, or an observer could page right past it.
+        self.assertEqual(self._list_ids(uuid), [])
+
+        for collection in self.controller._collections:
+            collection.update({'tx': {'$ne': None}},
+                              {'$set': {'tx': None}},
+                              upsert=False, multi=True)
+
+        for reservations in self.controller._reservations:
+            reservations.remove()
+
+        expected_ids = [m['body']['backupId'] for m in expected_messages]
+        self.assertEqual(self._list_ids(uuid), expected_ids)
+
+    def test_stalled_post_is_collected(self):
+        expected_messages = self._messages(2)
         uuid = '97b64000-2526-11e3-b088-d85c1300734c'
 
-        # NOTE(kgriffs): Patch _inc_counter so it is a noop, so that
-        # the second time we post, we will get a collision. This simulates
-        # what happens when we have parallel requests and the "winning"
-        # requests hasn't gotten around to calling _inc_counter before the
-        # "losing" request attempts to insert it's batch of messages.
-        with mock.patch.object(mongodb.queues.QueueController,
-                               '_inc_counter', autospec=True) as method:
-
-            method.return_value = 2
-            messages = expected_messages[:1]
-            created = list(self.controller.post(queue_name, messages,
-                                                uuid, project=self.project))
-            self.assertEqual(len(created), 1)
-
-            # Force infinite retries
-            method.return_value = None
-
-            with testing.expect(errors.MessageConflict):
-                self.controller.post(queue_name, messages,
+        self._post_pending(expected_messages[:1], uuid)
+        self.controller.post(self.queue_name, expected_messages[1:],
+                             uuid, project=self.project)
+
+        # NOTE: Listings are held up until the stalled post is
+        # collected, since they never write.
+        self.assertEqual(self._list_ids(uuid), [])
+
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        timeutils.advance_time_delta(datetime.timedelta(
+            seconds=mongodb.messages.COUNTER_STALL_WINDOW + 1))
+
+        # NOTE: The pending message is assumed to have been abandoned
+        # by a crashed producer, so it is skipped for good.
+        self.controller.gc()
+        self.assertEqual(self._list_ids(uuid),
+                         [expected_messages[1]['body']['backupId']])
+
+    def test_stalled_uncontended_post_is_collected(self):
+        expected_messages = self._messages(1)
+        uuid = '97b64000-2526-11e3-b088-d85c1300734c'
+        queue_ctrl = self.controller._queue_ctrl
+
+        # NOTE: Simulate a producer that took its markers without
+        # contention, and then stalled before inserting anything.
+        stalled = objectid.ObjectId.from_datetime(
+            timeutils.utcnow() - datetime.timedelta(
+                seconds=mongodb.messages.COUNTER_STALL_WINDOW + 1))
+
+        counter = queue_ctrl._get_counter(self.queue_name, self.project)
+        self.assertTrue(queue_ctrl._reserve_counter(
+            self.queue_name, self.project, counter, 1, stalled))
+
+        self.controller.post(self.queue_name, expected_messages,
+                             uuid, project=self.project)
+        self.assertEqual(self._list_ids(uuid), [])
+
+        self.controller.gc()
+        self.assertEqual(self._list_ids(uuid),
+                         [expected_messages[0]['body']['backupId']])
+
+        # NOTE: The stalled producer can no longer use its marker
+        collection = self.controller._collection(self.queue_name,
+                                                 self.project)
+        self.assertRaises(pymongo.errors.DuplicateKeyError,
+                          collection.insert,
+                          {'p_q': utils.scope_queue_name(self.queue_name,
+                                                         self.project),
+                           'k': counter, 'tx': None})
+
+    def test_uncontended_post_holds_up_listing(self):
+        expected_messages = self._messages(3)
+        uuid = '97b64000-2526-11e3-b088-d85c1300734c'
+        queue_ctrl = self.controller._queue_ctrl
+        reserve_counter = queue_ctrl._reserve_counter
+        listed = []
+
+        # NOTE: The second producer posts its messages after the
+        # first one has taken its markers, but before it has
+        # inserted anything.
+        def reserve(*args, **kwargs):
+            reserved = reserve_counter(*args, **kwargs)
+            if not listed:
+                listed.append(None)
+                self.controller.post(self.queue_name,
+                                     expected_messages[1:],
                                      uuid, project=self.project)
+                listed.append(self._list_ids(uuid))
 
-        created = list(self.controller.post(queue_name,
-                                            expected_messages[1:],
-                                            uuid, project=self.project))
+            return reserved
 
-        self.assertEqual(len(created), 2)
+        with mock.patch.object(queue_ctrl, '_reserve_counter',
+                               side_effect=reserve):
+            self.controller.post(self.queue_name, expected_messages[:1],
+                                 uuid, project=self.project)
+
+        self.assertEqual(listed[1], [])
+
+        expected_ids = [m['body']['backupId'] for m in expected_messages]
+        self.assertEqual(self._list_ids(uuid), expected_ids)
+
+    def test_reserved_markers_hold_up_listing(self):
+        expected_messages = self._messages(3)
+        uuid = '97b64000-2526-11e3-b088-d85c1300734c'
+        queue_ctrl = self.controller._queue_ctrl
+        inc_counter = queue_ctrl._inc_counter
+        listed = []
+
+        # NOTE: The second producer reserves, inserts and finalizes
+        # its messages after the first one has reserved its markers,
+        # but before it has inserted anything.
+        def reserve(*args, **kwargs):
+            value = inc_counter(*args, **kwargs)
+            if not listed:
+                listed.append(None)
+                self.controller.post(self.queue_name,
+                                     expected_messages[1:],
+                                     uuid, project=self.project)
+                listed.append(self._list_ids(uuid))
+
+            return value
+
+        with self._contended():
+            with mock.patch.object(queue_ctrl, '_inc_counter',
+                                   side_effect=reserve):
+                self.controller.post(self.queue_name,
+                                     expected_messages[:1],
+                                     uuid, project=self.project)
+
+        self.assertEqual(listed[1], [])
 
         expected_ids = [m['body']['backupId'] for m in expected_messages]
+        self.assertEqual(self._list_ids(uuid), expected_ids)
 
-        interaction = self.controller.list(queue_name, client_uuid=uuid,
-                                           echo=True, project=self.project)
+    def test_stalled_finalize_is_not_listed(self):
+        expected_messages = self._messages(2)
+        uuid = '97b64000-2526-11e3-b088-d85c1300734c'
+        finalize = controllers.FIFOMessageController._finalize
+        collected = []
+
+        # NOTE: The first transaction is collected just before its
+        # producer tries to commit it.
+        def stall(controller, collection, reservations, transaction):
+            if not collected:
+                timeutils.set_time_override()
+                self.addCleanup(timeutils.clear_time_override)
+                timeutils.advance_time_delta(datetime.timedelta(
+                    seconds=mongodb.messages.COUNTER_STALL_WINDOW + 1))
+
+                self.controller.gc()
+                collected.append(self._list_ids(uuid))
+                timeutils.clear_time_override()
+
+            return finalize(controller, collection, reservations,
+                            transaction)
+
+        with self._contended():
+            with mock.patch.object(controllers.FIFOMessageController,
+                                   '_finalize', autospec=True,
+                                   side_effect=stall):
+                self.controller.post(self.queue_name,
+                                     expected_messages[:1],
+                                     uuid, project=self.project)
 
-        actual_messages = list(next(interaction))
-        self.assertEqual(len(actual_messages), len(expected_messages))
-        actual_ids = [m['body']['backupId'] for m in actual_messages]
+        self.controller.post(self.queue_name, expected_messages[1:],
+                             uuid, project=self.project)
 
-        self.assertEqual(actual_ids, expected_ids)
+        # NOTE: The abandoned messages were posted again, with new
+        # markers, rather than being finalized after the collection.
+        self.assertEqual(collected[0], [])
+        expected_ids = [m['body']['backupId'] for m in expected_messages]
+        self.assertEqual(self._list_ids(uuid), expected_ids)
 
 
 @testing.requires_mongodb
@@ -436,6 +783,73 @@ class MongodbClaimTests(MongodbSetupMixin, base.ClaimControllerTest):
     controller_class = controllers.ClaimController
     control_driver_class = mongodb.ControlDriver
 
+    def test_wait_only_counts_queries_in_flight(self):
+        stats = utils.PoolStats()
+        in_flight = []
+
+        def wait(queue, timeout, ready, project=None):
+            in_flight.append(stats.in_flight)
+            return ready()
+
+        notifications = mock.Mock()
+        notifications.wait.side_effect = wait
+
+        with mock.patch.object(utils, 'POOL_STATS', stats):
+            with mock.patch.object(self.driver, 'notifications',
+                                   notifications):
+                self.assertFalse(self.controller.wait(
+                    self.queue_name, 1, project=self.project))
+
+        self.assertEqual(in_flight, [0])
+        self.assertEqual(stats.snapshot()['peak_operations_in_flight'], 1)
+
+    def test_create_does_not_requery(self):
+        self.message_controller.post(self.queue_name,
+                                     [{'ttl': 60, 'body': {'n': i}}
+                                      for i in range(3)],
+                                     'uuid', project=self.project)
+
+        with mock.patch.object(controllers.ClaimController, 'get',
+                               autospec=True) as method:
+            claim_id, messages = self.controller.create(
+                self.queue_name, {'ttl': 120, 'grace': 30},
+                project=self.project)
+
+            messages = list(messages)
+            self.assertFalse(method.called)
+
+        self.assertEqual([m['body']['n'] for m in messages], [0, 1, 2])
+        for message in messages:
+            self.assertEqual(message['claim_id'], claim_id)
+            self.assertEqual(message['ttl'], 150)
+
+        _, claimed = self.controller.get(self.queue_name, claim_id,
+                                         project=self.project)
+        self.assertEqual([m['ttl'] for m in claimed], [150] * 3)
+
+    def test_wait_is_notified(self):
+        engine = notifications.NotificationEngine(
+            self.driver.notifications_database, 4096)
+
+        def post():
+            time.sleep(0.5)
+            self.message_controller.post(self.queue_name, [{'ttl': 60}],
+                                         'uuid', project=self.project)
+
+        with mock.patch.object(mongodb.DataDriver, 'notifications', engine):
+            self.assertFalse(self.controller.wait(self.queue_name, 0.1,
+                                                  project=self.project))
+
+            thread = threading.Thread(target=post)
+            thread.start()
+
+            start = time.time()
+            self.assertTrue(self.controller.wait(self.queue_name, 10,
+                                                 project=self.project))
+            self.assertLess(time.time() - start, 5)
+
+            thread.join()
+
     def test_claim_doesnt_exist(self):
         """Verifies that operations fail on expired/missing claims.
 
@@ -13,6 +13,8 @@
 # limitations under the License.
 
 import collections
+import datetime
+import threading
 import time
 import uuid
 
@@ -58,6 +60,18 @@ def _create_sample_message(now=None, claimed=False, body=None):
     )
 
 
+class _HashTaggedDataDriver(driver.DataDriver):
+    """Uses the cluster key layout with a single Redis server."""
+
+    # NOTE: The builtin pipeline stages are looked up by the
+    # module of the driver class.
+    __module__ = driver.DataDriver.__module__
+
+    def __init__(self, *args, **kwargs):
+        super(_HashTaggedDataDriver, self).__init__(*args, **kwargs)
+        self.hash_tag_keys = True
+
+
 class RedisUtilsTest(testing.TestBase):
 
     config_file = 'wsgi_redis.conf'
@@ -106,6 +120,14 @@ class RedisUtilsTest(testing.TestBase):
         key = utils.scope_message_ids_set()
         self.assertEqual(utils.descope_message_ids_set(key), (None, None))
 
+        key = (utils.queue_hash_tag('my-q', '123') +
+               utils.scope_message_ids_set('my-q', '123'))
+        self.assertEqual(utils.descope_message_ids_set(key), ('my-q', '123'))
+
+    def test_queue_hash_tag(self):
+        self.assertEqual(utils.queue_hash_tag('my-q'), '{.my-q}')
+        self.assertEqual(utils.queue_hash_tag('my-q', '123'), '{123.my-q}')
+
     def test_normalize_none_str(self):
 
         self.assertEqual(utils.normalize_none_str('my-q'), 'my-q')
@@ -154,6 +176,27 @@ class RedisUtilsTest(testing.TestBase):
         self.assertEqual(basic_msg['body'], body)
         self.assertEqual(basic_msg['ttl'], msg.ttl)
 
+    def test_compact_message(self):
+        now = timeutils.utcnow_ts()
+        body = {'event': 'BackupStarted', 'data': 'x' * 1024}
+        msg = _create_sample_message(now=now, body=body)
+
+        for threshold in (0, 64):
+            hmap = msg.to_hmap(compact=True, compression_threshold=threshold)
+            self.assertEqual(sorted(hmap), ['c', 'c.e', 'e', 'p', 't'])
+
+            # NOTE: Simulate the binary keys returned by redis-py
+            hmap = dict((k.encode(), v) for k, v in hmap.items())
+            basic_msg = messages.Message.from_hmap(hmap).to_basic(now + 5)
+
+            self.assertEqual(basic_msg['id'], msg.id)
+            self.assertEqual(basic_msg['age'], 5)
+            self.assertEqual(basic_msg['body'], body)
+
+        compressed = msg.to_hmap(compact=True, compression_threshold=64)
+        uncompressed = msg.to_hmap(compact=True)
+        self.assertTrue(len(compressed['p']) < len(uncompressed['p']))
+
     def test_retries_on_connection_error(self):
         num_calls = [0]
 
@@ -279,6 +322,23 @@ class RedisDriverTest(testing.TestBase):
         self.assertEqual(uri.master, 'dumbledore')
         self.assertEqual(uri.socket_timeout, 0.5)
 
+    def test_connection_uri_cluster(self):
+        uri = driver.ConnectionURI('redis://n1?cluster=true')
+        self.assertEqual(uri.strategy, driver.STRATEGY_CLUSTER)
+        self.assertEqual(uri.startup_nodes, [{'host': 'n1', 'port': 6379}])
+        self.assertEqual(uri.socket_timeout, 0.1)
+
+        uri = driver.ConnectionURI(
+            'redis://n1:7000,n2:7001?cluster=true&socket_timeout=0.5')
+        self.assertEqual(uri.strategy, driver.STRATEGY_CLUSTER)
+        self.assertEqual(uri.startup_nodes, [{'host': 'n1', 'port': 7000},
+                                             {'host': 'n2', 'port': 7001}])
+        self.assertEqual(uri.socket_timeout, 0.5)
+
+        self.assertRaises(errors.ConfigurationError,
+                          driver.ConnectionURI,
+                          'redis://n1:not_an_integer?cluster=true')
+
 
 @testing.requires_redis
 class RedisQueuesTest(base.QueueControllerTest):
@@ -297,6 +357,26 @@ class RedisQueuesTest(base.QueueControllerTest):
         super(RedisQueuesTest, self).tearDown()
         self.connection.flushdb()
 
+    def test_cached_queue_lookups(self):
+        self.config(options.MESSAGE_REDIS_GROUP, cache_queue_lookups=True)
+        cached_controller = controllers.QueueController(self.driver)
+
+        self.assertFalse(cached_controller.exists('cached'))
+
+        # NOTE: Creating the queue purges the negative lookup
+        cached_controller.create('cached')
+        self.assertTrue(cached_controller.exists('cached'))
+
+        # NOTE: Deleting the queue through another controller
+        # does not purge the cache.
+        self.controller.delete('cached')
+        self.assertTrue(cached_controller.exists('cached'))
+        self.assertFalse(self.controller.exists('cached'))
+
+        cached_controller.create('cached')
+        cached_controller.delete('cached')
+        self.assertFalse(cached_controller.exists('cached'))
+
 
 @testing.requires_redis
 class RedisMessagesTest(base.MessageControllerTest):
@@ -329,6 +409,63 @@ class RedisMessagesTest(base.MessageControllerTest):
         num_msg = self.controller._count(queue_name, None)
         self.assertEqual(num_msg, 10)
 
+    def test_compact_message_encoding(self):
+        queue_name = 'compact-encoding'
+        self.queue_controller.create(queue_name)
+
+        # NOTE: Messages stored with either encoding can be read
+        legacy_ids = self.controller.post(
+            queue_name, [{'ttl': 300, 'body': {'n': 0}}], str(uuid.uuid4()))
+
+        self.config(options.MESSAGE_REDIS_GROUP, message_encoding='compact',
+                    compression_threshold=64)
+        compact_controller = controllers.MessageController(self.driver)
+
+        bodies = [{'n': 1}, {'n': 2, 'data': 'x' * 1024}]
+        compact_ids = compact_controller.post(
+            queue_name, [{'ttl': 300, 'body': b} for b in bodies],
+            str(uuid.uuid4()))
+
+        for mid in compact_ids:
+            self.assertFalse(self.connection.hexists(mid, 'b'))
+            self.assertTrue(self.connection.hexists(mid, 'p'))
+
+        message_ids = legacy_ids + compact_ids
+        msgs = list(next(compact_controller.list(queue_name)))
+        self.assertEqual([m['id'] for m in msgs], message_ids)
+        self.assertEqual([m['body'] for m in msgs], [{'n': 0}] + bodies)
+
+        msg = compact_controller.get(queue_name, compact_ids[1])
+        self.assertEqual(msg['body'], bodies[1])
+
+        claim_id, claimed = self.claim_controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=2)
+        self.assertEqual([m['body'] for m in claimed], [{'n': 0}, bodies[0]])
+
+        popped = compact_controller.pop(queue_name, 10)
+        self.assertEqual([m['body'] for m in popped], [bodies[1]])
+
+    def test_post_writes_and_indexes_messages(self):
+        queue_name = 'post-indexing'
+        self.queue_controller.create(queue_name)
+
+        msgs = [{'ttl': 300, 'body': {'n': i}} for i in range(3)]
+        message_ids = self.controller.post(queue_name, msgs,
+                                           str(uuid.uuid4()))
+
+        msgset_key = utils.msgset_key(queue_name)
+        self.assertEqual(self.connection.zrange(msgset_key, 0, -1),
+                         [mid.encode() for mid in message_ids])
+        self.assertEqual(self.connection.zcard(utils.active_key(queue_name)),
+                         3)
+
+        for mid in message_ids:
+            self.assertTrue(0 < self.connection.ttl(mid) <= 300)
+
+        messages = self.controller.bulk_get(queue_name, message_ids)
+        self.assertEqual(sorted(m['body']['n'] for m in messages),
+                         [0, 1, 2])
+
     def test_empty_queue_exception(self):
         queue_name = 'empty-queue-test'
         self.queue_controller.create(queue_name)
@@ -353,6 +490,101 @@ class RedisMessagesTest(base.MessageControllerTest):
         num_removed = self.controller.gc()
         self.assertEqual(num_removed, 100)
 
+    def test_gc_respects_work_budget(self):
+        self.config(options.MESSAGE_REDIS_GROUP, gc_work_budget=30)
+
+        self.queue_controller.create(self.queue_name)
+        self.controller.post(self.queue_name,
+                             [{'ttl': 0, 'body': {}}] * 100,
+                             client_uuid=str(uuid.uuid4()))
+
+        for expected in (30, 30, 30, 10, 0):
+            num_removed = self.controller.gc()
+            self.assertEqual(num_removed, expected)
+
+        metrics = self.connection.hgetall(messages.GC_METRICS_KEY)
+        self.assertEqual(int(metrics[b'messages_removed']), 0)
+        self.assertEqual(self.controller._count(self.queue_name, None), 0)
+
+    def test_gc_only_releases_its_own_lock(self):
+        gc = self.controller._gc
+
+        # NOTE: Simulate the lock expiring during the run, and being
+        # taken by another one.
+        def expire_lock(*args):
+            self.connection.set(messages.GC_LOCK_KEY, 'other')
+            return gc(*args)
+
+        with mock.patch.object(self.controller, '_gc',
+                               side_effect=expire_lock):
+            self.controller.gc()
+
+        self.assertEqual(self.connection.get(messages.GC_LOCK_KEY),
+                         b'other')
+
+        self.connection.delete(messages.GC_LOCK_KEY)
+        self.controller.gc()
+        self.assertIsNone(self.connection.get(messages.GC_LOCK_KEY))
+
+    def test_gc_reschedules_extended_messages(self):
+        self.queue_controller.create(self.queue_name)
+        msg_id = self.controller.post(self.queue_name,
+                                      [{'ttl': 60, 'body': {}}],
+                                      client_uuid=str(uuid.uuid4()))[0]
+
+        # NOTE: Simulate a claim extending the message's lifetime
+        expires = timeutils.utcnow_ts() + 3600
+        self.connection.hset(msg_id, 'e', expires)
+
+        future = timeutils.utcnow() + datetime.timedelta(seconds=61)
+        timeutils.set_time_override(future)
+        self.addCleanup(timeutils.clear_time_override)
+
+        num_removed = self.controller.gc()
+        self.assertEqual(num_removed, 0)
+
+        expires_key = utils.expires_key(self.queue_name)
+        self.assertEqual(self.connection.zscore(expires_key, msg_id),
+                         expires)
+        self.assertEqual(self.controller._count(self.queue_name, None), 1)
+
+    def test_gc_migrates_legacy_msgsets(self):
+        self.queue_controller.create(self.queue_name)
+        self.controller.post(self.queue_name,
+                             [{'ttl': 300, 'body': {}}] * 3,
+                             client_uuid=str(uuid.uuid4()))
+
+        # NOTE: Simulate a msgset created by an older
+        # version of the driver.
+        msgset_key = utils.msgset_key(self.queue_name)
+        expires_key = utils.expires_key(self.queue_name)
+        self.connection.delete(expires_key)
+        self.connection.zrem(messages.MSGSET_GC_INDEX_KEY, msgset_key)
+        self.connection.zadd(messages.MSGSET_INDEX_KEY, 2, msgset_key)
+        self.controller._migrated_msgsets.clear()
+
+        self.controller.gc()
+
+        self.assertEqual(self.connection.zcard(expires_key), 3)
+        version = self.connection.zscore(messages.MSGSET_INDEX_KEY,
+                                         msgset_key)
+        self.assertEqual(version, messages.MSGSET_FORMAT_VERSION)
+        self.assertIsNotNone(
+            self.connection.zscore(messages.MSGSET_GC_INDEX_KEY,
+                                   msgset_key))
+
+    def test_migrated_msgsets_are_bounded(self):
+        self.controller._migrated_msgsets.clear()
+
+        with mock.patch.object(messages, 'MIGRATED_MSGSETS_CACHE_SIZE', 2):
+            for name in ('alpha', 'beta', 'gamma'):
+                self.queue_controller.create(name)
+                self.controller._ensure_migrated(name, None)
+
+        self.assertEqual(list(self.controller._migrated_msgsets),
+                         [utils.msgset_key('beta'),
+                          utils.msgset_key('gamma')])
+
 
 @testing.requires_redis
 class RedisClaimsTest(base.ClaimControllerTest):
@@ -385,7 +617,7 @@ class RedisClaimsTest(base.ClaimControllerTest):
         time.sleep(1)
         self.assertRaises(storage.errors.ClaimDoesNotExist,
                           self.controller.update, queue_name,
-                          claim_id, {}, project=None)
+                          claim_id, {'ttl': 1, 'grace': 0}, project=None)
 
     def test_gc(self):
         self.queue_controller.create(self.queue_name)
@@ -421,6 +653,304 @@ class RedisClaimsTest(base.ClaimControllerTest):
         num_removed = self.controller._gc(self.queue_name, None)
         self.assertEqual(num_removed, 5)
 
+    def test_claimed_messages_leave_active_set(self):
+        for _ in range(10):
+            self.message_controller.post(self.queue_name,
+                                         [{'ttl': 300, 'body': 'yo gabba'}],
+                                         client_uuid=str(uuid.uuid4()),
+                                         project=self.project)
+
+        active_key = utils.active_key(self.queue_name, self.project)
+        claimed_key = utils.claimed_key(self.queue_name, self.project)
+
+        claim_id, claimed = self.controller.create(
+            self.queue_name, {'ttl': 60, 'grace': 60},
+            project=self.project, limit=4)
+
+        self.assertEqual(len(claimed), 4)
+        self.assertEqual(self.connection.zcard(active_key), 6)
+        self.assertEqual(self.connection.zcard(claimed_key), 4)
+
+        self.controller.delete(self.queue_name, claim_id,
+                               project=self.project)
+
+        self.assertEqual(self.connection.zcard(active_key), 10)
+        self.assertEqual(self.connection.zcard(claimed_key), 0)
+
+        # NOTE: Released messages must be claimed again
+        # in their original order.
+        claim_id, claimed2 = self.controller.create(
+            self.queue_name, {'ttl': 60, 'grace': 60},
+            project=self.project, limit=4)
+
+        self.assertEqual([m['id'] for m in claimed],
+                         [m['id'] for m in claimed2])
+
+    def test_wait_times_out(self):
+        queue_name = 'wait-timeout'
+        self.queue_controller.create(queue_name, project=self.project)
+
+        start = time.time()
+        self.assertFalse(self.controller.wait(queue_name, 0.2,
+                                              project=self.project))
+        self.assertTrue(time.time() - start >= 0.2)
+
+    def test_wait_returns_if_messages_are_available(self):
+        self.message_controller.post(
+            self.queue_name, [{'ttl': 300, 'body': {}}],
+            project=self.project, client_uuid=str(uuid.uuid4()))
+
+        self.assertTrue(self.controller.wait(self.queue_name, 5,
+                                             project=self.project))
+
+    def test_wait_is_woken_by_post(self):
+        queue_name = 'wait-post'
+        self.queue_controller.create(queue_name, project=self.project)
+
+        def post():
+            time.sleep(0.2)
+            self.message_controller.post(
+                queue_name, [{'ttl': 300, 'body': {}}],
+                project=self.project, client_uuid=str(uuid.uuid4()))
+
+        poster = threading.Thread(target=post)
+        poster.start()
+        self.addCleanup(poster.join)
+
+        start = time.time()
+        self.assertTrue(self.controller.wait(queue_name, 5,
+                                             project=self.project))
+        self.assertTrue(time.time() - start < 5)
+
+        claim_id, messages = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, project=self.project)
+        self.assertEqual(len(messages), 1)
+
+    def test_renew_extends_message_ttl_only_when_needed(self):
+        [mid] = self.message_controller.post(self.queue_name,
+                                             [{'ttl': 300, 'body': 'yo'}],
+                                             client_uuid=str(uuid.uuid4()),
+                                             project=self.project)
+
+        claim_id, _ = self.controller.create(self.queue_name,
+                                             {'ttl': 60, 'grace': 60},
+                                             project=self.project)
+
+        self.controller.update(self.queue_name, claim_id,
+                               {'ttl': 400, 'grace': 100},
+                               project=self.project)
+
+        self.assertEqual(self.connection.hget(mid, 't'), b'500')
+        self.assertTrue(490 < self.connection.ttl(mid) <= 500)
+        self.assertEqual(self.connection.hget(mid, 'c'), claim_id.encode())
+
+        # NOTE: Shortening the claim must not shorten the lifetime
+        # of the message.
+        self.controller.update(self.queue_name, claim_id,
+                               {'ttl': 30, 'grace': 30},
+                               project=self.project)
+
+        self.assertEqual(self.connection.hget(mid, 't'), b'500')
+        self.assertTrue(490 < self.connection.ttl(mid) <= 500)
+
+        self.controller.delete(self.queue_name, claim_id,
+                               project=self.project)
+
+        self.assertEqual(self.connection.hget(mid, 'c'), b'')
+        self.assertTrue(490 < self.connection.ttl(mid) <= 500)
+
+    def test_bulk_delete_removes_claim_records(self):
+        message_ids = self.message_controller.post(
+            self.queue_name,
+            [{'ttl': 300, 'body': 'yo gabba'} for _ in range(5)],
+            client_uuid=str(uuid.uuid4()), project=self.project)
+
+        claim_id, claimed = self.controller.create(
+            self.queue_name, {'ttl': 60, 'grace': 60},
+            project=self.project, limit=3)
+
+        msg_ctrl = self.driver.message_controller
+        claimed_ids = [msg['id'] for msg in claimed]
+
+        # NOTE: Only the messages owned by the claim may be deleted
+        # when a claim ID is given.
+        failed = msg_ctrl._delete_messages(self.queue_name, self.project,
+                                           message_ids, claim_id=claim_id)
+        self.assertEqual(sorted(failed),
+                         sorted(set(message_ids) - set(claimed_ids)))
+
+        self.message_controller.bulk_delete(self.queue_name, message_ids,
+                                            project=self.project)
+
+        for key in (utils.msgset_key(self.queue_name, self.project),
+                    utils.active_key(self.queue_name, self.project),
+                    utils.claimed_key(self.queue_name, self.project),
+                    self.controller._claim_msgs_key(claim_id)):
+            self.assertFalse(self.connection.exists(key))
+
+        self.assertEqual(self.connection.hget(claim_id, 'n'), b'0')
+
+    def test_pop_skips_claimed_messages(self):
+        self.message_controller.post(
+            self.queue_name,
+            [{'ttl': 300, 'body': i} for i in range(3)],
+            client_uuid=str(uuid.uuid4()), project=self.project)
+
+        self.controller.create(self.queue_name, {'ttl': 60, 'grace': 60},
+                               project=self.project, limit=1)
+
+        popped = self.message_controller.pop(self.queue_name, 5,
+                                             project=self.project)
+
+        self.assertEqual([msg['body'] for msg in popped], [1, 2])
+        self.assertEqual(self.connection.zcard(
+            utils.msgset_key(self.queue_name, self.project)), 1)
+
+    def test_legacy_msgset_is_migrated(self):
+        for _ in range(5):
+            self.message_controller.post(self.queue_name,
+                                         [{'ttl': 300, 'body': 'yo gabba'}],
+                                         client_uuid=str(uuid.uuid4()),
+                                         project=self.project)
+
+        self.controller.create(self.queue_name, {'ttl': 60, 'grace': 60},
+                               project=self.project, limit=2)
+
+        # NOTE: Simulate a msgset created by an older
+        # version of the driver.
+        msgset_key = utils.msgset_key(self.queue_name, self.project)
+        self.connection.delete(utils.active_key(self.queue_name,
+                                                self.project))
+        self.connection.delete(utils.claimed_key(self.queue_name,
+                                                 self.project))
+        self.connection.zadd(messages.MSGSET_INDEX_KEY, 1, msgset_key)
+        self.driver.message_controller._migrated_msgsets.clear()
+
+        claim_id, claimed = self.controller.create(
+            self.queue_name, {'ttl': 60, 'grace': 60},
+            project=self.project, limit=10)
+
+        self.assertEqual(len(claimed), 3)
+
+        version = self.connection.zscore(messages.MSGSET_INDEX_KEY,
+                                         msgset_key)
+        self.assertEqual(version, messages.MSGSET_FORMAT_VERSION)
+
+    def test_stats_exclude_expired_claims(self):
+        for _ in range(5):
+            self.message_controller.post(self.queue_name,
+                                         [{'ttl': 300, 'body': 'yo gabba'}],
+                                         client_uuid=str(uuid.uuid4()),
+                                         project=self.project)
+
+        self.controller.create(self.queue_name, {'ttl': 60, 'grace': 60},
+                               project=self.project, limit=2)
+
+        stats = self.queue_controller.stats(self.queue_name,
+                                            project=self.project)
+        self.assertEqual(stats['messages']['claimed'], 2)
+        self.assertEqual(stats['messages']['free'], 3)
+        self.assertEqual(stats['messages']['total'], 5)
+
+        future = timeutils.utcnow() + datetime.timedelta(seconds=61)
+        timeutils.set_time_override(future)
+        self.addCleanup(timeutils.clear_time_override)
+
+        stats = self.queue_controller.stats(self.queue_name,
+                                            project=self.project)
+        self.assertEqual(stats['messages']['claimed'], 0)
+        self.assertEqual(stats['messages']['free'], 5)
+
+    def test_reconcile_repairs_claimed_count(self):
+        for _ in range(5):
+            self.message_controller.post(self.queue_name,
+                                         [{'ttl': 300, 'body': 'yo gabba'}],
+                                         client_uuid=str(uuid.uuid4()),
+                                         project=self.project)
+
+        self.controller.create(self.queue_name, {'ttl': 60, 'grace': 60},
+                               project=self.project, limit=2)
+
+        # NOTE: Simulate drift between the message ID sets
+        # and the messages themselves.
+        active_key = utils.active_key(self.queue_name, self.project)
+        claimed_key = utils.claimed_key(self.queue_name, self.project)
+        self.connection.delete(claimed_key)
+        self.connection.zadd(active_key, 100, str(uuid.uuid4()))
+
+        stats = self.queue_controller.stats(self.queue_name,
+                                            project=self.project)
+        self.assertEqual(stats['messages']['claimed'], 0)
+
+        num_removed = self.driver.message_controller.reconcile()
+        self.assertEqual(num_removed, 1)
+
+        stats = self.queue_controller.stats(self.queue_name,
+                                            project=self.project)
+        self.assertEqual(stats['messages']['claimed'], 2)
+        self.assertEqual(stats['messages']['free'], 3)
+        self.assertEqual(self.connection.zcard(active_key), 3)
+
+
+@testing.requires_redis
+class RedisHashTaggedMessagesTest(base.MessageControllerTest):
+    driver_class = _HashTaggedDataDriver
+    config_file = 'wsgi_redis.conf'
+    controller_class = controllers.MessageController
+    control_driver_class = mongodb.ControlDriver
+
+    def setUp(self):
+        super(RedisHashTaggedMessagesTest, self).setUp()
+        self.connection = self.driver.connection
+
+    def tearDown(self):
+        super(RedisHashTaggedMessagesTest, self).tearDown()
+        self.connection.flushdb()
+
+    def test_queue_keys_share_hash_tag(self):
+        message_ids = self.controller.post(
+            self.queue_name, [{'ttl': 1, 'body': {}}] * 3,
+            project=self.project, client_uuid=str(uuid.uuid4()))
+
+        tag = utils.queue_hash_tag(self.queue_name, self.project)
+        msgset_key = tag + utils.msgset_key(self.queue_name, self.project)
+        active_key = tag + utils.active_key(self.queue_name, self.project)
+
+        self.assertEqual(self.connection.zcard(msgset_key), 3)
+        self.assertEqual(self.connection.zcard(active_key), 3)
+
+        for mid in message_ids:
+            self.assertTrue(self.connection.exists(tag + mid))
+            self.assertFalse(self.connection.exists(mid))
+
+        # NOTE: The GC index is updated outside of the scripts
+        self.assertIsNotNone(
+            self.connection.zscore(messages.MSGSET_GC_INDEX_KEY,
+                                   msgset_key))
+
+        time.sleep(2)
+        self.assertEqual(self.controller.gc(), 3)
+        self.assertEqual(self.connection.zcard(msgset_key), 0)
+        self.assertIsNone(
+            self.connection.zscore(messages.MSGSET_GC_INDEX_KEY,
+                                   msgset_key))
+
+
+@testing.requires_redis
+class RedisHashTaggedClaimsTest(base.ClaimControllerTest):
+    driver_class = _HashTaggedDataDriver
+    config_file = 'wsgi_redis.conf'
+    controller_class = controllers.ClaimController
+    control_driver_class = mongodb.ControlDriver
+
+    def setUp(self):
+        super(RedisHashTaggedClaimsTest, self).setUp()
+        self.connection = self.driver.connection
+
+    def tearDown(self):
+        super(RedisHashTaggedClaimsTest, self).tearDown()
+        self.connection.flushdb()
+
 
 @testing.requires_redis
 class RedisSubscriptionTests(base.SubscriptionControllerTest):
@@ -0,0 +1,91 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+import testtools
+
+from zaqar.storage import placement
+
+
+def _load(volume, seconds, reachable=True):
+    return {
+        'storage_reachable': reachable,
+        'message_volume': {'total': volume},
+        'seconds': seconds,
+    }
+
+
+class TestBalancedPlacement(testtools.TestCase):
+
+    def setUp(self):
+        super(TestBalancedPlacement, self).setUp()
+
+        self.pools = [{'name': name, 'weight': 100}
+                      for name in ('idle', 'busy', 'down')]
+        self.load = {
+            'idle': _load(0, 0.1),
+            'busy': _load(1000, 0.5),
+            'down': _load(0, 0, reachable=False),
+        }
+
+        catalog = mock.Mock()
+        catalog._pools_ctrl.list.side_effect = (
+            lambda limit: iter([self.pools]))
+        catalog.get_driver.side_effect = (
+            lambda name: mock.Mock(**{'_load.return_value':
+                                      self.load[name]}))
+
+        self.placement = placement.BalancedPlacement(mock.Mock(), catalog)
+        self.placement._start = mock.Mock()
+
+    def _weights(self):
+        factors, _ = self.placement._state
+        return dict((pool['name'], pool['weight'])
+                    for pool in self.placement._weigh(self.pools, factors))
+
+    def test_weights_are_static_until_refreshed(self):
+        self.assertEqual(self._weights(),
+                         {'idle': 100000, 'busy': 100000, 'down': 100000})
+
+    def test_refresh_steers_away_from_loaded_pools(self):
+        self.placement.refresh()
+        weights = self._weights()
+
+        self.assertGreater(weights['idle'], weights['busy'])
+        self.assertGreater(weights['busy'], 0)
+        self.assertEqual(weights['down'], 0)
+        self.assertNotEqual(self.placement.select(self.pools)['name'],
+                            'down')
+
+    def test_unhealthy_pools_are_chosen_as_a_last_resort(self):
+        for name in self.load:
+            self.load[name] = _load(0, 0, reachable=False)
+
+        self.placement.refresh()
+        self.assertIn(self.placement.select(self.pools), self.pools)
+
+
+class TestGetEngine(testtools.TestCase):
+
+    def test_engine_is_bound_to_its_catalog(self):
+        catalogs = [mock.Mock(), mock.Mock()]
+        for catalog in catalogs:
+            catalog._catalog_conf.placement = 'balanced'
+
+        engines = [placement.get_engine(mock.Mock(), catalog)
+                   for catalog in catalogs]
+
+        self.assertIsNot(engines[0], engines[1])
+        for engine, catalog in zip(engines, catalogs):
+            self.assertIsInstance(engine, placement.BalancedPlacement)
+            self.assertIs(engine._catalog, catalog)
@@ -12,11 +12,16 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
+import time
 import uuid
 
+import mock
+
+from zaqar.common import errors as cerrors
 from zaqar.openstack.common.cache import cache as oslo_cache
 from zaqar.storage import errors
 from zaqar.storage import mongodb
+from zaqar.storage.mongodb import controllers
 from zaqar.storage import pooling
 from zaqar.storage import utils
 from zaqar import tests as testing
@@ -75,6 +80,37 @@ class PoolCatalogTest(testing.TestBase):
         self.config(enable_virtual_pool=True, group='pooling:catalog')
         self.assertIsNotNone(self.catalog.lookup('not', 'mapped'))
 
+    def test_virtual_pool_is_resolved_once(self):
+        self.config(message_store='faulty', group='drivers')
+        self.config(enable_virtual_pool=True, group='pooling:catalog')
+
+        with mock.patch.object(utils, 'load_storage_driver',
+                               wraps=utils.load_storage_driver) as load:
+            storage = self.catalog.lookup('not', 'mapped')
+            num_loads = load.call_count
+
+            self.assertIs(self.catalog.lookup('also-not', 'mapped'),
+                          storage)
+            self.assertEqual(load.call_count, num_loads)
+
+    def test_virtual_pool_failure_is_retried_later(self):
+        self.config(message_store='faulty', group='drivers')
+        self.config(enable_virtual_pool=True, group='pooling:catalog')
+
+        error = cerrors.InvalidDriver('faulty')
+        with mock.patch.object(self.catalog, '_init_driver',
+                               side_effect=error) as init:
+            self.assertIsNone(self.catalog.lookup('not', 'mapped'))
+            self.assertIsNone(self.catalog.lookup('also-not', 'mapped'))
+            self.assertEqual(init.call_count, 1)
+
+            retry = time.time() + pooling.VIRTUAL_POOL_RETRY_INTERVAL
+            with mock.patch.object(pooling.time, 'time',
+                                   return_value=retry):
+                self.assertIsNone(self.catalog.lookup('not', 'mapped'))
+
+            self.assertEqual(init.call_count, 2)
+
     def test_lookup_returns_none_if_entry_deregistered(self):
         self.catalog.deregister(self.queue, self.project)
         self.assertIsNone(self.catalog.lookup(self.queue, self.project))
@@ -91,8 +127,198 @@ class PoolCatalogTest(testing.TestBase):
         storage = self.catalog.lookup(queue, self.project)
         self.assertIsInstance(storage._storage, mongodb.DataDriver)
 
+    def test_lookup_is_cached_until_catalogue_changes(self):
+        self.config(cache_refresh_interval=0, group='pooling:catalog')
+        self.catalog.lookup(self.queue, self.project)
+
+        with mock.patch.object(self.catalogue_ctrl, 'get') as get:
+            self.catalog.lookup(self.queue, self.project)
+            self.assertFalse(get.called)
+
+        # NOTE: Simulate another process moving the queue
+        self.catalogue_ctrl.update(self.project, self.queue, self.pool2)
+
+        storage = self.catalog.lookup(self.queue, self.project)
+        self.assertIs(storage, self.catalog.get_driver(self.pool2))
+
+    def test_lookup_is_not_cached_if_refreshed_meanwhile(self):
+        get = self.catalogue_ctrl.get
+
+        # NOTE: Simulate a refresh that applies a change to the
+        # mapping while it is being read.
+        def get_and_refresh(project, queue):
+            entry = get(project, queue)
+            self.catalog._catalogue_version = -1
+            return entry
+
+        with mock.patch.object(self.catalogue_ctrl, 'get',
+                               side_effect=get_and_refresh):
+            self.catalog.lookup(self.queue, self.project)
+
+        self.assertNotIn((self.project, self.queue), self.catalog._mappings)
+
     def test_register_with_fake_flavor(self):
         self.assertRaises(errors.FlavorDoesNotExist,
                           self.catalog.register,
                           'test', project=self.project,
                           flavor='fake')
+
+    def test_list_is_answered_by_the_catalogue(self):
+        queues = pooling.QueueController(self.catalog)
+
+        with mock.patch.object(self.catalog, 'get_driver') as get_driver:
+            interaction = queues.list(project=self.project)
+            self.assertEqual(list(next(interaction)),
+                             [{'name': self.queue}])
+            self.assertEqual(next(interaction), self.queue)
+            self.assertFalse(get_driver.called)
+
+    def test_detailed_list_is_answered_by_the_control_store(self):
+        queues = pooling.QueueController(self.catalog)
+        page = [{'name': self.queue, 'metadata': {}}]
+
+        with mock.patch.object(self.catalog, 'get_driver') as get_driver:
+            with mock.patch.object(self.catalog, 'control') as control:
+                control.queue_controller.list.return_value = iter([page])
+                interaction = queues.list(project=self.project,
+                                          detailed=True)
+                self.assertEqual(list(next(interaction)), page)
+
+            self.assertEqual(control.queue_controller.list.call_count, 1)
+            self.assertFalse(get_driver.called)
+
+    def _create_destination(self):
+        self.config(cache_refresh_interval=0, group='pooling:catalog')
+
+        # NOTE: Use a separate database, since both pools are backed
+        # by the same server.
+        pool = str(uuid.uuid1())
+        self.pools_ctrl.create(pool, 100, 'mongodb://localhost:27017',
+                               options={'database': 'zaqar_test_migrate'})
+        driver = self.catalog.get_driver(pool)._storage
+        for database in driver.message_databases:
+            self.addCleanup(driver.connection.drop_database, database.name)
+
+        return pool
+
+    def test_claim_falls_back_to_destination(self):
+        pool = self._create_destination()
+
+        queues = pooling.QueueController(self.catalog)
+        messages = pooling.MessageController(self.catalog)
+        claims = pooling.ClaimController(self.catalog)
+
+        queues.create(self.queue, project=self.project)
+        self.assertTrue(self.catalog.start_migration(self.queue, pool,
+                                                     self.project))
+        messages.post(self.queue, [{'ttl': 300, 'body': 'new'}],
+                      uuid.uuid4(), project=self.project)
+
+        claim_id, claimed = claims.create(self.queue,
+                                          {'ttl': 60, 'grace': 0},
+                                          project=self.project)
+
+        self.assertIsNotNone(claim_id)
+        self.assertEqual([m['body'] for m in claimed], ['new'])
+
+    def test_migrate_keeps_claims_valid(self):
+        pool = self._create_destination()
+
+        queues = pooling.QueueController(self.catalog)
+        messages = pooling.MessageController(self.catalog)
+        claims = pooling.ClaimController(self.catalog)
+        client = uuid.uuid4()
+
+        queues.create(self.queue, project=self.project)
+        messages.post(self.queue, [{'ttl': 300, 'body': 'old'}] * 3,
+                      client, project=self.project)
+        claim_id, claimed = claims.create(self.queue,
+                                          {'ttl': 60, 'grace': 0},
+                                          project=self.project, limit=1)
+        claimed = list(claimed)
+
+        self.assertTrue(self.catalog.start_migration(self.queue, pool,
+                                                     self.project))
+        messages.post(self.queue, [{'ttl': 300, 'body': 'new'}],
+                      client, project=self.project)
+
+        migration = self.catalog.migrate(self.queue, pool, self.project)
+        self.assertEqual(next(migration), 2)
+
+        # NOTE: The claimed message is only moved once it is deleted
+        messages.delete(self.queue, claimed[0]['id'],
+                        project=self.project, claim=claim_id)
+        self.assertEqual(list(migration), [])
+
+        self.assertIs(self.catalog.lookup(self.queue, self.project),
+                      self.catalog.get_driver(pool))
+        listed = next(messages.list(self.queue, project=self.project,
+                                    echo=True))
+        self.assertEqual(sorted(m['body'] for m in listed),
+                         ['new', 'old', 'old'])
+
+    def test_migrate_keeps_producers_but_not_order(self):
+        pool = self._create_destination()
+
+        queues = pooling.QueueController(self.catalog)
+        messages = pooling.MessageController(self.catalog)
+        producer = uuid.uuid4()
+
+        queues.create(self.queue, project=self.project)
+        messages.post(self.queue, [{'ttl': 300, 'body': 'old'}],
+                      producer, project=self.project)
+
+        self.assertTrue(self.catalog.start_migration(self.queue, pool,
+                                                     self.project))
+        messages.post(self.queue, [{'ttl': 300, 'body': 'new'}],
+                      uuid.uuid4(), project=self.project)
+
+        self.assertEqual(list(self.catalog.migrate(self.queue, pool,
+                                                   self.project)), [1])
+
+        # NOTE: The copies are posted after the messages that were
+        # posted to the destination during the migration.
+        listed = next(messages.list(self.queue, project=self.project,
+                                    echo=True))
+        self.assertEqual([m['body'] for m in listed], ['new', 'old'])
+
+        listed = next(messages.list(self.queue, project=self.project,
+                                    client_uuid=producer))
+        self.assertEqual([m['body'] for m in listed], ['new'])
+
+    def test_migrate_moves_messages_again_if_claim_expired(self):
+        pool = self._create_destination()
+
+        queues = pooling.QueueController(self.catalog)
+        messages = pooling.MessageController(self.catalog)
+        bulk_delete = controllers.MessageController.bulk_delete
+        expired = []
+
+        queues.create(self.queue, project=self.project)
+        messages.post(self.queue, [{'ttl': 300, 'body': 'old'}] * 2,
+                      uuid.uuid4(), project=self.project)
+
+        # NOTE: Let the migration claim expire before the first batch
+        # is deleted from the current pool.
+        def expire(controller, queue, message_ids, project=None,
+                   claim=None):
+            if claim is not None and not expired:
+                expired.append(claim)
+                source = self.catalog.lookup(queue, project)
+                source.claim_controller.delete(queue, claim,
+                                               project=project)
+                return list(message_ids)
+
+            return bulk_delete(controller, queue, message_ids,
+                               project=project, claim=claim)
+
+        with mock.patch.object(controllers.MessageController,
+                               'bulk_delete', autospec=True,
+                               side_effect=expire):
+            moved = list(self.catalog.migrate(self.queue, pool,
+                                              self.project))
+
+        self.assertEqual(moved, [0, 2])
+        listed = next(messages.list(self.queue, project=self.project,
+                                    echo=True))
+        self.assertEqual([m['body'] for m in listed], ['old', 'old'])
@@ -18,6 +18,7 @@ from zaqar.common.api import response
 from zaqar.common.api import utils as api_utils
 from zaqar.i18n import _
 from zaqar.storage import errors as storage_errors
+from zaqar.transport import utils
 from zaqar.transport import validation
 
 LOG = logging.getLogger(__name__)
@@ -26,7 +27,7 @@ LOG = logging.getLogger(__name__)
 class Endpoints(object):
     """v1.1 API Endpoints."""
 
-    def __init__(self, storage, control, validate):
+    def __init__(self, storage, control, validate, defaults):
         self._queue_controller = storage.queue_controller
         self._message_controller = storage.message_controller
         self._claim_controller = storage.claim_controller
@@ -35,6 +36,7 @@ class Endpoints(object):
         self._flavors_controller = control.flavors_controller
 
         self._validate = validate
+        self._defaults = defaults
 
     @api_utils.raises_conn_error
     def queue_list(self, req):
@@ -227,4 +229,57 @@ class Endpoints(object):
         else:
             headers = {'status': 200}
             resp = response.Response(req, body, headers)
-            return resp
\ No newline at end of file
+            return resp
+
+    # Claims
+
+    @api_utils.raises_conn_error
+    def claim_create(self, req):
+        """Creates a claim
+
+        If the queue is empty, and `wait` is given in the request body,
+        waits up to that many seconds for messages to arrive.
+
+        :param req: Request instance ready to be sent.
+        :type req: `api.common.Request`
+        :return: resp: Response instance
+        :type: resp: `api.common.Response`
+        """
+        project_id = req._headers.get('X-Project-ID')
+        queue_name = req._body.get('queue_name')
+        limit = req._body.get('limit')
+        wait = req._body.get('wait')
+
+        metadata = {
+            'ttl': req._body.get('ttl', self._defaults.claim_ttl),
+            'grace': req._body.get('grace', self._defaults.claim_grace),
+        }
+
+        LOG.debug(u'Claim create - queue: %(queue)s, project: %(project)s',
+                  {'queue': queue_name, 'project': project_id})
+
+        claim_options = {} if limit is None else {'limit': limit}
+
+        try:
+            self._validate.queue_identification(queue_name, project_id)
+            self._validate.claim_creation(metadata, limit=limit, wait=wait)
+            cid, msgs = utils.create_claim(self._claim_controller,
+                                           queue_name,
+                                           metadata=metadata,
+                                           project=project_id,
+                                           wait=wait,
+                                           **claim_options)
+        except validation.ValidationFailed as ex:
+            LOG.debug(ex)
+            headers = {'status': 400}
+            return api_utils.error_response(req, ex, headers)
+        except storage_errors.ExceptionBase as ex:
+            LOG.exception(ex)
+            error = _('Claim could not be created.')
+            headers = {'status': 503}
+            return api_utils.error_response(req, ex, headers, error)
+        else:
+            body = {'messages': msgs}
+            headers = {'status': 201} if msgs else {'status': 204}
+            resp = response.Response(req, body, headers)
+            return resp
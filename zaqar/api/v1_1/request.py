@@ -303,7 +303,8 @@ class RequestSchema(api.Api):
                         'queue_name': {'type': 'string'},
                         'limit': {'type': 'integer'},
                         'ttl': {'type': 'integer'},
-                        'grace': {'type': 'integer'}
+                        'grace': {'type': 'integer'},
+                        'wait': {'type': 'integer'}
                     },
                     'required': ['queue_name'],
                 }
@@ -0,0 +1,671 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Storage driver micro-benchmarks.
+
+Whereas the producer, consumer and observer workers exercise a running
+Zaqar server over HTTP, the scenarios in this module drive the storage
+driver configured in zaqar.conf directly, in order to measure the cost
+of individual storage operations in isolation.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import json
+import sys
+import threading
+import time
+import uuid
+
+from bson import objectid
+from bson import son
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+from zaqar import bootstrap
+from zaqar.storage.mongodb import driver as mongodb_driver
+from zaqar.storage.mongodb import messages as mongodb_messages
+from zaqar.storage.mongodb import utils as mongodb_utils
+from zaqar.storage import pipeline
+from zaqar.storage import pooling
+from zaqar.storage.redis import driver as redis_driver
+from zaqar.storage.redis import options as redis_options
+from zaqar.storage import utils as storage_utils
+
+CONF = cfg.CONF
+
+_CLI_OPTIONS = (
+    cfg.StrOpt('scenario', positional=True,
+               help='Name of the scenario to run'),
+    cfg.IntOpt('iterations', short='n', default=1000,
+               help='Number of times to repeat the measured operation'),
+    cfg.StrOpt('queue_prefix', short='q', default='ogre-test-queue'),
+)
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """Registers the decorated function as a named scenario.
+
+    Each scenario is called with a `Context` and must return a list
+    of dicts, one per data point.
+    """
+
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+
+    return decorator
+
+
+class Context(object):
+    """Storage handles and parameters passed to each scenario.
+
+    :param conf: Configuration used to load the storage driver
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+
+        boot = bootstrap.Bootstrap(conf)
+        self.cache = boot.cache
+        self.control = boot.control
+
+        # NOTE: Load the data driver ourselves rather than using
+        # boot.storage, so that scenarios may reach into the driver
+        # when they need to inspect backend-specific state.
+        self.driver = storage_utils.load_storage_driver(
+            conf, self.cache, control_driver=self.control)
+
+        self.storage = pipeline.DataDriver(conf, self.driver, self.control)
+
+    @property
+    def iterations(self):
+        return self.conf.iterations
+
+    def queue_name(self, suffix):
+        return '{0}-{1}'.format(self.conf.queue_prefix, suffix)
+
+    def reset_queue(self, name):
+        queue_ctrl = self.storage.queue_controller
+        queue_ctrl.delete(name)
+        queue_ctrl.create(name)
+
+
+def fill_queue(message_ctrl, queue, count, batch_size=100, ttl=3600,
+               body=None):
+    """Posts `count` messages to a queue, in batches."""
+
+    client_uuid = str(uuid.uuid4())
+    body = body if body is not None else {'event': 'BackupStarted'}
+
+    while count > 0:
+        num = min(count, batch_size)
+        messages = [{'ttl': ttl, 'body': body} for _ in range(num)]
+        message_ctrl.post(queue, messages, client_uuid)
+        count -= num
+
+
+def timed(func, *args, **kwargs):
+    """Calls func and returns the elapsed wall clock time, in seconds."""
+
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
+
+
+def percentile(samples, pct):
+    """Returns the given percentile of a list of samples."""
+
+    if not samples:
+        return 0
+
+    ordered = sorted(samples)
+    index = int(round((pct / 100) * (len(ordered) - 1)))
+    return ordered[index]
+
+
+@scenario('claim_backlog')
+def claim_backlog(ctx):
+    """Claim latency vs. number of claimed-but-undeleted messages.
+
+    For each backlog size, the head of the queue is filled with
+    messages that are claimed and never deleted, after which the
+    latency of claiming the remaining messages is measured.
+    """
+
+    results = []
+    message_ctrl = ctx.storage.message_controller
+    claim_ctrl = ctx.storage.claim_controller
+    limit = 10
+
+    for backlog in (0, 100, 1000, 10000, 100000):
+        queue = ctx.queue_name('claim-backlog-{0}'.format(backlog))
+        ctx.reset_queue(queue)
+
+        fill_queue(message_ctrl, queue, backlog)
+        fill_queue(message_ctrl, queue, ctx.iterations * limit)
+
+        remaining = backlog
+        while remaining > 0:
+            num = min(remaining, 100)
+            claim_ctrl.create(queue, {'ttl': 3600, 'grace': 60}, limit=num)
+            remaining -= num
+
+        samples = []
+        for _ in range(ctx.iterations):
+            samples.append(timed(claim_ctrl.create, queue,
+                                 {'ttl': 3600, 'grace': 60}, limit=limit))
+
+        results.append({
+            'claimed_backlog': backlog,
+            'ms_per_claim': 1000 * sum(samples) / len(samples),
+            'p99_ms_per_claim': 1000 * percentile(samples, 99),
+        })
+
+        ctx.storage.queue_controller.delete(queue)
+
+    return results
+
+
+@scenario('post_batch')
+def post_batch(ctx):
+    """Post throughput for batches of 1, 10 and 100 messages."""
+
+    results = []
+    message_ctrl = ctx.storage.message_controller
+    client_uuid = str(uuid.uuid4())
+
+    for batch_size in (1, 10, 100):
+        queue = ctx.queue_name('post-batch-{0}'.format(batch_size))
+        ctx.reset_queue(queue)
+
+        messages = [{'ttl': 300, 'body': {'event': 'BackupStarted'}}
+                    for _ in range(batch_size)]
+
+        elapsed = 0
+        for _ in range(ctx.iterations):
+            elapsed += timed(message_ctrl.post, queue, messages,
+                             client_uuid)
+
+        results.append({
+            'batch_size': batch_size,
+            'posts_per_sec': ctx.iterations / elapsed,
+            'messages_per_sec': ctx.iterations * batch_size / elapsed,
+            'ms_per_post': 1000 * elapsed / ctx.iterations,
+        })
+
+        ctx.storage.queue_controller.delete(queue)
+
+    return results
+
+
+@scenario('post_contention')
+def post_contention(ctx):
+    """Post latency with N concurrent producers on a single queue.
+
+    Each producer posts `iterations` batches of 10 messages. Retries
+    are counted as the number of times the driver backed off before
+    trying again, for drivers that do so.
+    """
+
+    results = []
+    message_ctrl = ctx.storage.message_controller
+    driver_message_ctrl = ctx.driver.message_controller
+    queue = ctx.queue_name('post-contention')
+    messages = [{'ttl': 300, 'body': {'event': 'BackupStarted'}}] * 10
+
+    retries = []
+    backoff_sleep = getattr(driver_message_ctrl, '_backoff_sleep', None)
+    if backoff_sleep is not None:
+        def counting_backoff_sleep(attempt):
+            retries.append(attempt)
+            backoff_sleep(attempt)
+
+        driver_message_ctrl._backoff_sleep = counting_backoff_sleep
+
+    def producer(samples):
+        client_uuid = str(uuid.uuid4())
+        for _ in range(ctx.iterations):
+            samples.append(timed(message_ctrl.post, queue, messages,
+                                 client_uuid))
+
+    try:
+        for num_producers in (1, 4, 16):
+            ctx.reset_queue(queue)
+            del retries[:]
+
+            samples = [[] for _ in range(num_producers)]
+            threads = [threading.Thread(target=producer, args=(s,))
+                       for s in samples]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+            samples = sum(samples, [])
+
+            results.append({
+                'producers': num_producers,
+                'p50_ms_per_post': 1000 * percentile(samples, 50),
+                'p99_ms_per_post': 1000 * percentile(samples, 99),
+                'retries': len(retries),
+            })
+
+            ctx.storage.queue_controller.delete(queue)
+    finally:
+        if backoff_sleep is not None:
+            del driver_message_ctrl._backoff_sleep
+
+    return results
+
+
+@scenario('queue_stats')
+def queue_stats(ctx):
+    """Queue stats latency vs. number of active claims.
+
+    Each claim holds a single message, so that the number of claims
+    grows with the number of claimed messages.
+    """
+
+    results = []
+    message_ctrl = ctx.storage.message_controller
+    claim_ctrl = ctx.storage.claim_controller
+    queue_ctrl = ctx.storage.queue_controller
+
+    for num_claims in (0, 100, 1000, 10000):
+        queue = ctx.queue_name('queue-stats-{0}'.format(num_claims))
+        ctx.reset_queue(queue)
+
+        fill_queue(message_ctrl, queue, num_claims + 100)
+
+        for _ in range(num_claims):
+            claim_ctrl.create(queue, {'ttl': 3600, 'grace': 60}, limit=1)
+
+        samples = []
+        for _ in range(ctx.iterations):
+            samples.append(timed(queue_ctrl.stats, queue))
+
+        results.append({
+            'claims': num_claims,
+            'ms_per_stats': 1000 * sum(samples) / len(samples),
+            'p99_ms_per_stats': 1000 * percentile(samples, 99),
+        })
+
+        queue_ctrl.delete(queue)
+
+    return results
+
+
+@scenario('gc')
+def gc(ctx):
+    """GC run latency vs. number of live messages.
+
+    The live messages are spread across 10 queues, and each run only
+    has the messages posted with a TTL of zero since the previous run
+    to collect.
+    """
+
+    results = []
+    message_ctrl = ctx.storage.message_controller
+    num_queues = 10
+
+    for num_messages in (1000, 10000, 100000):
+        queues = [ctx.queue_name('gc-{0}-{1}'.format(num_messages, i))
+                  for i in range(num_queues)]
+
+        for queue in queues:
+            ctx.reset_queue(queue)
+            fill_queue(message_ctrl, queue, num_messages // num_queues)
+
+        samples = []
+        for i in range(ctx.iterations):
+            fill_queue(message_ctrl, queues[i % num_queues], 10, ttl=0)
+            samples.append(timed(ctx.storage.gc))
+
+        results.append({
+            'live_messages': num_messages,
+            'ms_per_run': 1000 * sum(samples) / len(samples),
+            'p99_ms_per_run': 1000 * percentile(samples, 99),
+        })
+
+        for queue in queues:
+            ctx.storage.queue_controller.delete(queue)
+
+    return results
+
+
+@scenario('message_get')
+def message_get(ctx):
+    """Message GET throughput with queue lookup caching off and on.
+
+    Queue lookup caching is currently only implemented by the Redis
+    driver; for other drivers, both rows measure the same thing.
+    """
+
+    results = []
+    queue = ctx.queue_name('message-get')
+
+    for cached in (False, True):
+        for group in ('drivers:management_store:redis',
+                      'drivers:message_store:redis'):
+            if group in ctx.conf:
+                ctx.conf.set_override('cache_queue_lookups', cached,
+                                      group=group)
+
+        # NOTE: Controllers read the option when they are created
+        storage = Context(ctx.conf).storage
+        message_ctrl = storage.message_controller
+
+        ctx.reset_queue(queue)
+        message_ids = message_ctrl.post(
+            queue, [{'ttl': 3600, 'body': {'event': 'BackupStarted'}}] * 10,
+            str(uuid.uuid4()))
+
+        elapsed = 0
+        for i in range(ctx.iterations):
+            elapsed += timed(message_ctrl.get, queue,
+                             message_ids[i % len(message_ids)])
+
+        results.append({
+            'cache_queue_lookups': cached,
+            'gets_per_sec': ctx.iterations / elapsed,
+            'ms_per_get': 1000 * elapsed / ctx.iterations,
+        })
+
+        ctx.storage.queue_controller.delete(queue)
+
+    return results
+
+
+@scenario('virtual_pool_lookup')
+def virtual_pool_lookup(ctx):
+    """Catalog lookup throughput for queues that are not mapped to a pool.
+
+    Such queues are served by the virtual pool, i.e., the message store
+    configured in zaqar.conf. Each lookup is for a different queue. The
+    first lookup, which resolves the virtual pool, is reported
+    separately. Requires a management store that supports pooling.
+    """
+
+    catalog = pooling.Catalog(ctx.conf, ctx.cache, ctx.control)
+    ctx.conf.set_override('enable_virtual_pool', True,
+                          group='pooling:catalog')
+
+    first_lookup = timed(catalog.lookup, ctx.queue_name('unmapped'))
+
+    elapsed = 0
+    for i in range(ctx.iterations):
+        queue = ctx.queue_name('unmapped-{0}'.format(i))
+        elapsed += timed(catalog.lookup, queue)
+
+    return [{
+        'first_lookup_ms': 1000 * first_lookup,
+        'lookups_per_sec': ctx.iterations / elapsed,
+        'ms_per_lookup': 1000 * elapsed / ctx.iterations,
+    }]
+
+
+def sample_body(size):
+    """Returns a JSON document that serializes to about `size` bytes."""
+
+    events = []
+    body = {'source': 'backup-agent', 'events': events}
+
+    while len(json.dumps(body)) < size:
+        events.append({
+            'id': str(uuid.uuid4()),
+            'type': 'BackupStarted',
+            'host': 'backup-{0:04d}'.format(len(events)),
+            'created': int(time.time()),
+        })
+
+    return body
+
+
+@scenario('message_memory')
+def message_memory(ctx):
+    """Redis memory per message for each message encoding.
+
+    For 1 KB and 64 KB bodies, posts `iterations` messages with
+    each encoding, and reports the growth in the memory used by
+    Redis divided by the number of messages. Only supported by the
+    Redis driver.
+    """
+
+    if not isinstance(ctx.driver, redis_driver.DataDriver):
+        raise RuntimeError('The message_memory scenario requires '
+                           'the Redis driver')
+
+    results = []
+    group = redis_options.MESSAGE_REDIS_GROUP
+    queue = ctx.queue_name('message-memory')
+
+    encodings = (
+        ('hash', 0),
+        ('compact', 0),
+        ('compact', 256),
+    )
+
+    for body_size in (1024, 64 * 1024):
+        body = sample_body(body_size)
+
+        for encoding, compression_threshold in encodings:
+            ctx.conf.set_override('message_encoding', encoding, group=group)
+            ctx.conf.set_override('compression_threshold',
+                                  compression_threshold, group=group)
+
+            # NOTE: Controllers read the options when they are created
+            bench_ctx = Context(ctx.conf)
+            client = bench_ctx.driver.connection
+
+            bench_ctx.reset_queue(queue)
+            used_before = client.info('memory')['used_memory']
+
+            fill_queue(bench_ctx.storage.message_controller, queue,
+                       ctx.iterations, batch_size=10, body=body)
+
+            used_after = client.info('memory')['used_memory']
+
+            results.append({
+                'body_bytes': body_size,
+                'encoding': encoding,
+                'compression_threshold': compression_threshold,
+                'bytes_per_message': (used_after - used_before) /
+                ctx.iterations,
+            })
+
+            bench_ctx.storage.queue_controller.delete(queue)
+
+    return results
+
+
+def _explain_stats(plan):
+    """Returns the keys and documents examined from an explain plan."""
+
+    # NOTE: MongoDB 3.0 reports execution stats in their own section,
+    # whereas earlier versions report them at the top level.
+    stats = plan.get('executionStats')
+    if stats is not None:
+        return stats['totalKeysExamined'], stats['totalDocsExamined']
+
+    return plan['nscanned'], plan['nscannedObjects']
+
+
+@scenario('index_advisor')
+def index_advisor(ctx):
+    """Keys and documents examined by message queries, per index layout.
+
+    Loads a queue with 1M messages, posted in equal halves by two
+    clients. The first 10% of the messages are claimed, and the last
+    1000 are left pending as part of an unfinalized transaction. Each
+    query is then explained and timed (`iterations` times) with both
+    the current and the legacy index layouts. Only supported by the
+    MongoDB driver.
+    """
+
+    if not isinstance(ctx.driver, mongodb_driver.DataDriver):
+        raise RuntimeError('The index_advisor scenario requires '
+                           'the MongoDB driver')
+
+    num_messages = 1000000
+    num_claimed = num_messages // 10
+    num_pending = 1000
+
+    results = []
+    message_ctrl = ctx.driver.message_controller
+    queue = ctx.queue_name('index-advisor')
+    ctx.reset_queue(queue)
+
+    clients = [str(uuid.uuid4()), str(uuid.uuid4())]
+    messages = [{'ttl': 3600, 'body': {'event': 'BackupStarted'}}] * 100
+    for client_uuid in clients:
+        for _ in range(num_messages // len(clients) // len(messages)):
+            message_ctrl.post(queue, messages, client_uuid)
+
+    collection = message_ctrl._collection(queue)
+    scope = {mongodb_messages.PROJ_QUEUE: mongodb_utils.scope_queue_name(
+        queue)}
+
+    # NOTE: Claim and hold up the messages directly, rather than via
+    # the controllers, so as to get exactly the intended layout.
+    markers = [doc['k'] for doc in
+               collection.find(scope, fields={'k': 1}, sort=[('k', 1)])]
+
+    claimed = dict(scope, k={'$lte': markers[num_claimed - 1]})
+    expires = timeutils.utcnow_ts() + 3600
+    collection.update(claimed, {'$set': {'c': {'id': objectid.ObjectId(),
+                                               't': 3600, 'e': expires}}},
+                      multi=True)
+
+    pending = dict(scope, k={'$gte': markers[-num_pending]})
+    collection.update(pending, {'$set': {'tx': objectid.ObjectId()}},
+                      multi=True)
+
+    def count(hint, include_claimed):
+        query = message_ctrl._count_query(queue,
+                                          include_claimed=include_claimed)
+        command = son.SON([('count', collection.name), ('query', query),
+                           ('hint', son.SON(hint))])
+        plan = collection.database.command('explain', command,
+                                           verbosity='executionStats')
+
+        return plan, lambda: collection.find(query).hint(hint).count()
+
+    def listing(hint, client_uuid, marker=None):
+        def cursor():
+            return message_ctrl._list(queue, marker=marker,
+                                      client_uuid=client_uuid,
+                                      limit=10).hint(hint)
+
+        return cursor().explain(), lambda: list(cursor())
+
+    operations = (
+        ('count', lambda hint: count(hint, False), 'counting'),
+        ('count_include_claimed', lambda hint: count(hint, True),
+         'counting'),
+        ('list_own_head', lambda hint: listing(hint, clients[0]), 'active'),
+        ('list_other_head', lambda hint: listing(hint, clients[1]),
+         'active'),
+        ('list_tail', lambda hint: listing(hint, clients[0],
+                                           markers[-num_pending - 20]),
+         'active'),
+    )
+
+    layouts = {
+        'current': {
+            'active': mongodb_messages.ACTIVE_INDEX_FIELDS,
+            'counting': mongodb_messages.COUNTING_INDEX_FIELDS,
+        },
+        'legacy': {
+            'active': mongodb_messages.LEGACY_ACTIVE_INDEX_FIELDS,
+            'counting': mongodb_messages.LEGACY_COUNTING_INDEX_FIELDS,
+        },
+    }
+
+    # NOTE: The legacy indexes may already exist if the database was
+    # upgraded from an earlier release, in which case they are left
+    # in place afterwards.
+    existing = [info['key'] for info in
+                collection.index_information().values()]
+
+    created = []
+    for fields in layouts['legacy'].values():
+        if fields not in existing:
+            created.append(collection.create_index(fields))
+
+    try:
+        for name, operation, index in operations:
+            for layout in sorted(layouts):
+                plan, run = operation(layouts[layout][index])
+                keys_examined, docs_examined = _explain_stats(plan)
+
+                samples = [timed(run) for _ in range(ctx.iterations)]
+
+                results.append({
+                    'operation': name,
+                    'layout': layout,
+                    'keys_examined': keys_examined,
+                    'docs_examined': docs_examined,
+                    'ms_per_op': 1000 * sum(samples) / len(samples),
+                })
+    finally:
+        for name in created:
+            collection.drop_index(name)
+
+        ctx.storage.queue_controller.delete(queue)
+
+    return results
+
+
+def _print_table(results):
+    if not results:
+        return
+
+    columns = sorted(results[0])
+    print('  '.join('{0:>20}'.format(c) for c in columns))
+
+    for row in results:
+        values = []
+        for c in columns:
+            value = row[c]
+            if isinstance(value, float):
+                values.append('{0:>20.3f}'.format(value))
+            else:
+                values.append('{0:>20}'.format(value))
+
+        print('  '.join(values))
+
+
+def main():
+    CONF.register_cli_opts(_CLI_OPTIONS)
+    CONF(project='zaqar', prog='zaqar-bench-storage')
+
+    try:
+        run_scenario = SCENARIOS[CONF.scenario]
+    except KeyError:
+        print('Unknown scenario "{0}". Choose one of: {1}'.format(
+              CONF.scenario, ', '.join(sorted(SCENARIOS))), file=sys.stderr)
+        sys.exit(1)
+
+    results = run_scenario(Context(CONF))
+
+    # NOTE: The verbose option is registered by oslo.log
+    if CONF.verbose:
+        _print_table(results)
+    else:
+        print(json.dumps({CONF.scenario: results}))
@@ -19,6 +19,13 @@ from zaqar.common import cli
 
 LOG = log.getLogger(__name__)
 
+_CLI_OPTIONS = (
+    cfg.BoolOpt('reconcile', default=False,
+                help='After collecting garbage, rebuild any indexes and '
+                     'counters that the storage driver derives from the '
+                     'stored messages, in order to repair drift.'),
+)
+
 
 # In this first approach it's the responsibility of the operator
 # to call the garbage collector manually. Using crontab or a similar
@@ -29,9 +36,14 @@ def run():
     # to pick up common options from openstack.common.log, since
     # that module uses the global CONF instance exclusively.
     conf = cfg.CONF
+    conf.register_cli_opts(_CLI_OPTIONS)
     conf(project='zaqar', prog='zaqar-gc')
 
     server = bootstrap.Bootstrap(conf)
 
     LOG.debug(u'Calling the garbage collector')
     server.storage.gc()
+
+    if conf.reconcile:
+        LOG.debug(u'Reconciling derived storage data')
+        server.storage.reconcile()
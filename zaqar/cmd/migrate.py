@@ -0,0 +1,62 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+from oslo_config import cfg
+from oslo_log import log
+
+from zaqar import bootstrap
+from zaqar.common import cli
+from zaqar.storage import pooling
+
+LOG = log.getLogger(__name__)
+
+_CLI_OPTIONS = (
+    cfg.StrOpt('queue', required=True,
+               help='Name of the queue to migrate.'),
+    cfg.StrOpt('project',
+               help='Project to which the queue belongs.'),
+    cfg.StrOpt('pool', required=True,
+               help='Name of the pool to migrate the queue to.'),
+)
+
+
+# NOTE: The queue remains available while it is migrated. If the
+# migration is interrupted, run this again with the same pool to
+# resume it.
+@cli.runnable
+def run():
+    conf = cfg.CONF
+    conf.register_cli_opts(_CLI_OPTIONS)
+    conf(project='zaqar', prog='zaqar-migrate')
+
+    if not conf.pooling:
+        raise RuntimeError('Migrating queues requires pooling')
+
+    server = bootstrap.Bootstrap(conf)
+    catalog = pooling.Catalog(conf, server.cache, server.control)
+
+    moved = 0
+    for count in catalog.migrate(conf.queue, conf.pool, conf.project):
+        moved += count
+        LOG.debug(u'Moved %(count)d messages of queue %(queue)s',
+                  {'count': count, 'queue': conf.queue})
+
+    LOG.info(u'Migrated queue %(queue)s under project %(project)s to '
+             u'pool %(pool)s, moving %(moved)d messages',
+             {'queue': conf.queue, 'project': conf.project,
+              'pool': conf.pool, 'moved': moved})
+
+    print('{0}/{1}: {2} ({3} messages moved)'.format(
+        conf.project or '', conf.queue, conf.pool, moved))
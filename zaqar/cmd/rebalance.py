@@ -0,0 +1,59 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+from oslo_config import cfg
+from oslo_log import log
+
+from zaqar import bootstrap
+from zaqar.common import cli
+from zaqar.storage import mongodb
+from zaqar.storage import utils as storage_utils
+
+LOG = log.getLogger(__name__)
+
+_CLI_OPTIONS = (
+    cfg.BoolOpt('dry_run', default=False,
+                help='Only list the queues that would be moved.'),
+)
+
+
+# NOTE: Run this after increasing the number of partitions for the
+# MongoDB message store, and restarting the servers so that they pick
+# up the new setting. Queues remain available while they are moved.
+@cli.runnable
+def run():
+    conf = cfg.CONF
+    conf.register_cli_opts(_CLI_OPTIONS)
+    conf(project='zaqar', prog='zaqar-rebalance')
+
+    server = bootstrap.Bootstrap(conf)
+
+    # NOTE: Load the data driver ourselves rather than using
+    # server.storage, since we need the MongoDB driver itself.
+    driver = storage_utils.load_storage_driver(
+        conf, server.cache, control_driver=server.control)
+
+    if not isinstance(driver, mongodb.DataDriver):
+        raise RuntimeError('Rebalancing partitions is only supported '
+                           'by the MongoDB message store')
+
+    for project, queue, source, target in driver.rebalance(conf.dry_run):
+        LOG.info(u'Moved queue %(queue)s under project %(project)s from '
+                 u'partition %(source)d to %(target)d',
+                 {'queue': queue, 'project': project,
+                  'source': source, 'target': target})
+
+        print('{0}/{1}: {2} -> {3}'.format(project or '', queue,
+                                           source, target))
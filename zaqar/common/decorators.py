@@ -49,7 +49,9 @@ def caches(keygen, ttl, cond=None):
     """Flags a getter method as being cached using oslo_cache.
 
     It is assumed that the containing class defines an attribute
-    named `_cache` that is an instance of an oslo_cache backend.
+    named `_cache` that is an instance of an oslo_cache backend. If
+    `_cache` is None, caching is disabled, and both the getter and
+    any removers are called directly.
 
     The getter should raise an exception if the value can't be
     loaded, which will skip the caching step. Otherwise, the
@@ -77,7 +79,9 @@ def caches(keygen, ttl, cond=None):
 
     :param keygen: A static key generator function. This function
         must accept the same arguments as the getter, sans `self`.
-    :param ttl: TTL for the cache entry, in seconds.
+    :param ttl: TTL for the cache entry, in seconds. May also be
+        a function that takes the value to cache, and returns the
+        TTL to use for it.
     :param cond: Conditional for whether or not to cache the
         value. Must be a function that takes a single value, and
         returns True or False.
@@ -88,8 +92,9 @@ def caches(keygen, ttl, cond=None):
         @functools.wraps(remover)
         def wrapper(self, *args, **kwargs):
             # First, purge from cache
-            key = keygen(*args, **kwargs)
-            del self._cache[key]
+            if self._cache is not None:
+                key = keygen(*args, **kwargs)
+                del self._cache[key]
 
             # Remove/delete from origin
             remover(self, *args, **kwargs)
@@ -100,6 +105,9 @@ def caches(keygen, ttl, cond=None):
 
         @functools.wraps(getter)
         def wrapper(self, *args, **kwargs):
+            if self._cache is None:
+                return getter(self, *args, **kwargs)
+
             key = keygen(*args, **kwargs)
             packed_value = self._cache.get(key)
 
@@ -114,8 +122,9 @@ def caches(keygen, ttl, cond=None):
                     # both types are normalized to the MessagePack
                     # str format family.
                     packed_value = msgpack.packb(value, use_bin_type=True)
+                    value_ttl = ttl(value) if callable(ttl) else ttl
 
-                    if not self._cache.set(key, packed_value, ttl):
+                    if not self._cache.set(key, packed_value, value_ttl):
                         LOG.warn('Failed to cache key: ' + key)
             else:
                 # NOTE(kgriffs): unpackb does not default to UTF-8,
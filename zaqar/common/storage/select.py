@@ -16,23 +16,27 @@
 """select: a collection of algorithms for choosing an entry from a
 collection."""
 
+import bisect
 import random
 
 
-def weighted(objs, key='weight', generator=random.randint):
-    """Perform a weighted select given a list of objects.
+def spectrum(objs, key='weight'):
+    """Precompute the lookup table used for weighted selection.
+
+    The table can be built once and reused by `pick` for as long as
+    the objects and their weights do not change.
 
     :param objs: a list of objects containing at least the field `key`
     :type objs: [dict]
     :param key: the field in each obj that corresponds to weight
     :type key: six.text_type
-    :param generator: a number generator taking two ints
-    :type generator: function(int, int) -> int
-    :return: an object
-    :rtype: dict
+    :return: the selectable objects, and the cumulative weight of
+        each, i.e., the upper bound of its interval
+    :rtype: ([dict], [int])
     """
     acc = 0
-    lookup = []
+    selectable = []
+    bounds = []
 
     # construct weighted spectrum
     for o in objs:
@@ -40,19 +44,47 @@ def weighted(objs, key='weight', generator=random.randint):
         if o[key] <= 0:
             continue
         acc += o[key]
-        lookup.append((o, acc))
+        selectable.append(o)
+        bounds.append(acc)
+
+    return selectable, bounds
+
+
+def pick(table, generator=random.randint):
+    """Perform a weighted select given a precomputed table.
+
+    :param table: a lookup table, as returned by `spectrum`
+    :type table: ([dict], [int])
+    :param generator: a number generator taking two ints
+    :type generator: function(int, int) -> int
+    :return: an object
+    :rtype: dict
+    """
+    selectable, bounds = table
 
     # no objects were found
-    if not lookup:
+    if not selectable:
         return None
 
     # NOTE(cpp-cabrera): select an object from the lookup table. If
     # the selector lands in the interval [lower, upper), then choose
     # it.
-    gen = generator
-    selector = gen(0, acc - 1)
-    lower = 0
-    for obj, upper in lookup:
-        if lower <= selector < upper:
-            return obj
-        lower = upper
+    selector = generator(0, bounds[-1] - 1)
+    index = bisect.bisect_right(bounds, selector)
+    if 0 <= selector and index < len(selectable):
+        return selectable[index]
+
+
+def weighted(objs, key='weight', generator=random.randint):
+    """Perform a weighted select given a list of objects.
+
+    :param objs: a list of objects containing at least the field `key`
+    :type objs: [dict]
+    :param key: the field in each obj that corresponds to weight
+    :type key: six.text_type
+    :param generator: a number generator taking two ints
+    :type generator: function(int, int) -> int
+    :return: an object
+    :rtype: dict
+    """
+    return pick(spectrum(objs, key), generator)
@@ -38,6 +38,14 @@ DEFAULT_SUBSCRIPTIONS_PER_PAGE = 10
 
 DEFAULT_MESSAGES_PER_CLAIM = 10
 
+# NOTE: Number of recent changes that catalogue backends keep track
+# of (see also CatalogueBase.changes).
+CATALOGUE_CHANGE_LOG_SIZE = 1000
+
+# NOTE: Interval at which drivers that are not notified when messages
+# are posted poll the queue on behalf of long-polling consumers.
+CLAIM_WAIT_POLL_INTERVAL = 1
+
 LOG = logging.getLogger(__name__)
 
 
@@ -128,6 +136,25 @@ class DataDriverBase(DriverBase):
         """Return the health status based on different backends."""
         raise NotImplementedError
 
+    def _load(self):
+        """Return the load of the storage, without writing to it.
+
+        Unlike _health(), this only reads from the storage, so that
+        it is cheap enough to be checked periodically.
+
+        :returns: A dict with whether the storage is reachable, how
+            long it took to ping it, in seconds, and the message
+            volume if the driver is able to count it.
+        """
+
+        start = time.time()
+        reachable = self.is_alive()
+
+        return {
+            'storage_reachable': reachable,
+            'seconds': time.time() - start,
+        }
+
     def _get_operation_status(self):
         op_status = {}
         status_template = lambda s, t, r: {'succeeded': s,
@@ -218,6 +245,18 @@ class DataDriverBase(DriverBase):
         """
         pass
 
+    def reconcile(self):
+        """Repair drift in any derived data kept by the driver.
+
+        This method can be overridden by drivers that maintain
+        indexes or counters alongside the data they describe, so
+        that garbage collection scripts can rebuild them from the
+        authoritative data when requested.
+
+        By default, this method does nothing.
+        """
+        pass
+
     @decorators.lazy_property(write=False)
     def queue_controller(self):
         return self.control_driver.queue_controller
@@ -501,7 +540,7 @@ class Message(ControllerBase):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def bulk_delete(self, queue, message_ids, project=None):
+    def bulk_delete(self, queue, message_ids, project=None, claim=None):
         """Base method for deleting multiple messages.
 
         :param queue: Name of the queue to post
@@ -509,6 +548,10 @@ class Message(ControllerBase):
         :param message_ids: A sequence of message IDs
             to be deleted.
         :param project: Project id
+        :param claim: (Default None) If given, only the messages
+            that are currently claimed by this claim are deleted.
+        :returns: A list of the IDs of the messages that were
+            not deleted because they are not claimed by `claim`.
         """
         raise NotImplementedError
 
@@ -558,6 +601,28 @@ class Claim(ControllerBase):
         """
         raise NotImplementedError
 
+    def wait(self, queue, timeout, project=None):
+        """Base method for waiting for messages to claim.
+
+        Called by consumers that long-poll the queue, after a claim
+        came back empty. Drivers that can be notified when messages
+        are posted should override this method, so that consumers
+        are woken as soon as messages arrive.
+
+        By default, this method sleeps for a short interval and
+        then returns True, so that the caller polls the queue at a
+        bounded rate.
+
+        :param queue: Name of the queue to wait on.
+        :param timeout: Maximum time to wait, in seconds.
+        :param project: Project id
+
+        :returns: True if messages may be available to claim,
+            False if the timeout elapsed.
+        """
+        time.sleep(min(timeout, CLAIM_WAIT_POLL_INTERVAL))
+        return True
+
     @abc.abstractmethod
     def update(self, queue, claim_id, metadata, project=None):
         """Base method for updating a claim.
@@ -857,13 +922,20 @@ class CatalogueBase(ControllerBase):
     """
 
     @abc.abstractmethod
-    def list(self, project):
+    def list(self, project, marker=None, limit=None):
         """Get a list of queues from the catalogue.
 
         :param project: The project to use when filtering through queue
                         entries.
         :type project: six.text_type
-        :returns: [{'project': ..., 'queue': ..., 'pool': ...},]
+        :param marker: If given, only the entries for queues named
+                       after the marker are listed, sorted by name.
+        :type marker: six.text_type
+        :param limit: (Default None) If given, the maximum number of
+                      entries to list, sorted by queue name.
+        :type limit: int
+        :returns: [{'project': ..., 'queue': ..., 'pool': ...,
+                    'destination': ...},]
         :rtype: [dict]
         """
 
@@ -877,7 +949,7 @@ class CatalogueBase(ControllerBase):
         :type project: six.text_type
         :param queue: The name of the queue to search for
         :type queue: six.text_type
-        :returns: {'pool': ...}
+        :returns: {'pool': ..., 'destination': ...}
         :rtype: dict
         :raises: QueueNotMapped
         """
@@ -926,6 +998,9 @@ class CatalogueBase(ControllerBase):
     def update(self, project, queue, pools=None):
         """Updates the pool identifier for this queue.
 
+        Any migration of the queue to another pool is considered
+        complete, or aborted, once the queue is assigned a new pool.
+
         :param project: Namespace to search
         :type project: six.text_type
         :param queue: The name of the queue
@@ -937,6 +1012,49 @@ class CatalogueBase(ControllerBase):
 
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def set_destination(self, project, queue, destination):
+        """Marks a queue as being migrated to another pool.
+
+        The entries of queues being migrated list the pool to which
+        they are migrated under 'destination'.
+
+        :param project: Namespace to search
+        :type project: six.text_type
+        :param queue: The name of the queue
+        :type queue: six.text_type
+        :param destination: The name of the pool to which the queue
+            is being migrated, or None to abort the migration.
+        :type destination: six.text_type
+        :raises: QueueNotMapped
+        """
+
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def changes(self, since=None):
+        """Returns the catalogue entries that changed since a version.
+
+        Inserting, updating or deleting an entry bumps the version
+        of the catalogue by one, and records the entry in a log of
+        the last CATALOGUE_CHANGE_LOG_SIZE changes. This allows
+        callers that cache entries to invalidate exactly those that
+        changed.
+
+        Fewer than `version - since` changes are returned when some
+        of them are no longer in the log, or are still being
+        recorded. In that case, callers must assume that any entry
+        may have changed.
+
+        :param since: Version from which to list changes, or None
+            to only get the current version.
+        :type since: int
+        :returns: (version, [(project, queue), ...])
+        :rtype: tuple
+        """
+
+        raise NotImplementedError
+
     @abc.abstractmethod
     def drop_all(self):
         """Drops all catalogue entries from storage."""
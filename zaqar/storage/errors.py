@@ -141,6 +141,17 @@ class QueueNotMapped(DoesNotExist):
         super(QueueNotMapped, self).__init__(queue=queue, project=project)
 
 
+class QueueIsMigrating(Conflict):
+
+    msg_format = (u'Queue {queue} for project {project} is already '
+                  u'being migrated to pool {pool}')
+
+    def __init__(self, queue, project, pool):
+        super(QueueIsMigrating, self).__init__(queue=queue,
+                                               project=project,
+                                               pool=pool)
+
+
 class PoolDoesNotExist(DoesNotExist):
 
     msg_format = u'Pool {pool} does not exist'
@@ -21,7 +21,18 @@ Serves to construct an association between a project + queue -> pool.
 
     {
         'p_q': project_queue :: six.text_type,
-        's': pool_identifier :: six.text_type
+        's': pool_identifier :: six.text_type,
+        'd': destination_pool_identifier :: six.text_type
+    }
+
+The destination is only set while the queue is being migrated.
+
+Changes to the catalogue are logged in a separate collection, keyed
+by the catalogue version that each change produced::
+
+    {
+        '_id': version :: int,
+        'p_q': project_queue :: six.text_type
     }
 """
 
@@ -40,6 +51,8 @@ CATALOGUE_INDEX = [
     (PRIMARY_KEY, 1)
 ]
 
+VERSION_ID = 'catalogue'
+
 
 class CatalogueController(base.CatalogueBase):
 
@@ -49,19 +62,46 @@ class CatalogueController(base.CatalogueBase):
         self._col = self.driver.database.catalogue
         self._col.ensure_index(CATALOGUE_INDEX, unique=True)
 
+        self._changes = self.driver.database.catalogue_changes
+        self._versions = self.driver.database.catalogue_versions
+
     @utils.raises_conn_error
     def _insert(self, project, queue, pool, upsert):
         key = utils.scope_queue_name(queue, project)
-        return self._col.update({PRIMARY_KEY: key},
-                                {'$set': {'s': pool}}, upsert=upsert)
+        res = self._col.update({PRIMARY_KEY: key},
+                               {'$set': {'s': pool}, '$unset': {'d': ''}},
+                               upsert=upsert, w=1)
+
+        if upsert or res['updatedExisting']:
+            self._record_change(key)
+
+        return res
+
+    def _record_change(self, key):
+        doc = self._versions.find_and_modify({'_id': VERSION_ID},
+                                             {'$inc': {'v': 1}},
+                                             upsert=True, new=True)
+        version = doc['v']
+
+        self._changes.insert({'_id': version, PRIMARY_KEY: key})
+        self._changes.remove(
+            {'_id': {'$lte': version - base.CATALOGUE_CHANGE_LOG_SIZE}},
+            w=self.driver.delete_write_concern)
 
     @utils.raises_conn_error
-    def list(self, project):
+    def list(self, project, marker=None, limit=None):
         fields = {'_id': 0}
 
-        query = utils.scoped_query(None, project)
-        return utils.HookedCursor(self._col.find(query, fields),
-                                  _normalize)
+        query = utils.scoped_query(marker, project)
+        cursor = self._col.find(query, fields)
+
+        if marker is not None or limit is not None:
+            cursor = cursor.sort(PRIMARY_KEY)
+
+        if limit is not None:
+            cursor = cursor.limit(limit)
+
+        return utils.HookedCursor(cursor, _normalize)
 
     @utils.raises_conn_error
     def get(self, project, queue):
@@ -86,8 +126,11 @@ class CatalogueController(base.CatalogueBase):
 
     @utils.raises_conn_error
     def delete(self, project, queue):
-        self._col.remove({PRIMARY_KEY: utils.scope_queue_name(queue, project)},
-                         w=0)
+        key = utils.scope_queue_name(queue, project)
+        # NOTE: The change must not be recorded before the entry is
+        # actually removed, or catalogs may cache it again.
+        self._col.remove({PRIMARY_KEY: key}, w=1)
+        self._record_change(key)
 
     def update(self, project, queue, pool=None):
         # NOTE(cpp-cabrera): _insert handles conn_error
@@ -96,16 +139,49 @@ class CatalogueController(base.CatalogueBase):
         if not res['updatedExisting']:
             raise errors.QueueNotMapped(queue, project)
 
+    @utils.raises_conn_error
+    def set_destination(self, project, queue, destination):
+        key = utils.scope_queue_name(queue, project)
+
+        if destination is None:
+            change = {'$unset': {'d': ''}}
+        else:
+            change = {'$set': {'d': destination}}
+
+        res = self._col.update({PRIMARY_KEY: key}, change, w=1)
+        if not res['updatedExisting']:
+            raise errors.QueueNotMapped(queue, project)
+
+        self._record_change(key)
+
+    @utils.raises_conn_error
+    def changes(self, since=None):
+        doc = self._versions.find_one({'_id': VERSION_ID})
+        version = doc['v'] if doc is not None else 0
+
+        if since is None or since >= version:
+            return version, []
+
+        cursor = self._changes.find({'_id': {'$gt': since, '$lte': version}},
+                                    fields={'_id': 0, PRIMARY_KEY: 1})
+
+        return version, [utils.parse_scoped_project_queue(change[PRIMARY_KEY])
+                         for change in cursor]
+
     @utils.raises_conn_error
     def drop_all(self):
         self._col.drop()
         self._col.ensure_index(CATALOGUE_INDEX, unique=True)
 
+        self._changes.drop()
+        self._versions.drop()
+
 
 def _normalize(entry):
     project, queue = utils.parse_scoped_project_queue(entry[PRIMARY_KEY])
     return {
         'queue': queue,
         'project': project,
-        'pool': entry['s']
+        'pool': entry['s'],
+        'destination': entry.get('d')
     }
@@ -22,6 +22,7 @@ Field Mappings:
 """
 
 import datetime
+import functools
 
 from bson import objectid
 from oslo_log import log as logging
@@ -29,6 +30,7 @@ from oslo_utils import timeutils
 
 from zaqar import storage
 from zaqar.storage import errors
+from zaqar.storage.mongodb import messages as mongo_messages
 from zaqar.storage.mongodb import utils
 
 
@@ -118,9 +120,12 @@ class ClaimController(storage.Claim):
 
         Since there's a lot of space for race conditions here,
         we'll check if the number of updated records is equal to
-        the max number of messages to claim. If the number of updated
-        messages is lower than limit we'll try to claim the remaining
-        number of messages.
+        the number of messages we tried to claim. If so, the
+        messages fetched by the first query are exactly the ones
+        that were claimed, and are returned as-is. Otherwise, some
+        of them were claimed by a parallel request, and we have
+        to query for the ones that were actually tagged with our
+        claim ID.
 
         This 2 queries are required because there's no way, as for the
         time being, to execute an update on a limited number of records.
@@ -133,7 +138,6 @@ class ClaimController(storage.Claim):
 
         now = timeutils.utcnow_ts()
         claim_expires = now + ttl
-        claim_expires_dt = datetime.datetime.utcfromtimestamp(claim_expires)
 
         message_ttl = ttl + grace
         message_expiration = datetime.datetime.utcfromtimestamp(
@@ -147,8 +151,9 @@ class ClaimController(storage.Claim):
 
         # Get a list of active, not claimed nor expired
         # messages that could be claimed.
-        msgs = msg_ctrl._active(queue, fields={'_id': 1}, project=project,
-                                limit=limit)
+        fields = {'_id': 1, 't': 1, 'b': 1}
+        msgs = list(msg_ctrl._active(queue, fields=fields, project=project,
+                                     limit=limit))
 
         messages = iter([])
         ids = [msg['_id'] for msg in msgs]
@@ -169,25 +174,29 @@ class ClaimController(storage.Claim):
         # to the current time when the message is
         # posted. There is no need to check whether
         # 'c' exists or 'c.id' is None.
+        #
+        # NOTE: In the same update, extend the expiration
+        # time of any messages that would otherwise expire
+        # before the claim (plus grace) does.
         collection = msg_ctrl._collection(queue, project)
         updated = collection.update({'_id': {'$in': ids},
                                      'c.e': {'$lte': now}},
-                                    {'$set': {'c': meta}},
+                                    {'$set': {'c': meta},
+                                     '$max': {'e': message_expiration,
+                                              't': message_ttl}},
                                     upsert=False,
-                                    multi=True)['n']
+                                    multi=True,
+                                    **self.driver.claim_write_concern)['n']
 
-        # NOTE(flaper87): Dirty hack!
-        # This sets the expiration time to
-        # `expires` on messages that would
-        # expire before claim.
-        new_values = {'e': message_expiration, 't': message_ttl}
-        collection.update({'p_q': utils.scope_queue_name(queue, project),
-                           'e': {'$lt': claim_expires_dt},
-                           'c.id': oid},
-                          {'$set': new_values},
-                          upsert=False, multi=True)
+        if updated == len(ids):
+            for msg in msgs:
+                msg['c'] = meta
+                msg['t'] = max(msg['t'], message_ttl)
+
+            messages = iter([mongo_messages._basic_message(msg, now)
+                             for msg in msgs])
 
-        if updated != 0:
+        elif updated != 0:
             # NOTE(kgriffs): This extra step is necessary because
             # in between having gotten a list of active messages
             # and updating them, some of them may have been
@@ -198,6 +207,25 @@ class ClaimController(storage.Claim):
 
         return str(oid), messages
 
+    def wait(self, queue, timeout, project=None):
+        notifications = self.driver.notifications
+        if notifications is None:
+            return super(ClaimController, self).wait(queue, timeout,
+                                                     project=project)
+
+        # NOTE: Only the counts are operations that use a connection,
+        # so the waiting in between is not counted in POOL_STATS.
+        ready = functools.partial(self._ready, queue, project)
+        return notifications.wait(queue, timeout, ready, project=project)
+
+    @utils.raises_conn_error
+    @utils.retries_on_autoreconnect
+    def _ready(self, queue, project=None):
+        """Returns True if there are messages to claim in a queue."""
+
+        msg_ctrl = self.driver.message_controller
+        return msg_ctrl._count(queue, project) > 0
+
     @utils.raises_conn_error
     @utils.retries_on_autoreconnect
     def update(self, queue, claim_id, metadata, project=None):
@@ -235,7 +263,8 @@ class ClaimController(storage.Claim):
         collection = msg_ctrl._collection(queue, project)
         collection.update({'p_q': scope, 'c.id': cid},
                           {'$set': {'c': meta}},
-                          upsert=False, multi=True)
+                          upsert=False, multi=True,
+                          **self.driver.claim_write_concern)
 
         # NOTE(flaper87): Dirty hack!
         # This sets the expiration time to
@@ -246,10 +275,15 @@ class ClaimController(storage.Claim):
                            'c.id': cid},
                           {'$set': {'e': message_expires,
                                     't': message_ttl}},
-                          upsert=False, multi=True)
+                          upsert=False, multi=True,
+                          **self.driver.claim_write_concern)
 
     @utils.raises_conn_error
     @utils.retries_on_autoreconnect
     def delete(self, queue, claim_id, project=None):
         msg_ctrl = self.driver.message_controller
         msg_ctrl._unclaim(queue, claim_id, project=project)
+
+        # NOTE: The released messages may be claimed again right away
+        if self.driver.notifications is not None:
+            self.driver.notifications.notify(queue, project)
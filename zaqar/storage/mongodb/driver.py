@@ -18,6 +18,7 @@
 import ssl
 
 from oslo_log import log as logging
+from oslo_utils import timeutils
 import pymongo
 import pymongo.errors
 
@@ -25,7 +26,10 @@ from zaqar.common import decorators
 from zaqar.i18n import _
 from zaqar import storage
 from zaqar.storage.mongodb import controllers
+from zaqar.storage.mongodb import messages
+from zaqar.storage.mongodb import notifications
 from zaqar.storage.mongodb import options
+from zaqar.storage.mongodb import utils
 
 
 LOG = logging.getLogger(__name__)
@@ -44,9 +48,9 @@ def _connection(conf):
     else:
         MongoClient = pymongo.MongoClient
 
-    if conf.uri and 'ssl=true' in conf.uri.lower():
-        kwargs = {}
+    kwargs = utils.connection_options(conf)
 
+    if conf.uri and 'ssl=true' in conf.uri.lower():
         # Default to CERT_REQUIRED
         ssl_cert_reqs = ssl.CERT_REQUIRED
 
@@ -65,9 +69,7 @@ def _connection(conf):
         if conf.ssl_ca_certs:
             kwargs['ssl_ca_certs'] = conf.ssl_ca_certs
 
-        return MongoClient(uri, **kwargs)
-
-    return MongoClient(uri)
+    return MongoClient(uri, **kwargs)
 
 
 class DataDriver(storage.DataDriverBase):
@@ -82,6 +84,8 @@ class DataDriver(storage.DataDriverBase):
         super(DataDriver, self).__init__(conf, cache, control_driver)
 
         self.mongodb_conf = self.conf[options.MESSAGE_MONGODB_GROUP]
+        self.delete_write_concern = utils.write_concern(
+            self.mongodb_conf.delete_write_concern)
 
         conn = self.connection
         server_version = conn.server_info()['version']
@@ -113,6 +117,23 @@ class DataDriver(storage.DataDriverBase):
 
             conn.write_concern['j'] = False
 
+        self.post_write_concern = utils.operation_write_concern(
+            conn.write_concern, self.mongodb_conf.post_write_concern,
+            self.mongodb_conf.post_write_timeout_ms)
+
+        self.claim_write_concern = utils.operation_write_concern(
+            conn.write_concern, self.mongodb_conf.claim_write_concern,
+            self.mongodb_conf.claim_write_timeout_ms)
+
+        # NOTE: Claims need to know which messages were updated, and
+        # posts must not be silently lost.
+        for write_concern in (self.post_write_concern,
+                              self.claim_write_concern):
+            if write_concern.get('w') == 0:
+                raise RuntimeError(_('Posts and claims must be '
+                                     'acknowledged, so their write '
+                                     'concern may not be 0'))
+
         # FIXME(flaper87): Make this dynamic
         self._capabilities = self.BASE_CAPABILITIES
 
@@ -133,19 +154,86 @@ class DataDriver(storage.DataDriverBase):
         KPI['storage_reachable'] = self.is_alive()
         KPI['operation_status'] = self._get_operation_status()
         message_volume = {'free': 0, 'claimed': 0, 'total': 0}
+        now = timeutils.utcnow_ts()
 
         for msg_col in [db.messages for db in self.message_databases]:
-            msg_count_claimed = msg_col.find({'c.id': {'$ne': None}}).count()
+            # NOTE: Count claimed messages by scanning the counting
+            # index alone, rather than every document, and get the
+            # total from the collection's metadata.
+            msg_count_claimed = msg_col.find({'c.e': {'$gt': now}}).hint(
+                messages.COUNTING_INDEX_FIELDS).count()
             message_volume['claimed'] += msg_count_claimed
 
-            msg_count_total = msg_col.find().count()
+            msg_count_total = msg_col.count()
             message_volume['total'] += msg_count_total
 
         message_volume['free'] = (message_volume['total'] -
                                   message_volume['claimed'])
         KPI['message_volume'] = message_volume
+
+        connection_pool = utils.POOL_STATS.snapshot()
+        connection_pool['max_size'] = self.connection.max_pool_size
+        KPI['connection_pool'] = connection_pool
+
         return KPI
 
+    def gc(self):
+        self.message_controller.gc()
+
+    def _load(self):
+        load = super(DataDriver, self)._load()
+
+        # NOTE: Only count messages that have not expired yet, from
+        # the TTL index alone. Marker reservations are kept in their
+        # own collection, so they are not counted as messages.
+        query = {'e': {'$gt': timeutils.utcnow()}}
+        load['message_volume'] = {
+            'total': sum(db.messages.find(query)
+                         .hint(messages.TTL_INDEX_FIELDS).count()
+                         for db in self.message_databases)
+        }
+
+        return load
+
+    def rebalance(self, dry_run=False):
+        """Moves queues to the partitions assigned to them by the ring.
+
+        After adding partitions, this moves the queues that the
+        partition ring now assigns to a different partition, one at
+        a time, while they remain available (see also
+        MessageController._move).
+
+        :param dry_run: (Default False) Only report the queues that
+            would be moved.
+        :returns: A generator of (project, queue, source, target)
+            tuples, yielded as each queue is moved.
+        """
+
+        message_ctrl = self.message_controller
+
+        # NOTE: Consider every queue that is either mapped already,
+        # or has messages in any of the partitions.
+        scopes = set(doc['_id'] for doc in
+                     self.partitions_database.map.find(fields={'_id': 1}))
+
+        for db in self.message_databases:
+            scopes.update(db.messages.distinct('p_q'))
+
+        for scope in sorted(scopes):
+            project, name = utils.parse_scoped_project_queue(scope)
+            project = project or None
+
+            source = message_ctrl._partition(name, project)
+            target = message_ctrl._ring.get_partition(name, project)
+
+            if source == target:
+                continue
+
+            if not dry_run:
+                message_ctrl._move(name, project, target)
+
+            yield project, name, source, target
+
     @decorators.lazy_property(write=False)
     def message_databases(self):
         """List of message databases, ordered by partition number."""
@@ -163,12 +251,35 @@ class DataDriver(storage.DataDriverBase):
         return [self.connection[name + self._COL_SUFIX + str(p)]
                 for p in range(partitions)]
 
+    @decorators.lazy_property(write=False)
+    def partitions_database(self):
+        """Database dedicated to the queue partition map."""
+        name = self.mongodb_conf.database + '_partitions'
+        return self.connection[name]
+
     @decorators.lazy_property(write=False)
     def subscriptions_database(self):
         """Database dedicated to the "subscription" collection."""
         name = self.mongodb_conf.database + '_subscriptions'
         return self.connection[name]
 
+    @decorators.lazy_property(write=False)
+    def notifications_database(self):
+        """Database dedicated to the notification events collection."""
+        name = self.mongodb_conf.database + '_notifications'
+        return self.connection[name]
+
+    @decorators.lazy_property(write=False)
+    def notifications(self):
+        """Notification engine, or None if notifications are disabled."""
+
+        if not self.mongodb_conf.notifications:
+            return None
+
+        return notifications.NotificationEngine(
+            self.notifications_database,
+            self.mongodb_conf.notification_events_size)
+
     @decorators.lazy_property(write=False)
     def connection(self):
         """MongoDB client connection instance."""
@@ -210,6 +321,8 @@ class ControlDriver(storage.ControlDriverBase):
                                 group=options.MANAGEMENT_MONGODB_GROUP)
 
         self.mongodb_conf = self.conf[options.MANAGEMENT_MONGODB_GROUP]
+        self.delete_write_concern = utils.write_concern(
+            self.mongodb_conf.delete_write_concern)
 
     @decorators.lazy_property(write=False)
     def connection(self):
@@ -133,7 +133,8 @@ class FlavorsController(base.FlavorsBase):
 
     @utils.raises_conn_error
     def delete(self, name, project=None):
-        self._col.remove({'n': name, 'p': project}, w=0)
+        self._col.remove({'n': name, 'p': project},
+                         w=self.driver.delete_write_concern)
 
     @utils.raises_conn_error
     def drop_all(self):
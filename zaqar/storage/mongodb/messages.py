@@ -30,6 +30,7 @@ from oslo_utils import timeutils
 import pymongo.errors
 import pymongo.read_preferences
 
+from zaqar.common import decorators
 from zaqar.i18n import _
 from zaqar import storage
 from zaqar.storage import errors
@@ -38,17 +39,27 @@ from zaqar.storage.mongodb import utils
 
 LOG = logging.getLogger(__name__)
 
-# NOTE(kgriffs): This value, in seconds, should be at least less than the
-# minimum allowed TTL for messages (60 seconds). Make it 45 to allow for
-# some fudge room.
-MAX_RETRY_POST_DURATION = 45
-
-# NOTE(kgriffs): It is extremely unlikely that all workers would somehow hang
-# for more than 5 seconds, without a single one being able to succeed in
-# posting some messages and incrementing the counter, thus allowing the other
-# producers to succeed in turn.
+# NOTE: It is extremely unlikely that a worker would somehow hang
+# for more than 5 seconds between reserving markers for a batch of
+# messages and finalizing it. Past this window, a pending batch is
+# assumed to have been abandoned by a crashed worker, and is cleaned up
+# by the garbage collector, so that it no longer holds up listings.
 COUNTER_STALL_WINDOW = 5
 
+# NOTE: How long the tombstones for the markers of an abandoned post
+# are kept, in seconds. The post must not be able to take those markers
+# after the garbage collector has released them.
+ABANDONED_MARKER_TTL = 3600
+
+# NOTE: How long, in seconds, each process caches the partition that a
+# queue is mapped to. Moving a queue to another partition must wait at
+# least this long before assuming the old partition is no longer used.
+PARTITION_CACHE_TTL = 5
+
+# NOTE: How long messages that are being popped remain claimed, should
+# the request fail part way through.
+POP_CLAIM_TTL = 30
+
 # For hinting
 ID_INDEX_FIELDS = [('_id', 1)]
 
@@ -65,30 +76,43 @@ PROJ_QUEUE = utils.PROJ_QUEUE_KEY
 # filtering out claimed ones.
 ACTIVE_INDEX_FIELDS = [
     (PROJ_QUEUE, 1),  # Project will be unique, so put first
+    ('tx', 1),  # Listings only include finalized messages (tx is None)
     ('k', 1),  # Used for sorting and paging, must come before range queries
     ('c.e', 1),  # Used for filtering out claimed messages
-
-    # NOTE(kgriffs): We do not include 'u' and 'tx' here on
-    # purpose. It was found experimentally that adding 'u' did
-    # not improve performance, and so it was left out in order
-    # to reduce index size and make updating the index
-    # faster. When 'tx' was added, it was assumed that it would
-    # follow a similar performance pattern to 'u', since by
-    # the time you traverse the index down past the fields
-    # listed above, there is very little left to scan, esp.
-    # considering all queries are limited (limit=) to a fairly
-    # small number.
-    #
-    # TODO(kgriffs): The extrapolation wrt 'tx' needs to be
-    # proven empirically.
+    ('u', 1),  # Used for filtering out the client's own messages
+
+    # NOTE: Earlier releases left 'tx' and 'u' out of this index,
+    # on the assumption that there was little left to scan once
+    # the index had been traversed past 'c.e'. That does not hold
+    # when the head of a queue consists of messages posted by the
+    # listing client, or when a batch of messages is being posted,
+    # since each of those documents had to be fetched only to be
+    # filtered out. With every predicate in the index, documents
+    # are only fetched when they are returned. Use the
+    # index_advisor scenario of zaqar-bench-storage to compare the
+    # keys and documents examined with each layout.
 ]
 
 # For counting
 COUNTING_INDEX_FIELDS = [
     (PROJ_QUEUE, 1),  # Project will be unique, so put first
+    ('tx', 1),  # Only finalized messages are counted
     ('c.e', 1),  # Used for filtering out claimed messages
 ]
 
+# NOTE: The layouts used by earlier releases, whose indexes are
+# superseded by the ones above (see also _ensure_indexes).
+LEGACY_ACTIVE_INDEX_FIELDS = [
+    (PROJ_QUEUE, 1),
+    ('k', 1),
+    ('c.e', 1),
+]
+
+LEGACY_COUNTING_INDEX_FIELDS = [
+    (PROJ_QUEUE, 1),
+    ('c.e', 1),
+]
+
 # Index used for claims
 CLAIMED_INDEX_FIELDS = [
     (PROJ_QUEUE, 1),
@@ -116,6 +140,15 @@ TRANSACTION_INDEX_FIELDS = [
     ('tx', 1),
 ]
 
+RESERVATION_INDEX_FIELDS = [
+    (PROJ_QUEUE, 1),
+    ('r', 1),
+]
+
+
+def _partition_key(queue, project=None):
+    return 'messagecontroller:partition:' + str(project) + '/' + queue
+
 
 class MessageController(storage.Message):
     """Implements message resource operations using MongoDB.
@@ -145,6 +178,13 @@ class MessageController(storage.Message):
         self._queue_ctrl = self.driver.queue_controller
         self._retry_range = range(self.driver.mongodb_conf.max_attempts)
 
+        # NOTE: Options for reads that only observe messages, such as
+        # listing messages and queue stats, as opposed to the reads
+        # done while claiming and deleting them.
+        self._observer_reads = utils.observer_read_options(
+            self.driver.mongodb_conf)
+        self._listing_reads = self._observer_reads
+
         # Create a list of 'messages' collections, one for each database
         # partition, ordered by partition number.
         #
@@ -159,6 +199,22 @@ class MessageController(storage.Message):
         for collection in self._collections:
             self._ensure_indexes(collection)
 
+        # NOTE: Queues are mapped to partitions by the persisted
+        # partition map, so that they keep their partition when the
+        # number of partitions changes. New queues are placed using
+        # a consistent-hash ring; queues that were created before the
+        # map was introduced stay where the "legacy" hash put them.
+        self._cache = self.driver.cache
+        self._partition_map = self.driver.partitions_database.map
+        self._ring = utils.PartitionRing(self._num_partitions)
+
+        settings = self.driver.partitions_database.settings.find_and_modify(
+            {'_id': 'legacy'},
+            {'$setOnInsert': {'n': self._num_partitions}},
+            upsert=True, new=True)
+
+        self._legacy_partitions = settings['n']
+
     # ----------------------------------------------------------------------
     # Helpers
     # ----------------------------------------------------------------------
@@ -171,8 +227,12 @@ class MessageController(storage.Message):
                                 expireAfterSeconds=0,
                                 background=True)
 
+        # NOTE: The 'active' and 'counting' indexes created by
+        # earlier releases are not dropped here, since servers that
+        # have not been upgraded yet still hint them. Drop them once
+        # every server has been upgraded.
         collection.ensure_index(ACTIVE_INDEX_FIELDS,
-                                name='active',
+                                name='active_v2',
                                 background=True)
 
         collection.ensure_index(CLAIMED_INDEX_FIELDS,
@@ -180,7 +240,7 @@ class MessageController(storage.Message):
                                 background=True)
 
         collection.ensure_index(COUNTING_INDEX_FIELDS,
-                                name='counting',
+                                name='counting_v2',
                                 background=True)
 
         collection.ensure_index(MARKER_INDEX_FIELDS,
@@ -193,8 +253,157 @@ class MessageController(storage.Message):
 
     def _collection(self, queue_name, project=None):
         """Get a partitioned collection instance."""
-        return self._collections[utils.get_partition(self._num_partitions,
-                                                     queue_name, project)]
+        return self._collections[self._partition(queue_name, project)]
+
+    @decorators.caches(_partition_key, PARTITION_CACHE_TTL,
+                       lambda v: v is not None)
+    def _mapped_partition(self, queue_name, project=None):
+        doc = self._partition_map.find_one(
+            {'_id': utils.scope_queue_name(queue_name, project)},
+            fields={'pt': 1})
+
+        return None if doc is None else doc['pt']
+
+    def _map_partition(self, queue_name, project=None, partition=None):
+        """Maps a queue to a partition, unless it is already mapped.
+
+        :param partition: (Default None) Partition number. If not
+            specified, the queue is placed using the partition ring.
+        :returns: The partition the queue is mapped to.
+        """
+
+        if partition is None:
+            partition = self._ring.get_partition(queue_name, project)
+
+        doc = self._partition_map.find_and_modify(
+            {'_id': utils.scope_queue_name(queue_name, project)},
+            {'$setOnInsert': {'pt': partition}},
+            upsert=True, new=True)
+
+        return doc['pt']
+
+    def _partition(self, queue_name, project=None):
+        """Returns the number of the partition that holds a queue."""
+
+        partition = self._mapped_partition(queue_name, project)
+        if partition is not None:
+            return partition
+
+        partition = utils.get_partition(self._legacy_partitions,
+                                        queue_name, project)
+
+        # NOTE: The queue was created before the partition map was
+        # introduced, so pin it to its legacy partition. Queues that
+        # do not exist yet are not pinned, since they will be placed
+        # using the ring when they are created (see also
+        # MessageQueueHandler.create).
+        if self._queue_ctrl.exists(queue_name, project):
+            partition = self._map_partition(queue_name, project, partition)
+
+        return partition
+
+    def _copy_messages(self, source, target, queue_name, project=None,
+                       pending=True, copied_ids=None):
+        """Copies messages that are missing from the target partition.
+
+        :param pending: (Default True) Whether to also copy messages
+            that are part of an unfinalized transaction.
+        :param copied_ids: (Default None) IDs of the messages that
+            were copied earlier, which are not copied again even if
+            they were deleted from the target partition since. The
+            IDs of the messages copied now are added to it.
+        :returns: The number of messages copied.
+        """
+
+        if copied_ids is None:
+            copied_ids = set()
+
+        query = {PROJ_QUEUE: utils.scope_queue_name(queue_name, project)}
+        if not pending:
+            query['tx'] = None
+
+        copied = 0
+        batch = []
+
+        def flush():
+            ids = [msg['_id'] for msg in batch]
+            existing = set(doc['_id'] for doc in
+                           target.find({'_id': {'$in': ids}},
+                                       fields={'_id': 1}))
+
+            missing = [msg for msg in batch if msg['_id'] not in existing]
+            copied_ids.update(ids)
+
+            if missing:
+                target.insert(missing)
+
+            return len(missing)
+
+        for msg in source.find(query, sort=[('k', 1)]):
+            if msg['_id'] in copied_ids:
+                continue
+
+            batch.append(msg)
+            if len(batch) == 1000:
+                copied += flush()
+                batch = []
+
+        if batch:
+            copied += flush()
+
+        return copied
+
+    def _move(self, queue_name, project, partition):
+        """Moves a queue's messages to another partition.
+
+        The queue remains writable while its messages are moved:
+
+        1. Finalized messages are copied to the target partition.
+        2. The queue is mapped to the target partition, after which
+           new requests use it.
+        3. Once every process's cached mapping has expired, any
+           messages that were posted or finalized in the source
+           partition in the meantime, and that were not copied in
+           step 1, are copied over, and the source partition is
+           purged.
+
+        Claims made and messages deleted in the source partition
+        between steps 1 and 2 are not carried over, so such messages
+        may be delivered again.
+
+        :returns: The number of messages copied, or None if the queue
+            already lives in the given partition.
+        """
+
+        current = self._partition(queue_name, project)
+        if current == partition:
+            return None
+
+        source = self._collections[current]
+        target = self._collections[partition]
+
+        copied_ids = set()
+        copied = self._copy_messages(source, target, queue_name, project,
+                                     pending=False, copied_ids=copied_ids)
+
+        self._partition_map.update(
+            {'_id': utils.scope_queue_name(queue_name, project)},
+            {'$set': {'pt': partition}}, upsert=True)
+
+        if self._cache is not None:
+            del self._cache[_partition_key(queue_name, project)]
+
+        time.sleep(PARTITION_CACHE_TTL + 1)
+
+        # NOTE: Messages copied in the first pass may have been deleted
+        # from the target partition since, so they must not be copied
+        # again from the source partition.
+        copied += self._copy_messages(source, target, queue_name, project,
+                                      copied_ids=copied_ids)
+        source.remove({PROJ_QUEUE: utils.scope_queue_name(queue_name,
+                                                          project)})
+
+        return copied
 
     def _backoff_sleep(self, attempt):
         """Sleep between retries using a jitter algorithm.
@@ -226,11 +435,29 @@ class MessageController(storage.Message):
         """
         scope = utils.scope_queue_name(queue_name, project)
         collection = self._collection(queue_name, project)
-        collection.remove({PROJ_QUEUE: scope}, w=0)
+        collection.remove({PROJ_QUEUE: scope},
+                          w=self.driver.delete_write_concern)
+
+    def _marker_horizon(self, queue_name, project=None):
+        """Returns the marker at which listings must stop, if any.
+
+        Messages are not guaranteed to be listed in FIFO order by
+        this controller, so listings are never held up.
+        """
+        return None
+
+    def gc(self):
+        """Collects garbage left behind by crashed workers.
+
+        Expired messages are removed by MongoDB itself, so there is
+        nothing to collect by default.
+        """
+        pass
 
     def _list(self, queue_name, project=None, marker=None,
               echo=False, client_uuid=None, fields=None,
-              include_claimed=False, sort=1, limit=None):
+              include_claimed=False, sort=1, limit=None,
+              read_options=None):
         """Message document listing helper.
 
         :param queue_name: Name of the queue to list
@@ -254,6 +481,9 @@ class MessageController(storage.Message):
             to list. The results may include fewer messages than the
             requested `limit` if not enough are available. If limit is
             not specified
+        :param read_options: (Default None) Additional options for the
+            query, such as a read preference. If not specified, the
+            connection's defaults are used.
 
         :returns: Generator yielding up to `limit` messages.
         """
@@ -279,8 +509,17 @@ class MessageController(storage.Message):
         if not echo:
             query['u'] = {'$ne': client_uuid}
 
+        marker_range = {}
+
         if marker is not None:
-            query['k'] = {'$gt': marker}
+            marker_range['$gt'] = marker
+
+        horizon = self._marker_horizon(queue_name, project)
+        if horizon is not None:
+            marker_range['$lt'] = horizon
+
+        if marker_range:
+            query['k'] = marker_range
 
         collection = self._collection(queue_name, project)
 
@@ -290,7 +529,8 @@ class MessageController(storage.Message):
             query['c.e'] = {'$lte': now}
 
         # Construct the request
-        cursor = collection.find(query, fields=fields, sort=[('k', sort)])
+        cursor = collection.find(query, fields=fields, sort=[('k', sort)],
+                                 **(read_options or {}))
 
         if limit is not None:
             cursor.limit(limit)
@@ -314,6 +554,15 @@ class MessageController(storage.Message):
         Note: Some expired messages may be included in the count if
             they haven't been GC'd yet. This is done for performance.
         """
+        query = self._count_query(queue_name, project, include_claimed)
+
+        collection = self._collection(queue_name, project)
+        cursor = collection.find(query, **self._observer_reads)
+        return cursor.hint(COUNTING_INDEX_FIELDS).count()
+
+    def _count_query(self, queue_name, project=None, include_claimed=False):
+        """Returns the query used by _count."""
+
         query = {
             # Messages must belong to this queue and project.
             PROJ_QUEUE: utils.scope_queue_name(queue_name, project),
@@ -330,8 +579,85 @@ class MessageController(storage.Message):
             # Exclude messages that are claimed
             query['c.e'] = {'$lte': timeutils.utcnow_ts()}
 
+        return query
+
+    def _stats(self, queue_name, project=None):
+        """Returns the message stats of a queue.
+
+        The counts are aggregated from the counting index alone, and
+        the oldest and newest messages are looked up by marker.
+
+        :returns: A dict with the 'claimed' and 'total' message counts,
+            and the IDs of the 'oldest' and 'newest' messages, or None
+            if the queue does not have any messages.
+        """
+
+        now = timeutils.utcnow_ts()
+        query = {
+            PROJ_QUEUE: utils.scope_queue_name(queue_name, project),
+
+            # NOTE: Messages must be finalized (i.e., must not
+            # be part of an unfinalized transaction).
+            'tx': None,
+        }
+
+        pipeline = [
+            {'$match': query},
+
+            # NOTE: Only project fields of COUNTING_INDEX_FIELDS, so
+            # that the documents themselves do not need to be read.
+            {'$project': {'_id': 0, PROJ_QUEUE: 1, 'c.e': 1}},
+            {'$group': {
+                '_id': '$' + PROJ_QUEUE,
+                'total': {'$sum': 1},
+                'claimed': {
+                    '$sum': {'$cond': [{'$gt': ['$c.e', now]}, 1, 0]},
+                },
+            }},
+        ]
+
         collection = self._collection(queue_name, project)
-        return collection.find(query).hint(COUNTING_INDEX_FIELDS).count()
+        result = collection.aggregate(pipeline, **self._observer_reads)
+        if not result['result']:
+            return None
+
+        stats = result['result'][0]
+        del stats['_id']
+
+        for key, sort in (('oldest', 1), ('newest', -1)):
+            cursor = collection.find(query, fields=['_id'],
+                                     sort=[('k', sort)],
+                                     **self._observer_reads)
+            cursor = cursor.hint(ACTIVE_INDEX_FIELDS).limit(1)
+
+            # NOTE: The messages may have been removed after they
+            # were counted.
+            for doc in cursor:
+                stats[key] = doc['_id']
+
+            if key not in stats:
+                return None
+
+        return stats
+
+    def _client_uuids(self, queue_name, message_ids, project=None):
+        """Returns the UUIDs of the clients that posted some messages.
+
+        :returns: A dict that maps the ID of each message that
+            exists to the UUID of the client that posted it.
+        """
+
+        message_ids = [mid for mid in map(utils.to_oid, message_ids) if mid]
+        query = {
+            '_id': {'$in': message_ids},
+            PROJ_QUEUE: utils.scope_queue_name(queue_name, project),
+        }
+
+        collection = self._collection(queue_name, project)
+        messages = collection.find(query, fields={'u': 1}).hint(
+            ID_INDEX_FIELDS)
+
+        return dict((str(msg['_id']), msg['u']) for msg in messages)
 
     def _active(self, queue_name, marker=None, echo=False,
                 client_uuid=None, fields=None, project=None,
@@ -410,7 +736,8 @@ class MessageController(storage.Message):
 
         messages = self._list(queue_name, project=project, marker=marker,
                               client_uuid=client_uuid, echo=echo,
-                              include_claimed=include_claimed, limit=limit)
+                              include_claimed=include_claimed, limit=limit,
+                              read_options=self._listing_reads)
 
         marker_id = {}
 
@@ -431,7 +758,7 @@ class MessageController(storage.Message):
     def first(self, queue_name, project=None, sort=1):
         cursor = self._list(queue_name, project=project,
                             include_claimed=True, sort=sort,
-                            limit=1)
+                            limit=1, read_options=self._observer_reads)
         try:
             message = next(cursor)
         except StopIteration:
@@ -456,7 +783,8 @@ class MessageController(storage.Message):
         }
 
         collection = self._collection(queue_name, project)
-        message = list(collection.find(query).limit(1).hint(ID_INDEX_FIELDS))
+        cursor = collection.find(query, **self._observer_reads)
+        message = list(cursor.limit(1).hint(ID_INDEX_FIELDS))
 
         if not message:
             raise errors.MessageDoesNotExist(message_id, queue_name,
@@ -483,7 +811,8 @@ class MessageController(storage.Message):
 
         # NOTE(flaper87): Should this query
         # be sorted?
-        messages = collection.find(query).hint(ID_INDEX_FIELDS)
+        messages = collection.find(query, **self._observer_reads).hint(
+            ID_INDEX_FIELDS)
 
         def denormalizer(msg):
             return _basic_message(msg, now)
@@ -526,7 +855,11 @@ class MessageController(storage.Message):
             for index, message in enumerate(messages)
         ]
 
-        ids = collection.insert(prepared_messages)
+        ids = collection.insert(prepared_messages,
+                                **self.driver.post_write_concern)
+
+        if self.driver.notifications is not None:
+            self.driver.notifications.notify(queue_name, project)
 
         return [str(id_) for id_ in ids]
 
@@ -576,11 +909,12 @@ class MessageController(storage.Message):
 
                     raise errors.MessageNotClaimed(message_id)
 
-        collection.remove(query['_id'], w=0)
+        collection.remove(query['_id'], w=self.driver.delete_write_concern)
 
     @utils.raises_conn_error
     @utils.retries_on_autoreconnect
-    def bulk_delete(self, queue_name, message_ids, project=None):
+    def bulk_delete(self, queue_name, message_ids, project=None,
+                    claim=None):
         message_ids = [mid for mid in map(utils.to_oid, message_ids) if mid]
         query = {
             '_id': {'$in': message_ids},
@@ -588,37 +922,112 @@ class MessageController(storage.Message):
         }
 
         collection = self._collection(queue_name, project)
-        collection.remove(query, w=0)
+
+        if claim is None:
+            collection.remove(query, w=self.driver.delete_write_concern)
+            return []
+
+        cid = utils.to_oid(claim)
+        if cid is None:
+            raise errors.ClaimDoesNotExist(queue_name, project, claim)
+
+        # NOTE: Check ownership as part of the remove itself, rather
+        # than finding each message first. The write is acknowledged
+        # so that we know how many messages were removed; only when
+        # some of them were not do we need to look up which ones.
+        owned = dict(query)
+        owned['c.id'] = cid
+        owned['c.e'] = {'$gt': timeutils.utcnow_ts()}
+
+        result = collection.remove(owned, w=1)
+        if result['n'] == len(message_ids):
+            return []
+
+        # NOTE: Messages that no longer exist are treated as
+        # deleted, same as in delete().
+        pref = pymongo.read_preferences.ReadPreference.PRIMARY
+        remaining = collection.find(query, fields={'_id': 1},
+                                    read_preference=pref)
+
+        return [str(doc['_id']) for doc in remaining]
 
     @utils.raises_conn_error
     @utils.retries_on_autoreconnect
     def pop(self, queue_name, limit, project=None):
-        query = {
-            PROJ_QUEUE: utils.scope_queue_name(queue_name, project),
-        }
+        # NOTE: Rather than removing messages one at a time, claim
+        # a batch of active messages under a claim ID that is never
+        # handed out, read back the ones that were actually claimed,
+        # and then remove them, for a fixed number of round trips.
+        #
+        # Messages are only returned once they have been removed,
+        # preserving at-most-once delivery. If we fail part way
+        # through, the messages become active again when the
+        # claim expires.
+        msgs = self._active(queue_name, fields={'_id': 1},
+                            project=project, limit=limit)
 
-        # Only include messages that are not part of
-        # any claim, or are part of an expired claim.
-        now = timeutils.utcnow_ts()
-        query['c.e'] = {'$lte': now}
+        ids = [msg['_id'] for msg in msgs]
+        if not ids:
+            return []
 
+        now = timeutils.utcnow_ts()
+        cid = objectid.ObjectId()
+        scope = utils.scope_queue_name(queue_name, project)
         collection = self._collection(queue_name, project)
-        fields = {'_id': 1, 't': 1, 'b': 1, 'c.id': 1}
 
-        messages = (collection.find_and_modify(query,
-                                               fields=fields,
-                                               remove=True)
-                    for _ in range(limit))
+        # NOTE: Filter by 'c.e' to skip any messages that were
+        # claimed by a parallel request in the meantime (see also
+        # ClaimController.create).
+        meta = {'id': cid, 't': POP_CLAIM_TTL, 'e': now + POP_CLAIM_TTL}
+        collection.update({'_id': {'$in': ids}, 'c.e': {'$lte': now}},
+                          {'$set': {'c': meta}},
+                          upsert=False, multi=True)
+
+        query = {PROJ_QUEUE: scope, 'c.id': cid}
+
+        # NOTE: Read from the primary, since the claim may not
+        # have made it to the secondaries yet.
+        preference = pymongo.read_preferences.ReadPreference.PRIMARY
+        fields = {'_id': 1, 't': 1, 'b': 1}
+        messages = list(collection.find(query, fields=fields,
+                                        sort=[('k', 1)],
+                                        read_preference=preference).hint(
+                                            CLAIMED_INDEX_FIELDS))
+
+        if not messages:
+            return []
+
+        collection.remove(query)
 
-        final_messages = [_basic_message(message, now)
-                          for message in messages
-                          if message]
+        # NOTE: The claim ID is internal to this method, so don't
+        # leak it to the caller.
+        for message in messages:
+            message['c'] = {'id': None}
 
-        return final_messages
+        return [_basic_message(message, now) for message in messages]
 
 
 class FIFOMessageController(MessageController):
 
+    def __init__(self, *args, **kwargs):
+        super(FIFOMessageController, self).__init__(*args, **kwargs)
+
+        # NOTE: Listings must see the same pending markers as the
+        # primary does (see also _marker_horizon), so they can not
+        # be served from secondaries that may be lagging behind.
+        self._listing_reads = {}
+
+        # NOTE: Pending transactions are kept apart from the messages,
+        # in each partition, so that finding the lowest reservation
+        # for a queue is a single indexed lookup.
+        self._reservations = [db.reservations
+                              for db in self.driver.message_databases]
+
+        for reservations in self._reservations:
+            reservations.ensure_index(RESERVATION_INDEX_FIELDS,
+                                      name='queue_reservation',
+                                      background=True)
+
     def _ensure_indexes(self, collection):
         """Ensures that all indexes are created."""
 
@@ -627,8 +1036,12 @@ class FIFOMessageController(MessageController):
                                 expireAfterSeconds=0,
                                 background=True)
 
+        # NOTE: The 'active' and 'counting' indexes created by
+        # earlier releases are not dropped here, since servers that
+        # have not been upgraded yet still hint them. Drop them once
+        # every server has been upgraded.
         collection.ensure_index(ACTIVE_INDEX_FIELDS,
-                                name='active',
+                                name='active_v2',
                                 background=True)
 
         collection.ensure_index(CLAIMED_INDEX_FIELDS,
@@ -636,7 +1049,7 @@ class FIFOMessageController(MessageController):
                                 background=True)
 
         collection.ensure_index(COUNTING_INDEX_FIELDS,
-                                name='counting',
+                                name='counting_v2',
                                 background=True)
 
         # NOTE(kgriffs): This index must be unique so that
@@ -655,66 +1068,172 @@ class FIFOMessageController(MessageController):
                                 name='transaction',
                                 background=True)
 
-    @utils.raises_conn_error
-    @utils.retries_on_autoreconnect
-    def post(self, queue_name, messages, client_uuid, project=None):
-        # NOTE(flaper87): This method should be safe to retry on
-        # autoreconnect, since we've a 2-step insert for messages.
-        # The worst-case scenario is that we'll increase the counter
-        # several times and we'd end up with some non-active messages.
+    def _reservation_collection(self, queue_name, project=None):
+        """Get the partitioned collection of pending transactions."""
+        return self._reservations[self._partition(queue_name, project)]
+
+    def _marker_horizon(self, queue_name, project=None):
+        """Returns the lowest marker that is still being posted.
+
+        Each post reserves a range of markers up front, and then
+        inserts its messages, so a batch with higher markers may
+        become visible before one with lower markers. Listings must
+        stop short of the lowest marker that is still being posted;
+        otherwise an observer paging through the queue could advance
+        its marker past messages that have not yet become visible,
+        and never see them.
+
+        A post that takes its markers without contention records
+        them along with the counter (see also _post_uncontended).
+        Otherwise, it first records a reservation for its pending
+        transaction, with a lower bound for the markers it is about
+        to take (see also _post_pending). The counter is read before
+        the reservations, so that posts which take their markers in
+        the meantime are held back by the counter itself.
+
+        Posts that stall are abandoned by gc(), so this only reads.
+
+        :param queue_name: Name of the queue to check
+        :param project: Queue's project
+        :returns: The marker at which listings must stop, or None if
+            the queue does not exist.
+        """
 
-        if not self._queue_ctrl.exists(queue_name, project):
-            raise errors.QueueDoesNotExist(queue_name, project)
+        horizon = self._queue_ctrl._get_horizon(queue_name, project)
+        if horizon is None:
+            return None
 
-        now = timeutils.utcnow_ts()
-        now_dt = datetime.datetime.utcfromtimestamp(now)
-        collection = self._collection(queue_name, project)
+        reservations = self._reservation_collection(queue_name, project)
+        cursor = reservations.find(
+            {PROJ_QUEUE: utils.scope_queue_name(queue_name, project)},
+            fields={'r': 1, '_id': 0}, sort=[('r', 1)]).limit(1)
+
+        for doc in cursor.hint(RESERVATION_INDEX_FIELDS):
+            horizon = min(horizon, doc['r'])
+
+        return horizon
+
+    def _finalize_messages(self, collection, reservations, transaction):
+        """Makes the messages in a committed transaction visible."""
+
+        collection.update({'tx': transaction},
+                          {'$set': {'tx': None}},
+                          upsert=False, multi=True,
+                          **self.driver.post_write_concern)
+
+        reservations.remove({'_id': transaction},
+                            w=self.driver.delete_write_concern)
+
+    def _finalize(self, collection, reservations, transaction):
+        """Commits a pending transaction, and makes its messages visible.
+
+        :returns: True if the messages were finalized, or False if
+            the transaction had stalled, and was abandoned by gc()
+            in the meantime.
+        """
+
+        result = reservations.update({'_id': transaction},
+                                     {'$set': {'f': True}},
+                                     upsert=False, w=1)
+
+        if not result['n']:
+            return False
+
+        self._finalize_messages(collection, reservations, transaction)
+        return True
+
+    def _post_uncontended(self, queue_name, project, messages, counter):
+        """Posts messages when no other post is taking markers.
+
+        The markers are reserved along with the counter, in a single
+        update, so the messages are inserted as visible right away.
+
+        :param counter: Counter value that was read beforehand
+        :returns: The IDs of the posted messages, or None if the
+            counter was contended.
+        """
 
-        # Set the next basis marker for the first attempt.
-        #
-        # Note that we don't increment the counter right away because
-        # if 2 concurrent posts happen and the one with the higher counter
-        # ends before the one with the lower counter, there's a window
-        # where a client paging through the queue may get the messages
-        # with the higher counter and skip the previous ones. This would
-        # make our FIFO guarantee unsound.
-        next_marker = self._queue_ctrl._get_counter(queue_name, project)
-
-        # Unique transaction ID to facilitate atomic batch inserts
         transaction = objectid.ObjectId()
+        if not self._queue_ctrl._reserve_counter(
+                queue_name, project, counter, len(messages), transaction):
+            return None
 
-        prepared_messages = [
-            {
-                PROJ_QUEUE: utils.scope_queue_name(queue_name, project),
-                't': message['ttl'],
-                'e': now_dt + datetime.timedelta(seconds=message['ttl']),
-                'u': client_uuid,
-                'c': {'id': None, 'e': now},
-                'b': message['body'] if 'body' in message else {},
-                'k': next_marker + index,
-                'tx': transaction,
-            }
+        collection = self._collection(queue_name, project)
+        for index, message in enumerate(messages):
+            message['k'] = counter + index
+            message['tx'] = None
 
-            for index, message in enumerate(messages)
-        ]
+        try:
+            ids = collection.insert(messages,
+                                    **self.driver.post_write_concern)
 
-        # NOTE(kgriffs): Don't take the time to do a 2-phase insert
-        # if there is no way for it to partially succeed.
-        if len(prepared_messages) == 1:
-            transaction = None
-            prepared_messages[0]['tx'] = None
+        except pymongo.errors.DuplicateKeyError:
+            # NOTE: The post stalled, and gc() abandoned the markers
+            # that were still missing, so post the remaining messages
+            # again, with new markers.
+            ids = [message['_id'] for message in messages]
+            inserted = set(doc['_id'] for doc in collection.find(
+                {'_id': {'$in': ids}}, fields={'_id': 1}))
 
-        # Use a retry range for sanity, although we expect
-        # to rarely, if ever, reach the maximum number of
-        # retries.
-        #
-        # NOTE(kgriffs): With the default configuration (100 ms
-        # max sleep, 1000 max attempts), the max stall time
-        # before the operation is abandoned is 49.95 seconds.
+            ids = [id_ for id_ in ids if id_ in inserted]
+            remaining = [message for message in messages
+                         if message['_id'] not in inserted]
+
+            for message in remaining:
+                del message['_id']
+
+            counter = self._queue_ctrl._get_counter(queue_name, project)
+            ids += self._post_pending(queue_name, project, remaining,
+                                      counter)
+
+        finally:
+            self._queue_ctrl._release_counter(queue_name, project,
+                                              transaction)
+
+        return ids
+
+    def _post_pending(self, queue_name, project, messages, counter):
+        """Posts messages as part of a pending transaction.
+
+        This is used when another post is taking markers at the same
+        time, so that the messages do not become visible until every
+        marker before theirs is taken (see also _marker_horizon).
+
+        :param counter: Counter value that was read beforehand, which
+            is a lower bound for the markers that will be taken.
+        :returns: The IDs of the posted messages
+        :raises: MessageConflict if every attempt stalled
+        """
+
+        collection = self._collection(queue_name, project)
+        reservations = self._reservation_collection(queue_name, project)
+        msgs_n = len(messages)
+
+        # NOTE: We only need to retry in the unlikely event that the
+        # post took so long that the transaction was abandoned.
         for attempt in self._retry_range:
-            try:
-                ids = collection.insert(prepared_messages)
+            transaction = objectid.ObjectId()
+
+            # NOTE: The reservation must be recorded before taking
+            # the markers from the counter.
+            reservations.insert({
+                '_id': transaction,
+                PROJ_QUEUE: utils.scope_queue_name(queue_name, project),
+                'r': counter,
+            }, w=1)
+
+            next_marker = self._queue_ctrl._inc_counter(
+                queue_name, project, amount=msgs_n) - msgs_n
+
+            for index, message in enumerate(messages):
+                message.pop('_id', None)
+                message['k'] = next_marker + index
+                message['tx'] = transaction
+
+            ids = collection.insert(messages,
+                                    **self.driver.post_write_concern)
 
+            if self._finalize(collection, reservations, transaction):
                 # Log a message if we retried, for debugging perf issues
                 if attempt != 0:
                     msgtmpl = _(u'%(attempts)d attempt(s) required to post '
@@ -727,113 +1246,24 @@ class FIFOMessageController(MessageController):
                                    num_messages=len(ids),
                                    project=project))
 
-                # Update the counter in preparation for the next batch
-                #
-                # NOTE(kgriffs): Due to the unique index on the messages
-                # collection, competing inserts will fail as a whole,
-                # and keep retrying until the counter is incremented
-                # such that the competing marker's will start at a
-                # unique number, 1 past the max of the messages just
-                # inserted above.
-                self._queue_ctrl._inc_counter(queue_name, project,
-                                              amount=len(ids))
-
-                # NOTE(kgriffs): Finalize the insert once we can say that
-                # all the messages made it. This makes bulk inserts
-                # atomic, assuming queries filter out any non-finalized
-                # messages.
-                if transaction is not None:
-                    collection.update({'tx': transaction},
-                                      {'$set': {'tx': None}},
-                                      upsert=False, multi=True)
-
-                return [str(id_) for id_ in ids]
-
-            except pymongo.errors.DuplicateKeyError as ex:
-                # TODO(kgriffs): Record stats of how often retries happen,
-                # and how many attempts, on average, are required to insert
-                # messages.
-
-                # NOTE(kgriffs): This can be used in conjunction with the
-                # log line, above, that is emitted after all messages have
-                # been posted, to gauge how long it is taking for messages
-                # to be posted to a given queue, or overall.
-                #
-                # TODO(kgriffs): Add transaction ID to help match up loglines
-                if attempt == 0:
-                    msgtmpl = _(u'First attempt failed while '
-                                u'adding messages to queue '
-                                u'"%(queue)s" under project %(project)s')
+                return ids
 
-                    LOG.debug(msgtmpl, dict(queue=queue_name, project=project))
-
-                # NOTE(kgriffs): Never retry past the point that competing
-                # messages expire and are GC'd, since once they are gone,
-                # the unique index no longer protects us from getting out
-                # of order, which could cause an observer to miss this
-                # message. The code below provides a sanity-check to ensure
-                # this situation can not happen.
-                elapsed = timeutils.utcnow_ts() - now
-                if elapsed > MAX_RETRY_POST_DURATION:
-                    msgtmpl = _(u'Exceeded maximum retry duration for queue '
-                                u'"%(queue)s" under project %(project)s')
+            msgtmpl = _(u'Abandoning a stalled post of %(num_messages)d '
+                        u'messages to queue "%(queue)s" under project '
+                        u'%(project)s')
+
+            LOG.warning(msgtmpl,
+                        dict(queue=queue_name,
+                             num_messages=msgs_n,
+                             project=project))
 
-                    LOG.warning(msgtmpl,
-                                dict(queue=queue_name, project=project))
-                    break
-
-                # Chill out for a moment to mitigate thrashing/thundering
-                self._backoff_sleep(attempt)
-
-                # NOTE(kgriffs): Perhaps we failed because a worker crashed
-                # after inserting messages, but before incrementing the
-                # counter; that would cause all future requests to stall,
-                # since they would keep getting the same base marker that is
-                # conflicting with existing messages, until the messages that
-                # "won" expire, at which time we would end up reusing markers,
-                # and that could make some messages invisible to an observer
-                # that is querying with a marker that is large than the ones
-                # being reused.
-                #
-                # To mitigate this, we apply a heuristic to determine whether
-                # a counter has stalled. We attempt to increment the counter,
-                # but only if it hasn't been updated for a few seconds, which
-                # should mean that nobody is left to update it!
-                #
-                # Note that we increment one at a time until the logjam is
-                # broken, since we don't know how many messages were posted
-                # by the worker before it crashed.
-                next_marker = self._queue_ctrl._inc_counter(
-                    queue_name, project, window=COUNTER_STALL_WINDOW)
-
-                # Retry the entire batch with a new sequence of markers.
-                #
-                # NOTE(kgriffs): Due to the unique index, and how
-                # MongoDB works with batch requests, we will never
-                # end up with a partially-successful update. The first
-                # document in the batch will fail to insert, and the
-                # remainder of the documents will not be attempted.
-                if next_marker is None:
-                    # NOTE(kgriffs): Usually we will end up here, since
-                    # it should be rare that a counter becomes stalled.
-                    next_marker = self._queue_ctrl._get_counter(
-                        queue_name, project)
-                else:
-                    msgtmpl = (u'Detected a stalled message counter for '
-                               u'queue "%(queue)s" under project %(project)s. '
-                               u'The counter was incremented to %(value)d.')
-
-                    LOG.warning(msgtmpl,
-                                dict(queue=queue_name,
-                                     project=project,
-                                     value=next_marker))
-
-                for index, message in enumerate(prepared_messages):
-                    message['k'] = next_marker + index
-
-            except Exception as ex:
-                LOG.exception(ex)
-                raise
+            # NOTE: The abandoned messages are invisible, but remove
+            # them anyway rather than waiting for them to expire.
+            collection.remove({'tx': transaction},
+                              w=self.driver.delete_write_concern)
+
+            # Chill out for a moment to mitigate thrashing/thundering
+            self._backoff_sleep(attempt)
 
         msgtmpl = _(u'Hit maximum number of attempts (%(max)s) for queue '
                     u'"%(queue)s" under project %(project)s')
@@ -845,6 +1275,128 @@ class FIFOMessageController(MessageController):
 
         raise errors.MessageConflict(queue_name, project)
 
+    def _abandon_markers(self, queue_name, project, counter):
+        """Abandons markers that a stalled post took without contention.
+
+        Any of the reserved markers that are still missing are taken
+        by invisible tombstones, so that the stalled post can no
+        longer insert messages with them once the markers have been
+        released (see also _post_uncontended).
+        """
+
+        scope = utils.scope_queue_name(queue_name, project)
+        collection = self._collection(queue_name, project)
+        first, last = counter['b'], counter['b'] + counter['n']
+
+        existing = set(doc['k'] for doc in collection.find(
+            {PROJ_QUEUE: scope, 'k': {'$gte': first, '$lt': last}},
+            fields={'k': 1, '_id': 0}).hint(MARKER_INDEX_FIELDS))
+
+        expires = timeutils.utcnow() + datetime.timedelta(
+            seconds=ABANDONED_MARKER_TTL)
+
+        tombstones = [
+            {
+                PROJ_QUEUE: scope,
+                't': 0,
+                'e': expires,
+                'u': None,
+                'c': {'id': None, 'e': 0},
+                'b': {},
+                'k': marker,
+                'tx': counter['f'],
+            }
+
+            for marker in range(first, last)
+            if marker not in existing
+        ]
+
+        if tombstones:
+            try:
+                collection.insert(tombstones, continue_on_error=True)
+            except pymongo.errors.DuplicateKeyError:
+                # NOTE: The stalled post inserted those in the meantime
+                pass
+
+        self._queue_ctrl._release_counter(queue_name, project, counter['f'])
+
+    def gc(self):
+        """Abandons posts that stalled before making their messages visible.
+
+        Listings are held up by the markers of those posts until then,
+        so this should be run regularly (see also zaqar-gc).
+        """
+
+        cutoff = objectid.ObjectId.from_datetime(
+            timeutils.utcnow() -
+            datetime.timedelta(seconds=COUNTER_STALL_WINDOW))
+
+        for name, project, counter in self._queue_ctrl._stalled_counters(
+                cutoff):
+            self._abandon_markers(name, project, counter)
+
+        for collection, reservations in zip(self._collections,
+                                            self._reservations):
+            for doc in reservations.find({'_id': {'$lt': cutoff}}):
+                transaction = doc['_id']
+
+                if not doc.get('f'):
+                    result = reservations.remove(
+                        {'_id': transaction, 'f': {'$exists': False}}, w=1)
+
+                    if result['n']:
+                        collection.remove({'tx': transaction},
+                                          w=self.driver.delete_write_concern)
+                        continue
+
+                # NOTE: The worker committed the transaction, but then
+                # crashed before finalizing its messages.
+                self._finalize_messages(collection, reservations,
+                                        transaction)
+
+    @utils.raises_conn_error
+    @utils.retries_on_autoreconnect
+    def post(self, queue_name, messages, client_uuid, project=None):
+        # NOTE(flaper87): This method should be safe to retry on
+        # autoreconnect, since we've a 2-step insert for messages.
+        # The worst-case scenario is that we'll increase the counter
+        # several times and we'd end up with some non-active messages.
+
+        # NOTE: This also checks that the queue exists
+        counter = self._queue_ctrl._get_counter(queue_name, project)
+
+        now = timeutils.utcnow_ts()
+        now_dt = datetime.datetime.utcfromtimestamp(now)
+
+        prepared_messages = [
+            {
+                PROJ_QUEUE: utils.scope_queue_name(queue_name, project),
+                't': message['ttl'],
+                'e': now_dt + datetime.timedelta(seconds=message['ttl']),
+                'u': client_uuid,
+                'c': {'id': None, 'e': now},
+                'b': message['body'] if 'body' in message else {},
+            }
+
+            for message in messages
+        ]
+
+        # NOTE: Concurrent producers never compete for the same
+        # markers, since each one atomically reserves its own range
+        # before inserting anything. Most posts are not contended,
+        # and take the cheaper path.
+        ids = self._post_uncontended(queue_name, project,
+                                     prepared_messages, counter)
+
+        if ids is None:
+            ids = self._post_pending(queue_name, project,
+                                     prepared_messages, counter)
+
+        if self.driver.notifications is not None:
+            self.driver.notifications.notify(queue_name, project)
+
+        return [str(id_) for id_ in ids]
+
 
 def _is_claimed(msg, now):
     return (msg['c']['id'] is not None and
@@ -885,6 +1437,12 @@ class MessageQueueHandler(object):
         self.queue_controller = self.driver.queue_controller
         self.message_controller = self.driver.message_controller
 
+    def create(self, name, metadata=None, project=None):
+        # NOTE: Place the queue before it is created, so that nobody
+        # could see it exist without it being mapped to a partition.
+        if not self.queue_controller.exists(name, project=project):
+            self.message_controller._map_partition(name, project)
+
     def delete(self, queue_name, project=None):
         self.message_controller._purge_queue(queue_name, project)
 
@@ -894,31 +1452,23 @@ class MessageQueueHandler(object):
         if not self.queue_controller.exists(name, project=project):
             raise errors.QueueDoesNotExist(name, project)
 
-        controller = self.message_controller
+        stats = self.message_controller._stats(name, project=project)
+        return {'messages': _message_stats(stats, timeutils.utcnow_ts())}
 
-        active = controller._count(name, project=project,
-                                   include_claimed=False)
 
-        total = controller._count(name, project=project,
-                                  include_claimed=True)
-
-        message_stats = {
-            'claimed': total - active,
-            'free': active,
-            'total': total,
-        }
+def _message_stats(stats, now):
+    """Formats aggregated stats as returned by MessageController._stats."""
 
-        try:
-            oldest = controller.first(name, project=project, sort=1)
-            newest = controller.first(name, project=project, sort=-1)
-        except errors.QueueIsEmpty:
-            pass
-        else:
-            now = timeutils.utcnow_ts()
-            message_stats['oldest'] = utils.stat_message(oldest, now)
-            message_stats['newest'] = utils.stat_message(newest, now)
+    if stats is None:
+        return {'claimed': 0, 'free': 0, 'total': 0}
 
-        return {'messages': message_stats}
+    return {
+        'claimed': stats['claimed'],
+        'free': stats['total'] - stats['claimed'],
+        'total': stats['total'],
+        'oldest': utils.stat_message({'id': str(stats['oldest'])}, now),
+        'newest': utils.stat_message({'id': str(stats['newest'])}, now),
+    }
 
 
 def _get_scoped_query(name, project):
@@ -0,0 +1,169 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Wakes consumers that are waiting for messages to be posted.
+
+Whenever messages become available in a queue, an event naming the
+queue is appended to a small capped collection. Each server tails
+that collection with a single background thread, and wakes up any
+consumers that are waiting on the queue named in the event, so that
+they do not have to poll the queue while it is idle.
+
+Field Mappings:
+    In order to reduce the disk / memory space used,
+    field names will be, most of the time, the first
+    letter of their long name.
+"""
+
+import threading
+import time
+
+from oslo_log import log as logging
+import pymongo.errors
+
+from zaqar.common import decorators
+from zaqar.i18n import _
+from zaqar.storage.mongodb import utils
+
+LOG = logging.getLogger(__name__)
+
+# NOTE: How long to wait before tailing the events collection again
+# after the cursor died, e.g., because the collection was empty, or
+# because the connection failed.
+RETRY_INTERVAL = 1
+
+EVENTS_COLLECTION = 'events'
+
+PROJ_QUEUE = utils.PROJ_QUEUE_KEY
+
+
+class NotificationEngine(object):
+    """Notifies waiting consumers when messages are posted.
+
+    :param database: Database in which to keep the events
+    :param size: Size of the capped events collection, in bytes
+    """
+
+    def __init__(self, database, size):
+        self._database = database
+        self._size = size
+
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._thread = None
+
+    @decorators.lazy_property(write=False)
+    def _events(self):
+        try:
+            return self._database.create_collection(EVENTS_COLLECTION,
+                                                    capped=True,
+                                                    size=self._size)
+        except pymongo.errors.CollectionInvalid:
+            # NOTE: Already created by this or another server
+            return self._database[EVENTS_COLLECTION]
+
+    def notify(self, queue, project=None):
+        """Wakes up the consumers waiting on a queue, on every server.
+
+        :param queue: Name of the queue that received messages
+        :param project: Project id
+        """
+
+        # NOTE: A lost event only delays waiters until their timeout
+        # expires, so there is no need to wait for replication, and
+        # failures are not raised to the caller; otherwise, the
+        # caller might retry posting its messages.
+        event = {PROJ_QUEUE: utils.scope_queue_name(queue, project)}
+
+        try:
+            self._events.insert(event, w=1)
+
+        except pymongo.errors.PyMongoError as ex:
+            LOG.warning(_(u'Failed to notify waiters on queue %(queue)s '
+                          u'under project %(project)s: %(ex)s'),
+                        {'queue': queue, 'project': project, 'ex': ex})
+
+    def wait(self, queue, timeout, ready, project=None):
+        """Waits for messages to be posted to a queue.
+
+        :param queue: Name of the queue to wait on
+        :param timeout: Maximum time to wait, in seconds
+        :param ready: Callable that returns True if there are
+            messages available. It is called once the waiter has
+            been registered, so that messages posted just before
+            then are not missed, and again if the timeout expires.
+        :param project: Project id
+        :returns: True if messages may be available, False if the
+            timeout elapsed and there are none.
+        """
+
+        scope = utils.scope_queue_name(queue, project)
+        event = threading.Event()
+
+        with self._lock:
+            self._waiters.setdefault(scope, set()).add(event)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+        try:
+            if ready():
+                return True
+
+            # NOTE: Check once more if no event arrived, in case
+            # it was lost, or skipped while the cursor was reopened.
+            return event.wait(timeout) or ready()
+
+        finally:
+            with self._lock:
+                waiters = self._waiters[scope]
+                waiters.discard(event)
+
+                if not waiters:
+                    del self._waiters[scope]
+
+    def _run(self):
+        last_id = None
+
+        while True:
+            try:
+                last_id = self._tail(last_id)
+
+            except pymongo.errors.PyMongoError as ex:
+                LOG.warning(_(u'Failed to tail the events collection: '
+                              u'%(ex)s'), {'ex': ex})
+
+            time.sleep(RETRY_INTERVAL)
+
+    def _tail(self, last_id):
+        """Wakes up waiters as events arrive, until the cursor dies.
+
+        :param last_id: ID of the last event seen, or None to tail
+            the collection from the start.
+        :returns: ID of the last event seen
+        """
+
+        query = {} if last_id is None else {'_id': {'$gt': last_id}}
+        cursor = self._events.find(query, tailable=True, await_data=True)
+
+        while cursor.alive:
+            for event in cursor:
+                last_id = event['_id']
+
+                with self._lock:
+                    for waiter in self._waiters.get(event[PROJ_QUEUE], ()):
+                        waiter.set()
+
+        return last_id
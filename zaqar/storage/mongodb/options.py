@@ -114,6 +114,52 @@ _COMMON_OPTIONS = (
                        'after a primary node failover. '
                        'The actual sleep time increases exponentially (power '
                        'of 2) each time the operation is retried.')),
+
+    cfg.IntOpt('max_pool_size', min=1,
+               help=('Maximum number of connections to keep open to each '
+                     'MongoDB server. Operations wait for a connection to '
+                     'become available once this many are in use. If not '
+                     'set, the MongoDB client\'s default is used.')),
+
+    cfg.IntOpt('wait_queue_timeout_ms', min=0,
+               help=('How long, in milliseconds, an operation may wait '
+                     'for a connection to become available before failing. '
+                     'If not set, operations wait indefinitely.')),
+
+    cfg.IntOpt('wait_queue_multiple', min=0,
+               help=('Maximum number of operations that may wait for a '
+                     'connection, as a multiple of ``max_pool_size``. '
+                     'Operations beyond this limit fail right away. '
+                     'If not set, the number of waiters is unlimited.')),
+
+    cfg.IntOpt('connect_timeout_ms', min=0,
+               help=('How long, in milliseconds, to wait for a connection '
+                     'to a MongoDB server to be established. If not set, '
+                     'the MongoDB client\'s default is used.')),
+
+    cfg.IntOpt('socket_timeout_ms', min=0,
+               help=('How long, in milliseconds, to wait for a response '
+                     'to an operation before failing it. If not set, '
+                     'operations never time out.')),
+
+    cfg.StrOpt('write_concern',
+               help=('Write concern for writes, given as the number of '
+                     'members that must acknowledge each write, '
+                     '``majority``, or the name of a tag set. If not set, '
+                     'the connection URI is honoured, and ``majority`` is '
+                     'used for replica sets and mongos.')),
+
+    cfg.IntOpt('write_timeout_ms', min=0,
+               help=('How long, in milliseconds, to wait for a write to '
+                     'be acknowledged as per ``write_concern``. If not set, '
+                     'writes wait indefinitely.')),
+
+    cfg.StrOpt('delete_write_concern', default='0',
+               help=('Write concern for deletes, which by default are not '
+                     'acknowledged at all, since a failed delete is retried '
+                     'by the client or eventually cleaned up by the TTL '
+                     'index. Accepts the same values as ``write_concern``.'
+                     )),
 )
 
 MANAGEMENT_MONGODB_OPTIONS = _COMMON_OPTIONS
@@ -125,12 +171,69 @@ MESSAGE_MONGODB_OPTIONS = _COMMON_OPTIONS + (
                                 group=_deprecated_group), ],
                help=('Number of databases across which to '
                      'partition message data, in order to '
-                     'reduce writer lock %. DO NOT change '
-                     'this setting after initial deployment. '
-                     'It MUST remain static. Also, you '
+                     'reduce writer lock %. After increasing '
+                     'this setting, run zaqar-rebalance to move '
+                     'existing queues to their new partitions. '
+                     'Do not decrease it. Also, you '
                      'should not need a large number of partitions '
                      'to improve performance, esp. if deploying '
                      'MongoDB on SSD storage.')),
+
+    cfg.StrOpt('observer_read_preference',
+               choices=['primary', 'primary_preferred', 'secondary',
+                        'secondary_preferred', 'nearest'],
+               help=('Read preference for operations that only observe '
+                     'messages, i.e., listing and getting messages, and '
+                     'queue stats. Setting this to one of the secondary '
+                     'modes allows these reads to be scaled out by '
+                     'adding replica set members, at the cost of '
+                     'possibly returning slightly stale results. '
+                     'Operations that claim or delete messages always '
+                     'use the connection\'s default read preference. '
+                     'If not set, the connection\'s default is used '
+                     'for all operations.')),
+
+    cfg.IntOpt('observer_acceptable_latency_ms', min=0,
+               help=('When reading from secondaries as per '
+                     '``observer_read_preference``, only read from '
+                     'members whose ping time is within this many '
+                     'milliseconds of the nearest member. If not set, '
+                     'the connection\'s default is used.')),
+
+    cfg.StrOpt('post_write_concern',
+               help=('Write concern for posting messages, overriding '
+                     '``write_concern``. Accepts the same values, except '
+                     'for ``0``. Waiting for fewer members than a '
+                     'majority may lose messages on failover. If not set, '
+                     'the connection\'s write concern is used.')),
+
+    cfg.IntOpt('post_write_timeout_ms', min=0,
+               help=('How long, in milliseconds, to wait for a post to '
+                     'be acknowledged as per ``post_write_concern``. If '
+                     'not set, ``write_timeout_ms`` is used.')),
+
+    cfg.StrOpt('claim_write_concern',
+               help=('Write concern for claiming messages and updating '
+                     'claims, overriding ``write_concern``. Accepts the '
+                     'same values, except for ``0``. If not set, the '
+                     'connection\'s write concern is used.')),
+
+    cfg.IntOpt('claim_write_timeout_ms', min=0,
+               help=('How long, in milliseconds, to wait for a claim to '
+                     'be acknowledged as per ``claim_write_concern``. If '
+                     'not set, ``write_timeout_ms`` is used.')),
+
+    cfg.BoolOpt('notifications', default=False,
+                help=('Wake up consumers that are waiting for messages '
+                      'to claim as soon as messages become available, '
+                      'rather than having them poll the queue. Each '
+                      'post records an event in a capped collection, '
+                      'which every server tails.')),
+
+    cfg.IntOpt('notification_events_size', default=1024 * 1024, min=4096,
+               help=('Size of the capped collection of notification '
+                     'events, in bytes. It only needs to hold the '
+                     'events posted while a server catches up.')),
 )
 
 MANAGEMENT_MONGODB_GROUP = 'drivers:management_store:mongodb'
@@ -142,7 +142,8 @@ class PoolsController(base.PoolsBase):
                 flavors = ', '.join([x['name'] for x in res])
                 raise errors.PoolInUseByFlavor(name, flavors)
 
-            self._col.remove({'n': name}, w=0)
+            self._col.remove({'n': name},
+                             w=self.driver.delete_write_concern)
         except errors.PoolDoesNotExist:
             pass
 
@@ -96,6 +96,10 @@ class QueueController(storage.Queue):
         # a specific project, for example. Order matters!
         self._collection.ensure_index([('p_q', 1)], unique=True)
 
+        # NOTE: Only queues with markers that are being taken without
+        # contention have 'c.f' set (see also _reserve_counter).
+        self._collection.ensure_index([('c.f', 1)], sparse=True)
+
     # ----------------------------------------------------------------------
     # Helpers
     # ----------------------------------------------------------------------
@@ -130,6 +134,88 @@ class QueueController(storage.Queue):
 
         return doc['c']['v']
 
+    def _get_horizon(self, name, project=None):
+        """Retrieves the lowest marker that a post may still be taking.
+
+        This is the current counter value, unless markers are being
+        taken without contention (see also _reserve_counter), in
+        which case it is the first of those markers.
+
+        :param name: Name of the queue to which the counter is scoped
+        :param project: Queue's project
+        :returns: The marker as an integer, or None if the queue
+            does not exist
+        """
+
+        doc = self._collection.find_one(_get_scoped_query(name, project),
+                                        fields={'c': 1, '_id': 0})
+
+        if doc is None:
+            return None
+
+        counter = doc['c']
+        return counter['b'] if 'f' in counter else counter['v']
+
+    def _reserve_counter(self, name, project, expected, amount,
+                         transaction):
+        """Takes markers from the counter, only if it is uncontended.
+
+        The counter is only incremented if it still has the expected
+        value, and no other markers are being taken this way. The
+        reserved range is recorded along with the counter, so that
+        it is atomically visible to listings (see also _get_horizon).
+        It must be released once the messages have been inserted.
+
+        :param name: Name of the queue to which the counter is scoped
+        :param project: Queue's project
+        :param expected: Counter value that was read beforehand; this
+            is the first of the reserved markers.
+        :param amount: Number of markers to reserve
+        :param transaction: ID of the post reserving the markers
+        :returns: True if the markers were reserved, False otherwise
+        """
+
+        query = _get_scoped_query(name, project)
+        query['c.v'] = expected
+        query['c.f'] = {'$exists': False}
+
+        update = {
+            '$inc': {'c.v': amount},
+            '$set': {
+                'c.t': timeutils.utcnow_ts(),
+                'c.f': transaction,
+                'c.b': expected,
+                'c.n': amount,
+            },
+        }
+
+        res = self._collection.update(query, update, w=1)
+        return res['n'] == 1
+
+    def _release_counter(self, name, project, transaction):
+        """Releases markers that were taken by _reserve_counter."""
+
+        query = _get_scoped_query(name, project)
+        query['c.f'] = transaction
+
+        self._collection.update(query, {'$unset': {'c.f': '', 'c.b': '',
+                                                   'c.n': ''}})
+
+    def _stalled_counters(self, cutoff):
+        """Lists the queues whose reserved markers were never released.
+
+        :param cutoff: Markers reserved by transactions that started
+            before this ObjectId are considered stalled.
+        :returns: An iterator of (name, project, counter) tuples
+        """
+
+        cursor = self._collection.find({'c.f': {'$lt': cutoff}},
+                                       fields={'p_q': 1, 'c': 1, '_id': 0})
+
+        for doc in cursor:
+            project, name = utils.parse_scoped_project_queue(doc['p_q'])
+            yield name, project or None, doc['c']
+
     def _inc_counter(self, name, project=None, amount=1, window=None):
         """Increments the message counter and returns the new value.
 
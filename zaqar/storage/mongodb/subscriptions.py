@@ -138,7 +138,8 @@ class SubscriptionController(base.Subscription):
     @utils.raises_conn_error
     def delete(self, queue, subscription_id, project=None):
         self._collection.remove({'_id': utils.to_oid(subscription_id),
-                                 'p': project}, w=0)
+                                 'p': project},
+                                w=self.driver.delete_write_concern)
 
 
 def _normalize(record):
@@ -15,10 +15,13 @@
 
 from __future__ import division
 import binascii
+import bisect
 import collections
 import datetime
 import functools
+import hashlib
 import random
+import threading
 import time
 
 from bson import errors as berrors
@@ -27,6 +30,7 @@ from bson import tz_util
 from oslo_log import log as logging
 from oslo_utils import timeutils
 from pymongo import errors
+from pymongo import read_preferences
 
 from zaqar.i18n import _
 from zaqar.storage import errors as storage_errors
@@ -131,6 +135,29 @@ def oid_ts(oid):
         raise TypeError(u'Expected ObjectId and got %s' % type(oid))
 
 
+def observer_read_options(conf):
+    """Returns keyword arguments for reads that only observe messages.
+
+    :param conf: Message store configuration
+    :returns: A dict of options to pass along with such reads, e.g.,
+        to `find()`. Empty if the connection's defaults should be
+        used.
+    """
+
+    options = {}
+
+    if conf.observer_read_preference:
+        mode = conf.observer_read_preference.upper()
+        options['read_preference'] = getattr(
+            read_preferences.ReadPreference, mode)
+
+    if conf.observer_acceptable_latency_ms is not None:
+        options['secondary_acceptable_latency_ms'] = (
+            conf.observer_acceptable_latency_ms)
+
+    return options
+
+
 def stat_message(message, now):
     """Creates a stat document from the given message, relative to now."""
     msg_id = message['id']
@@ -241,20 +268,184 @@ def get_partition(num_partitions, queue, project=None):
     return binascii.crc32(name.encode('utf-8')) % num_partitions
 
 
+def write_concern(value):
+    """Parses a write concern option value.
+
+    :param value: Number of members that must acknowledge a write,
+        'majority', or the name of a tag set, as a string.
+    :returns: The write concern as expected by pymongo's `w`.
+    """
+
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def operation_write_concern(default, value, timeout_ms):
+    """Returns the write concern for a kind of write operation.
+
+    :param default: Write concern of the connection, as a dict
+    :param value: Write concern option value for the operation, or None
+    :param timeout_ms: Write timeout option value for the operation,
+        or None
+    :returns: Keyword arguments to pass to each write, which are
+        empty if the connection's write concern is not overridden.
+    """
+
+    if not value and timeout_ms is None:
+        return {}
+
+    # NOTE: The write concern given to a write replaces the
+    # connection's altogether, so start from the latter.
+    options = dict(default)
+
+    if value:
+        options['w'] = write_concern(value)
+
+    if timeout_ms is not None:
+        options['wtimeout'] = timeout_ms
+
+    return options
+
+
+def connection_options(conf):
+    """Returns MongoDB client keyword arguments for the given options."""
+
+    options = {}
+
+    if conf.max_pool_size is not None:
+        options['max_pool_size'] = conf.max_pool_size
+
+    uri_options = (
+        ('waitQueueTimeoutMS', conf.wait_queue_timeout_ms),
+        ('waitQueueMultiple', conf.wait_queue_multiple),
+        ('connectTimeoutMS', conf.connect_timeout_ms),
+        ('socketTimeoutMS', conf.socket_timeout_ms),
+        ('wtimeout', conf.write_timeout_ms),
+    )
+
+    for name, value in uri_options:
+        if value is not None:
+            options[name] = value
+
+    if conf.write_concern:
+        options['w'] = write_concern(conf.write_concern)
+
+    return options
+
+
+class PoolStats(object):
+    """Counts the storage operations using MongoDB connections.
+
+    Every operation holds a connection from the client's pool while
+    it runs, so the number of operations in flight approximates the
+    number of connections in use. Counters are process-wide; nested
+    operations made by the same thread are only counted once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.operations = 0
+        self.connection_errors = 0
+
+    def enter(self):
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+
+        if depth == 0:
+            with self._lock:
+                self.operations += 1
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight,
+                                          self.in_flight)
+
+    def exit(self, failed=False):
+        self._local.depth -= 1
+
+        if self._local.depth == 0:
+            with self._lock:
+                self.in_flight -= 1
+                if failed:
+                    self.connection_errors += 1
+
+    def snapshot(self):
+        """Returns the current counters as a dict."""
+
+        with self._lock:
+            return {
+                'operations_in_flight': self.in_flight,
+                'peak_operations_in_flight': self.peak_in_flight,
+                'operations': self.operations,
+                'connection_errors': self.connection_errors,
+            }
+
+
+POOL_STATS = PoolStats()
+
+
+class PartitionRing(object):
+    """Consistent-hash ring that maps queues to partitions.
+
+    Each partition is placed on the ring at a number of pseudo-random
+    points, and a queue is mapped to the partition that owns the first
+    point following the queue's own hash. Unlike `get_partition`,
+    adding a partition only remaps the queues that now fall on the
+    new partition's points, i.e., about 1/N of them.
+
+    :param num_partitions: Number of partitions to spread queues over
+    :param points: (Default 100) Number of points per partition
+    """
+
+    def __init__(self, num_partitions, points=100):
+        ring = sorted(
+            (_ring_hash('{0}-{1}'.format(partition, point)), partition)
+            for partition in range(num_partitions)
+            for point in range(points)
+        )
+
+        self._hashes = [h for h, _ in ring]
+        self._partitions = [partition for _, partition in ring]
+
+    def get_partition(self, queue, project=None):
+        """Returns the partition number for a given queue and project."""
+
+        name = project + queue if project is not None else queue
+        index = bisect.bisect(self._hashes, _ring_hash(name))
+
+        return self._partitions[index % len(self._partitions)]
+
+
+def _ring_hash(value):
+    digest = hashlib.md5(value.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16)
+
+
 def raises_conn_error(func):
     """Handles the MongoDB ConnectionFailure error.
 
     This decorator catches MongoDB's ConnectionFailure
-    error and raises Zaqar's ConnectionError instead.
+    error and raises Zaqar's ConnectionError instead. It
+    also keeps track of the operation in POOL_STATS.
     """
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
+        POOL_STATS.enter()
+        failed = False
+
         try:
             return func(*args, **kwargs)
         except errors.ConnectionFailure as ex:
+            failed = True
             LOG.exception(ex)
             raise storage_errors.ConnectionError()
+        finally:
+            POOL_STATS.exit(failed)
 
     return wrapper
 
@@ -132,6 +132,19 @@ class DataDriver(base.DataDriverBase):
     def _health(self):
         return self._storage._health()
 
+    def _load(self):
+        return self._storage._load()
+
+    @property
+    def pool_catalog(self):
+        return self._storage.pool_catalog
+
+    def gc(self):
+        self._storage.gc()
+
+    def reconcile(self):
+        self._storage.reconcile()
+
     @decorators.lazy_property(write=False)
     def queue_controller(self):
         stages = _get_builtin_entry_points('queue', self._storage,
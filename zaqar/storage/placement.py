@@ -0,0 +1,208 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Placement engines, which choose the pool for each new queue.
+
+The engine used by the pool catalog is loaded from the
+`zaqar.storage.placement` namespace, according to the
+`placement` option in the `pooling:catalog` group. Each catalog
+loads its own engine, which is owned by the pooling driver along
+with the catalog.
+"""
+
+import abc
+import threading
+import time
+
+from oslo_log import log as logging
+import six
+from stevedore import driver
+
+from zaqar.common.storage import select
+
+LOG = logging.getLogger(__name__)
+
+# NOTE: Weights are scaled before being adjusted by the load of each
+# pool, so that they remain integers without losing much precision.
+WEIGHT_SCALE = 1000
+
+
+def get_engine(conf, catalog):
+    """Loads the placement engine configured for the given catalog."""
+
+    mgr = driver.DriverManager('zaqar.storage.placement',
+                               catalog._catalog_conf.placement,
+                               invoke_on_load=True,
+                               invoke_args=[conf, catalog])
+    return mgr.driver
+
+
+@six.add_metaclass(abc.ABCMeta)
+class PlacementBase(object):
+    """Chooses the pool in which to create new queues.
+
+    :param conf: Configuration from which to read pooling options
+    :param catalog: Catalog of available pools
+    :type catalog: zaqar.storage.pooling.Catalog
+    """
+
+    def __init__(self, conf, catalog):
+        self._conf = conf
+        self._catalog = catalog
+
+    @abc.abstractmethod
+    def select(self, pools):
+        """Chooses one of the given pools.
+
+        :param pools: Detailed pools that may host the queue
+        :type pools: [dict]
+        :returns: The chosen pool, or None if no pool may host it
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+
+class WeightedPlacement(PlacementBase):
+    """Chooses pools at random, in proportion to their weight."""
+
+    def select(self, pools):
+        return select.weighted(pools)
+
+
+class BalancedPlacement(PlacementBase):
+    """Steers new queues away from loaded or slow pools.
+
+    The weight of each pool is adjusted by how its message volume and
+    the latency of a ping, as reported by the load of its driver,
+    compare to those of the other pools. Pools that are not reachable
+    are not chosen unless no other pool may host the queue.
+
+    The load of the pools is refreshed by a background thread,
+    every `placement_refresh_interval` seconds. The weighted spectrum
+    of each group of pools is computed once, until then.
+    """
+
+    def __init__(self, conf, catalog):
+        super(BalancedPlacement, self).__init__(conf, catalog)
+
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # NOTE: The load factor of each pool, and the weighted
+        # spectrum of each group of pools that was computed from
+        # those factors, are swapped together on each refresh.
+        self._state = ({}, {})
+
+    def select(self, pools):
+        self._start()
+
+        factors, tables = self._state
+        key = tuple((pool['name'], pool['weight']) for pool in pools)
+
+        table = tables.get(key)
+        if table is None:
+            table = select.spectrum(self._weigh(pools, factors))
+            tables[key] = table
+
+        return select.pick(table)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+
+            except Exception as ex:
+                LOG.exception(ex)
+
+            time.sleep(self._catalog._catalog_conf.placement_refresh_interval)
+
+    def refresh(self):
+        """Collects the load of every pool, and updates their factors."""
+
+        signals = {}
+        for pool in next(self._catalog._pools_ctrl.list(limit=0)):
+            try:
+                load = self._catalog.get_driver(pool['name'])._load()
+                signals[pool['name']] = _signals(load)
+
+            except Exception as ex:
+                LOG.exception(ex)
+                signals[pool['name']] = None
+
+        self._state = (_factors(signals), {})
+
+    @staticmethod
+    def _weigh(pools, factors):
+        weighted = []
+        for pool in pools:
+            factor = factors.get(pool['name'], 1.0)
+            weight = pool['weight'] * factor * WEIGHT_SCALE
+            if pool['weight'] > 0 and factor > 0:
+                weight = max(int(weight), 1)
+
+            weighted.append(dict(pool, weight=int(weight)))
+
+        # NOTE: Rather place the queue in an unhealthy pool than
+        # fail to create it.
+        if not any(pool['weight'] > 0 for pool in weighted):
+            return pools
+
+        return weighted
+
+
+def _signals(load):
+    """Extracts the message volume and latency of a pool.
+
+    :returns: (volume, seconds), or None if the pool is unreachable
+    """
+
+    if not load or not load.get('storage_reachable'):
+        return None
+
+    volume = load.get('message_volume', {}).get('total', 0)
+    return volume, load['seconds']
+
+
+def _factors(signals):
+    """Computes the load factor of each pool from its signals.
+
+    A pool with an average message volume and latency gets a factor
+    of 1, an idle and fast pool gets up to 3, and the factor of a
+    busier or slower pool decreases towards 0. Unreachable pools get 0.
+    """
+
+    healthy = [s for s in signals.values() if s is not None]
+    if not healthy:
+        return dict.fromkeys(signals, 0)
+
+    mean_volume = float(sum(s[0] for s in healthy)) / len(healthy)
+    mean_seconds = float(sum(s[1] for s in healthy)) / len(healthy)
+
+    factors = {}
+    for name, s in signals.items():
+        if s is None:
+            factors[name] = 0
+            continue
+
+        volume = s[0] / mean_volume if mean_volume else 1
+        seconds = s[1] / mean_seconds if mean_seconds else 1
+        factors[name] = 3.0 / (1 + volume + seconds)
+
+    return factors
@@ -13,18 +13,21 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
-import heapq
+import collections
 import itertools
+import threading
+import time
 
 from oslo_config import cfg
 from oslo_log import log
 
 from zaqar.common import decorators
 from zaqar.common import errors as cerrors
-from zaqar.common.storage import select
+from zaqar.i18n import _
 from zaqar import storage
 from zaqar.storage import errors
 from zaqar.storage import pipeline
+from zaqar.storage import placement
 from zaqar.storage import utils
 
 LOG = log.getLogger(__name__)
@@ -33,33 +36,54 @@ _CATALOG_OPTIONS = (
     cfg.BoolOpt('enable_virtual_pool', default=False,
                 help=('If enabled, the message_store will be used '
                       'as the storage for the virtual pool.')),
+
+    cfg.IntOpt('cache_size', default=10000, min=0,
+               help=('Maximum number of queue to pool mappings that '
+                     'each process keeps in memory. The least '
+                     'recently used mappings are evicted first.')),
+
+    cfg.FloatOpt('cache_refresh_interval', default=1.0, min=0,
+                 help=('How often, in seconds, each process checks '
+                       'the catalogue for changes made by other '
+                       'processes, evicting the mappings that '
+                       'changed. This bounds how long a process may '
+                       'keep using a stale mapping.')),
+
+    cfg.StrOpt('placement', default='weighted',
+               help=('Engine that chooses the pool for each new '
+                     'queue, among those of its flavor. "weighted" '
+                     'chooses pools in proportion to their weight, '
+                     'while "balanced" also steers new queues away '
+                     'from pools with a higher message volume or '
+                     'ping latency.')),
+
+    cfg.FloatOpt('placement_refresh_interval', default=60.0, min=1,
+                 help=('How often, in seconds, the "balanced" '
+                       'placement engine collects the health of '
+                       'every pool.')),
 )
 
 _CATALOG_GROUP = 'pooling:catalog'
 
-# NOTE(kgriffs): E.g.: 'zaqar-pooling:5083853/my-queue'
-_POOL_CACHE_PREFIX = 'pooling:'
+# NOTE: How long to wait, in seconds, before trying again to load the
+# driver for the virtual pool after it could not be loaded.
+VIRTUAL_POOL_RETRY_INTERVAL = 30
 
-# TODO(kgriffs): If a queue is migrated, everyone's
-# caches need to have the relevant entry invalidated
-# before "unfreezing" the queue, rather than waiting
-# on the TTL.
-#
-# TODO(kgriffs): Make configurable?
-_POOL_CACHE_TTL = 10
+# NOTE: Messages are moved between pools in batches, by claiming them
+# in the pool that holds them. The claims must last long enough for
+# each batch to be copied before its messages are deleted.
+MIGRATION_BATCH_SIZE = 20
+MIGRATION_CLAIM_TTL = 300
+
+# NOTE: How long to wait for consumers to delete the messages that they
+# claimed, or for their claims to expire, before moving them.
+MIGRATION_POLL_INTERVAL = 1
 
 
 def _config_options():
     return [(_CATALOG_GROUP, _CATALOG_OPTIONS)]
 
 
-def _pool_cache_key(queue, project=None):
-    # NOTE(kgriffs): Use string concatenation for performance,
-    # also put project first since it is guaranteed to be
-    # unique, which should reduce lookup time.
-    return _POOL_CACHE_PREFIX + str(project) + '/' + queue
-
-
 class DataDriver(storage.DataDriverBase):
     """Pooling meta-driver for routing requests to multiple backends.
 
@@ -76,6 +100,11 @@ class DataDriver(storage.DataDriverBase):
         super(DataDriver, self).__init__(conf, cache, control_driver)
         self._pool_catalog = Catalog(conf, cache, control)
 
+    @property
+    def pool_catalog(self):
+        """The catalog that maps each queue to its pool."""
+        return self._pool_catalog
+
     @property
     def capabilities(self):
         # NOTE(flaper87): We can't know the capabilities
@@ -112,6 +141,12 @@ class DataDriver(storage.DataDriverBase):
             driver = self._pool_catalog.get_driver(pool['name'])
             driver.gc()
 
+    def reconcile(self):
+        cursor = self._pool_catalog._pools_ctrl.list(limit=0)
+        for pool in next(cursor):
+            driver = self._pool_catalog.get_driver(pool['name'])
+            driver.reconcile()
+
     @decorators.lazy_property(write=False)
     def queue_controller(self):
         return QueueController(self._pool_catalog)
@@ -144,29 +179,27 @@ class QueueController(storage.Queue):
     def _list(self, project=None, marker=None,
               limit=storage.DEFAULT_QUEUES_PER_PAGE, detailed=False):
 
-        def all_pages():
-            cursor = self._pool_catalog._pools_ctrl.list(limit=0)
-            for pool in next(cursor):
-                yield next(self._pool_catalog.get_driver(pool['name'])
-                           .queue_controller.list(
-                               project=project,
-                               marker=marker,
-                               limit=limit,
-                               detailed=detailed))
-
-        # make a heap compared with 'name'
-        ls = heapq.merge(*[
-            utils.keyify('name', page)
-            for page in all_pages()
-        ])
+        if detailed:
+            # NOTE: Queue metadata is kept in the management store,
+            # which every pool shares, so a single query answers
+            # for all of them.
+            control = self._pool_catalog.control.queue_controller
+            queues = next(control.list(project=project, marker=marker,
+                                       limit=limit, detailed=True))
+        else:
+            # NOTE: Every queue is registered in the catalogue, so
+            # there is no need to ask the pools for their names.
+            entries = self._pool_catalog._catalogue_ctrl.list(
+                project, marker=marker, limit=limit)
+            queues = ({'name': entry['queue']} for entry in entries)
 
         marker_name = {}
 
-        # limit the iterator and strip out the comparison wrapper
+        # limit the iterator
         def it():
-            for queue_cmp in itertools.islice(ls, limit):
-                marker_name['next'] = queue_cmp.obj['name']
-                yield queue_cmp.obj
+            for queue in itertools.islice(queues, limit):
+                marker_name['next'] = queue['name']
+                yield queue
 
         yield it()
         yield marker_name and marker_name['next']
@@ -250,8 +283,37 @@ class MessageController(storage.Message):
         self._pool_catalog = pool_catalog
         self._get_controller = self._pool_catalog.get_message_controller
 
+    # NOTE: While a queue is migrated, new messages are posted to the
+    # destination pool, while the messages left in the current pool
+    # are consumed first. Operations on existing messages are routed
+    # to whichever pool holds them.
+    def _get_destination(self, queue, project=None):
+        target = self._pool_catalog.lookup_destination(queue, project)
+        return target and target.message_controller
+
+    def _get_owner(self, control, queue, message_id, project=None):
+        destination = self._get_destination(queue, project)
+        if destination:
+            try:
+                control.get(queue, message_id, project=project)
+            except errors.MessageDoesNotExist:
+                return destination
+
+        return control
+
+    def _get_reader(self, control, queue, project=None):
+        destination = self._get_destination(queue, project)
+        if destination:
+            try:
+                control.first(queue, project=project)
+            except errors.QueueIsEmpty:
+                return destination
+
+        return control
+
     def post(self, queue, messages, client_uuid, project=None):
-        control = self._get_controller(queue, project)
+        control = (self._get_destination(queue, project) or
+                   self._get_controller(queue, project))
         if control:
             return control.post(queue, project=project,
                                 messages=messages,
@@ -261,28 +323,56 @@ class MessageController(storage.Message):
     def delete(self, queue, message_id, project=None, claim=None):
         control = self._get_controller(queue, project)
         if control:
+            control = self._get_owner(control, queue, message_id, project)
             return control.delete(queue, project=project,
                                   message_id=message_id, claim=claim)
         return None
 
-    def bulk_delete(self, queue, message_ids, project=None):
+    def bulk_delete(self, queue, message_ids, project=None, claim=None):
         control = self._get_controller(queue, project)
         if control:
-            return control.bulk_delete(queue, project=project,
-                                       message_ids=message_ids)
+            failed = []
+
+            destination = self._get_destination(queue, project)
+            if destination:
+                held = set(message['id'] for message in
+                           control.bulk_get(queue, project=project,
+                                            message_ids=message_ids))
+                failed = destination.bulk_delete(
+                    queue, project=project, claim=claim,
+                    message_ids=[mid for mid in message_ids
+                                 if mid not in held])
+                message_ids = [mid for mid in message_ids if mid in held]
+
+            return failed + control.bulk_delete(queue, project=project,
+                                                message_ids=message_ids,
+                                                claim=claim)
         return None
 
     def pop(self, queue, limit, project=None):
         control = self._get_controller(queue, project)
         if control:
-            return control.pop(queue, project=project, limit=limit)
+            messages = control.pop(queue, project=project, limit=limit)
+
+            destination = self._get_destination(queue, project)
+            if destination and not messages:
+                messages = destination.pop(queue, project=project,
+                                           limit=limit)
+            return messages
         return None
 
     def bulk_get(self, queue, message_ids, project=None):
         control = self._get_controller(queue, project)
         if control:
-            return control.bulk_get(queue, project=project,
-                                    message_ids=message_ids)
+            messages = control.bulk_get(queue, project=project,
+                                        message_ids=message_ids)
+
+            destination = self._get_destination(queue, project)
+            if destination:
+                messages = itertools.chain(
+                    messages, destination.bulk_get(queue, project=project,
+                                                   message_ids=message_ids))
+            return messages
         return []
 
     def list(self, queue, project=None, marker=None,
@@ -290,6 +380,7 @@ class MessageController(storage.Message):
              echo=False, client_uuid=None, include_claimed=False):
         control = self._get_controller(queue, project)
         if control:
+            control = self._get_reader(control, queue, project)
             return control.list(queue, project=project,
                                 marker=marker, limit=limit,
                                 echo=echo, client_uuid=client_uuid,
@@ -299,6 +390,7 @@ class MessageController(storage.Message):
     def get(self, queue, message_id, project=None):
         control = self._get_controller(queue, project)
         if control:
+            control = self._get_owner(control, queue, message_id, project)
             return control.get(queue, message_id=message_id,
                                project=project)
         raise errors.QueueDoesNotExist(queue, project)
@@ -306,6 +398,18 @@ class MessageController(storage.Message):
     def first(self, queue, project=None, sort=1):
         control = self._get_controller(queue, project)
         if control:
+            destination = self._get_destination(queue, project)
+            if destination:
+                # NOTE: The newest messages are in the destination pool
+                pools = [control, destination]
+                if sort != 1:
+                    pools.reverse()
+
+                try:
+                    return pools[0].first(queue, project=project, sort=sort)
+                except errors.QueueIsEmpty:
+                    control = pools[1]
+
             return control.first(queue, project=project, sort=sort)
         raise errors.QueueDoesNotExist(queue, project)
 
@@ -322,17 +426,50 @@ class ClaimController(storage.Claim):
         self._pool_catalog = pool_catalog
         self._get_controller = self._pool_catalog.get_claim_controller
 
+    # NOTE: While a queue is migrated, messages are claimed from the
+    # current pool until it is drained, and then from the destination
+    # pool. Existing claims remain valid in either pool.
+    def _get_destination(self, queue, project=None):
+        target = self._pool_catalog.lookup_destination(queue, project)
+        return target and target.claim_controller
+
     def create(self, queue, metadata, project=None,
                limit=storage.DEFAULT_MESSAGES_PER_CLAIM):
         control = self._get_controller(queue, project)
         if control:
-            return control.create(queue, metadata=metadata,
-                                  project=project, limit=limit)
+            claim = control.create(queue, metadata=metadata,
+                                   project=project, limit=limit)
+
+            destination = self._get_destination(queue, project)
+            if destination:
+                # NOTE: Some drivers return the claimed messages as an
+                # iterator, which is always truthy.
+                claim = (claim[0], list(claim[1]))
+                if not claim[1]:
+                    claim = destination.create(queue, metadata=metadata,
+                                               project=project,
+                                               limit=limit)
+            return claim
         return [None, []]
 
+    def wait(self, queue, timeout, project=None):
+        control = (self._get_destination(queue, project) or
+                   self._get_controller(queue, project))
+        if control:
+            return control.wait(queue, timeout, project=project)
+        return False
+
     def get(self, queue, claim_id, project=None):
         control = self._get_controller(queue, project)
         if control:
+            try:
+                return control.get(queue, claim_id=claim_id,
+                                   project=project)
+            except errors.ClaimDoesNotExist:
+                control = self._get_destination(queue, project)
+                if not control:
+                    raise
+
             return control.get(queue, claim_id=claim_id,
                                project=project)
         raise errors.ClaimDoesNotExist(claim_id, queue, project)
@@ -340,6 +477,14 @@ class ClaimController(storage.Claim):
     def update(self, queue, claim_id, metadata, project=None):
         control = self._get_controller(queue, project)
         if control:
+            try:
+                return control.update(queue, claim_id=claim_id,
+                                      project=project, metadata=metadata)
+            except errors.ClaimDoesNotExist:
+                control = self._get_destination(queue, project)
+                if not control:
+                    raise
+
             return control.update(queue, claim_id=claim_id,
                                   project=project, metadata=metadata)
         raise errors.ClaimDoesNotExist(claim_id, queue, project)
@@ -347,6 +492,11 @@ class ClaimController(storage.Claim):
     def delete(self, queue, claim_id, project=None):
         control = self._get_controller(queue, project)
         if control:
+            destination = self._get_destination(queue, project)
+            if destination:
+                destination.delete(queue, claim_id=claim_id,
+                                   project=project)
+
             return control.delete(queue, claim_id=claim_id,
                                   project=project)
         return None
@@ -416,6 +566,17 @@ class Catalog(object):
         self._flavor_ctrl = control.flavors_controller
         self._catalogue_ctrl = control.catalogue_controller
 
+        self._placement = placement.get_engine(conf, self)
+
+        # NOTE: Mappings are cached until the catalogue reports that
+        # they changed (see also _refresh), rather than for a fixed
+        # TTL, so that lookups rarely need to hit the control store.
+        self._mappings = collections.OrderedDict()
+        self._mappings_lock = threading.Lock()
+        self._catalogue_version = None
+        self._refreshed = 0
+        self._virtual_pool_retry = 0
+
     # FIXME(cpp-cabrera): https://bugs.launchpad.net/zaqar/+bug/1252791
     def _init_driver(self, pool_id, pool_conf=None):
         """Given a pool name, returns a storage driver.
@@ -436,18 +597,81 @@ class Catalog(object):
                                             control_driver=self.control)
         return pipeline.DataDriver(conf, storage, self.control)
 
-    @decorators.caches(_pool_cache_key, _POOL_CACHE_TTL)
-    def _pool_id(self, queue, project=None):
-        """Get the ID for the pool assigned to the given queue.
+    def _refresh(self):
+        """Evicts the cached mappings that changed in the catalogue.
+
+        The catalogue is checked at most once per
+        cache_refresh_interval. If it is unknown which mappings
+        changed, e.g., because too many changes were made since the
+        last check, every mapping is evicted.
+        """
+
+        now = time.time()
+        if now - self._refreshed < self._catalog_conf.cache_refresh_interval:
+            return
+
+        self._refreshed = now
+
+        since = self._catalogue_version
+        version, changed = self._catalogue_ctrl.changes(since)
+
+        with self._mappings_lock:
+            if since is not None and (version < since or
+                                      len(changed) < version - since):
+                self._mappings.clear()
+            else:
+                for project, queue in changed:
+                    self._mappings.pop((project or None, queue), None)
+
+            self._catalogue_version = version
+
+    def _evict(self, queue, project=None):
+        with self._mappings_lock:
+            self._mappings.pop((project or None, queue), None)
+
+    def _mapping(self, queue, project=None):
+        """Get the IDs of the pools assigned to the given queue.
 
         :param queue: name of the queue
         :param project: project to which the queue belongs
 
-        :returns: pool id
+        :returns: (pool id, destination pool id), where the latter
+            is None unless the queue is being migrated
 
         :raises: `errors.QueueNotMapped`
         """
-        return self._catalogue_ctrl.get(project, queue)['pool']
+
+        self._refresh()
+        key = (project or None, queue)
+
+        with self._mappings_lock:
+            try:
+                # NOTE: Re-insert the mapping to mark it as the most
+                # recently used one.
+                mapping = self._mappings.pop(key)
+                self._mappings[key] = mapping
+                return mapping
+            except KeyError:
+                pass
+
+            # NOTE: Only cache the mapping below if no changes were
+            # applied by _refresh in the meantime, since the entry may
+            # have been read before one of them.
+            version = self._catalogue_version
+
+        entry = self._catalogue_ctrl.get(project, queue)
+        mapping = (entry['pool'], entry.get('destination'))
+
+        with self._mappings_lock:
+            if self._catalogue_version != version:
+                return mapping
+
+            self._mappings[key] = mapping
+
+            while len(self._mappings) > self._catalog_conf.cache_size:
+                self._mappings.popitem(last=False)
+
+        return mapping
 
     def register(self, queue, project=None, flavor=None):
         """Register a new queue in the pool catalog.
@@ -481,14 +705,14 @@ class Catalog(object):
                 flavor = self._flavor_ctrl.get(flavor, project=project)
                 pools = self._pools_ctrl.get_group(group=flavor['pool'],
                                                    detailed=True)
-                pool = select.weighted(pools)
+                pool = self._placement.select(pools)
                 pool = pool and pool['name'] or None
             else:
                 # NOTE(flaper87): Get pools assigned to the default
                 # group `None`. We should consider adding a `default_group`
                 # option in the future.
                 pools = self._pools_ctrl.get_group(detailed=True)
-                pool = select.weighted(pools)
+                pool = self._placement.select(pools)
                 pool = pool and pool['name'] or None
 
                 if not pool and self.lookup(queue, project) is None:
@@ -501,8 +725,8 @@ class Catalog(object):
                     raise errors.NoPoolFound()
 
             self._catalogue_ctrl.insert(project, queue, pool)
+            self._evict(queue, project)
 
-    @_pool_id.purges
     def deregister(self, queue, project=None):
         """Removes a queue from the pool catalog.
 
@@ -516,6 +740,176 @@ class Catalog(object):
         :type project: six.text_type
         """
         self._catalogue_ctrl.delete(project, queue)
+        self._evict(queue, project)
+
+    def start_migration(self, queue, destination, project=None):
+        """Starts migrating a queue to another pool.
+
+        From then on, new messages are posted to the destination
+        pool, while consumers keep receiving the messages left in
+        the current pool first. Call `migrate()` to move those
+        messages, and complete the migration.
+
+        :param queue: Name of the queue to migrate
+        :type queue: six.text_type
+        :param destination: Name of the pool to migrate the queue to
+        :type destination: six.text_type
+        :param project: Project to which the queue belongs, or
+            None for the "global" or "generic" project.
+        :type project: six.text_type
+
+        :returns: False if the queue is already in the destination pool
+        :raises: QueueNotMapped, PoolDoesNotExist, QueueIsMigrating
+        """
+
+        entry = self._catalogue_ctrl.get(project, queue)
+        self._pools_ctrl.get(destination)
+
+        current = entry.get('destination')
+        if current is not None and current != destination:
+            raise errors.QueueIsMigrating(queue, project, current)
+
+        if entry['pool'] == destination:
+            return False
+
+        if current is None:
+            self._catalogue_ctrl.set_destination(project, queue,
+                                                 destination)
+            self._evict(queue, project)
+
+        return True
+
+    def migrate(self, queue, destination, project=None):
+        """Migrates a queue to another pool, while it remains in use.
+
+        Once the migration is started (see `start_migration`), the
+        messages left in the current pool are moved in batches, by
+        claiming them, posting copies to the destination pool, and
+        deleting the claimed messages. Messages that were already
+        claimed by consumers are left in place until they are
+        deleted, or their claims expire, so that those claims remain
+        valid. The catalogue entry is then switched to the
+        destination pool.
+
+        Copies are posted before the messages are deleted, so a
+        message may be delivered twice if the migration is
+        interrupted. An interrupted migration is resumed by calling
+        this method again with the same destination.
+
+        The copies keep the client UUID of their original producer,
+        but not their position in the queue: they are posted after
+        the messages that were posted to the destination pool since
+        the migration started. Consumers only see this reordering
+        for the messages that they have not claimed before they
+        were moved.
+
+        :param queue: Name of the queue to migrate
+        :type queue: six.text_type
+        :param destination: Name of the pool to migrate the queue to
+        :type destination: six.text_type
+        :param project: Project to which the queue belongs, or
+            None for the "global" or "generic" project.
+        :type project: six.text_type
+
+        :returns: An iterator over the number of messages moved by
+            each batch
+        :raises: QueueNotMapped, PoolDoesNotExist, QueueIsMigrating
+        """
+
+        if not self.start_migration(queue, destination, project):
+            return
+
+        # NOTE: Give the other processes a chance to notice the
+        # migration, so that they stop posting to the current pool.
+        time.sleep(self._catalog_conf.cache_refresh_interval)
+
+        source = self.lookup(queue, project)
+        target = self.get_driver(destination)
+        metadata = {'ttl': MIGRATION_CLAIM_TTL, 'grace': 0}
+
+        while True:
+            claim_id, messages = source.claim_controller.create(
+                queue, metadata, project=project,
+                limit=MIGRATION_BATCH_SIZE)
+            messages = list(messages)
+
+            if not messages:
+                # NOTE: Check for claimed messages explicitly, since
+                # some drivers do not consider them in first().
+                interaction = source.message_controller.list(
+                    queue, project=project, echo=True,
+                    include_claimed=True, limit=1)
+
+                if not list(next(interaction)):
+                    break
+
+                time.sleep(MIGRATION_POLL_INTERVAL)
+                continue
+
+            message_ids = [message['id'] for message in messages]
+            client_uuids = source.message_controller._client_uuids(
+                queue, message_ids, project=project)
+
+            # NOTE: Post the copies of consecutive messages from the
+            # same producer together, so that they keep their order.
+            copies = {}
+            live = [message for message in messages
+                    if message['ttl'] > message['age'] and
+                    message['id'] in client_uuids]
+
+            for client_uuid, group in itertools.groupby(
+                    live, lambda message: client_uuids[message['id']]):
+
+                group = list(group)
+                copy_ids = target.message_controller.post(
+                    queue,
+                    [{'ttl': message['ttl'] - message['age'],
+                      'body': message['body']} for message in group],
+                    client_uuid, project=project)
+
+                copies.update(zip((message['id'] for message in group),
+                                  copy_ids))
+
+            failed = source.message_controller.bulk_delete(
+                queue, message_ids, project=project, claim=claim_id)
+
+            # NOTE: The claim expired before the batch was deleted,
+            # so the messages that were not may have been claimed by
+            # consumers already. Withdraw their copies, and move them
+            # again with a later batch if they are left.
+            withdrawn = [copies[mid] for mid in failed if mid in copies]
+            if withdrawn:
+                LOG.warning(_(u'Migration claim on queue %(queue)s '
+                              u'expired, moving %(count)d messages '
+                              u'again'),
+                            {'queue': queue, 'count': len(withdrawn)})
+
+                target.message_controller.bulk_delete(queue, withdrawn,
+                                                      project=project)
+
+            yield len(copies) - len(withdrawn)
+
+        self._catalogue_ctrl.update(project, queue, destination)
+        self._evict(queue, project)
+
+    def lookup_destination(self, queue, project=None):
+        """Lookup the driver for the pool a queue is migrated to.
+
+        :param queue: Name of the queue for which to find a pool
+        :param project: Project to which the queue belongs, or
+            None to specify the "global" or "generic" project.
+
+        :returns: A storage driver instance for the destination pool,
+            or None if the queue is not being migrated.
+        :rtype: Maybe DataDriver
+        """
+
+        try:
+            destination = self._mapping(queue, project)[1]
+        except errors.QueueNotMapped:
+            return None
+
+        return destination and self.get_driver(destination)
 
     def get_queue_controller(self, queue, project=None):
         """Lookup the queue controller for the given queue and project.
@@ -588,47 +982,72 @@ class Catalog(object):
         """
 
         try:
-            pool_id = self._pool_id(queue, project)
+            pool_id = self._mapping(queue, project)[0]
         except errors.QueueNotMapped as ex:
             LOG.debug(ex)
 
             if not self._catalog_conf.enable_virtual_pool:
                 return None
 
-            conf_section = ('drivers:message_store:%s' %
-                            self._conf.drivers.message_store)
+            return self._virtual_pool_driver()
 
-            try:
-                # NOTE(flaper87): Try to load the driver to check
-                # whether it can be used as the default store for
-                # the default pool.
-                utils.load_storage_driver(self._conf, self._cache,
-                                          control_driver=self.control)
-            except cerrors.InvalidDriver:
-                # NOTE(kgriffs): Return `None`, rather than letting the
-                # exception bubble up, so that the higher layer doesn't
-                # have to duplicate the try..except..log code all over
-                # the place.
-                return None
+        return self.get_driver(pool_id)
 
-            if conf_section not in self._conf:
-                # NOTE(flaper87): If there's no config section for this storage
-                # skip the pool registration entirely since we won't know how
-                # to connect to it.
-                return None
+    def _virtual_pool_driver(self):
+        """Returns the driver for the virtual pool.
+
+        The virtual pool is backed by the message store configured
+        for this process. Its driver is loaded the first time it is
+        needed, and cached. If it cannot be loaded, loading it is
+        not tried again for VIRTUAL_POOL_RETRY_INTERVAL seconds.
+
+        :returns: A storage driver, or None if the message store
+            cannot be used for the virtual pool.
+        """
+
+        # NOTE: The virtual pool is cached under the None pool ID
+        try:
+            return self._drivers[None]
+        except KeyError:
+            pass
 
-            # NOTE(flaper87): This assumes the storage driver type is the
-            # same as the management.
-            pool_conf = {'uri': self._conf[conf_section].uri,
-                         'options': {}}
+        now = time.time()
+        if now < self._virtual_pool_retry:
+            return None
 
+        conf_section = ('drivers:message_store:%s' %
+                        self._conf.drivers.message_store)
+
+        if conf_section not in self._conf:
+            # NOTE(flaper87): If there's no config section for this storage
+            # skip the pool registration entirely since we won't know how
+            # to connect to it.
+            self._virtual_pool_retry = now + VIRTUAL_POOL_RETRY_INTERVAL
+            return None
+
+        # NOTE(flaper87): This assumes the storage driver type is the
+        # same as the management.
+        pool_conf = {'uri': self._conf[conf_section].uri,
+                     'options': {}}
+
+        try:
             # NOTE(flaper87): This will be using the config
             # storage configuration as the default one if no
             # default storage has been registered in the pool
             # store.
-            return self.get_driver(None, pool_conf)
-
-        return self.get_driver(pool_id)
+            driver = self._init_driver(None, pool_conf)
+        except cerrors.InvalidDriver as ex:
+            # NOTE(kgriffs): Return `None`, rather than letting the
+            # exception bubble up, so that the higher layer doesn't
+            # have to duplicate the try..except..log code all over
+            # the place.
+            LOG.warning(_(u'The message store cannot be used for the '
+                          u'virtual pool: %(error)s'), {'error': ex})
+            self._virtual_pool_retry = now + VIRTUAL_POOL_RETRY_INTERVAL
+            return None
+
+        self._drivers[None] = driver
+        return driver
 
     def get_driver(self, pool_id, pool_conf=None):
         """Get storage driver, preferably cached, from a pool name.
@@ -13,9 +13,11 @@
 # limitations under the License.
 
 import functools
+import time
 
 import msgpack
 from oslo_log import log as logging
+from oslo_utils import encodeutils
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
 
@@ -33,14 +35,6 @@ CLAIM_MESSAGES_SUFFIX = 'messages'
 
 RETRY_CLAIM_TIMEOUT = 10
 
-# NOTE(kgriffs): Number of claims to read at a time when counting
-# the total number of claimed messages for a queue.
-#
-# TODO(kgriffs): Tune this parameter and/or make it configurable. It
-# takes  ~0.8 ms to retrieve 100 items from a sorted set on a 2.7 GHz
-# Intel Core i7 (not including network latency).
-COUNTING_BATCH_SIZE = 100
-
 
 class ClaimController(storage.Claim, scripting.Mixin):
     """Implements claim resource operations using Redis.
@@ -79,7 +73,7 @@ class ClaimController(storage.Claim, scripting.Mixin):
         +----------------+---------+
     """
 
-    script_names = ['claim_messages']
+    script_names = ['claim_messages', 'renew_claim', 'release_claim']
 
     def __init__(self, *args, **kwargs):
         super(ClaimController, self).__init__(*args, **kwargs)
@@ -97,13 +91,13 @@ class ClaimController(storage.Claim, scripting.Mixin):
     def _queue_ctrl(self):
         return self.driver.queue_controller
 
-    def _get_claim_info(self, claim_id, fields, transform=int):
+    def _get_claim_info(self, claim_key, fields, transform=int):
         """Get one or more fields from the claim Info."""
 
-        values = self._client.hmget(claim_id, fields)
+        values = self._client.hmget(claim_key, fields)
         return [transform(v) for v in values] if transform else values
 
-    def _claim_messages(self, msgset_key, now, limit,
+    def _claim_messages(self, queue, project, now, limit,
                         claim_id, claim_expires, msg_ttl, msg_expires):
 
         # NOTE(kgriffs): A watch on a pipe could also be used, but that
@@ -111,20 +105,27 @@ class ClaimController(storage.Claim, scripting.Mixin):
         # having to do something similar in the MongoDB driver.
         func = self._scripts['claim_messages']
 
-        args = [now, limit, claim_id, claim_expires, msg_ttl, msg_expires]
-        return func(keys=[msgset_key], args=args)
+        tag = self.driver.key_tag(queue, project)
+        keys = [tag + utils.msgset_key(queue, project),
+                tag + utils.active_key(queue, project),
+                tag + utils.claimed_key(queue, project)]
+
+        args = [now, limit, claim_id, claim_expires, msg_ttl, msg_expires,
+                tag]
+        return func(keys=keys, args=args)
 
     def _exists(self, queue, claim_id, project):
         client = self._client
-        claims_set_key = utils.scope_claims_set(queue, project,
-                                                QUEUE_CLAIMS_SUFFIX)
+        tag = self.driver.key_tag(queue, project)
+        claims_set_key = tag + utils.scope_claims_set(queue, project,
+                                                      QUEUE_CLAIMS_SUFFIX)
 
         # Return False if no such claim exists
         # TODO(prashanthr_): Discuss the feasibility of a bloom filter.
         if client.zscore(claims_set_key, claim_id) is None:
             return False
 
-        expires = self._get_claim_info(claim_id, b'e')[0]
+        expires = self._get_claim_info(tag + claim_id, b'e')[0]
         now = timeutils.utcnow_ts()
 
         if expires <= now:
@@ -136,48 +137,29 @@ class ClaimController(storage.Claim, scripting.Mixin):
 
         return True
 
+    def _claim_msgs_key(self, claim_id, tag=''):
+        return tag + utils.scope_claim_messages(claim_id,
+                                                CLAIM_MESSAGES_SUFFIX)
+
     def _get_claimed_message_keys(self, claim_msgs_key):
         return self._client.lrange(claim_msgs_key, 0, -1)
 
     def _count_messages(self, queue, project):
         """Count and return the total number of claimed messages."""
 
-        # NOTE(kgriffs): Iterate through all claims, adding up the
-        # number of messages per claim. This is obviously slower
-        # than keeping a side counter, but is also less error-prone.
-        # Plus, it avoids having to do a lot of extra work during
-        # garbage collection passes. Also, considering that most
-        # workloads won't require a large number of claims, most of
-        # the time we can do this in a single pass, so it is still
-        # pretty fast.
-
-        claims_set_key = utils.scope_claims_set(queue, project,
-                                                QUEUE_CLAIMS_SUFFIX)
-        num_claimed = 0
-        offset = 0
-
-        while True:
-            claim_ids = self._client.zrange(claims_set_key, offset,
-                                            offset + COUNTING_BATCH_SIZE - 1)
-            if not claim_ids:
-                break
-
-            offset += len(claim_ids)
-
-            with self._client.pipeline() as pipe:
-                for cid in claim_ids:
-                    pipe.hmget(cid, 'n')
-
-                claim_infos = pipe.execute()
-
-            for info in claim_infos:
-                # NOTE(kgriffs): In case the claim was deleted out
-                # from under us, sanity-check that we got a non-None
-                # info list.
-                if info:
-                    num_claimed += int(info[0])
+        # NOTE: Every claimed message is kept in the queue's
+        # claimed set, scored by its claim expiry time, and the claim,
+        # delete and GC scripts keep that set up to date atomically.
+        # Messages whose claims have expired are only moved back to
+        # the active set by the next claim, so they are excluded by
+        # counting only scores later than the current time. This
+        # makes the count independent of the number of claims.
+        self._message_ctrl._ensure_migrated(queue, project)
 
-        return num_claimed
+        now = timeutils.utcnow_ts()
+        claimed_key = (self.driver.key_tag(queue, project) +
+                       utils.claimed_key(queue, project))
+        return self._client.zcount(claimed_key, '({0}'.format(now), '+inf')
 
     def _del_message(self, queue, project, claim_id, message_id, pipe):
         """Called by MessageController when messages are being deleted.
@@ -185,8 +167,8 @@ class ClaimController(storage.Claim, scripting.Mixin):
         This method removes the message from claim data structures.
         """
 
-        claim_msgs_key = utils.scope_claim_messages(claim_id,
-                                                    CLAIM_MESSAGES_SUFFIX)
+        tag = self.driver.key_tag(queue, project)
+        claim_msgs_key = self._claim_msgs_key(claim_id, tag)
 
         # NOTE(kgriffs): In practice, scanning will be quite fast,
         # since the usual pattern is to delete messages from oldest
@@ -195,7 +177,7 @@ class ClaimController(storage.Claim, scripting.Mixin):
         pipe.lrem(claim_msgs_key, 1, message_id)
 
         # NOTE(kgriffs): Decrement the message counter used for stats
-        pipe.hincrby(claim_id, 'n', -1)
+        pipe.hincrby(tag + claim_id, 'n', -1)
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
@@ -208,8 +190,9 @@ class ClaimController(storage.Claim, scripting.Mixin):
         :returns: Number of claims removed
         """
 
-        claims_set_key = utils.scope_claims_set(queue, project,
-                                                QUEUE_CLAIMS_SUFFIX)
+        claims_set_key = (self.driver.key_tag(queue, project) +
+                          utils.scope_claims_set(queue, project,
+                                                 QUEUE_CLAIMS_SUFFIX))
         now = timeutils.utcnow_ts()
         num_removed = self._client.zremrangebyscore(claims_set_key, 0, now)
         return num_removed
@@ -220,11 +203,12 @@ class ClaimController(storage.Claim, scripting.Mixin):
         if not self._exists(queue, claim_id, project):
             raise errors.ClaimDoesNotExist(queue, project, claim_id)
 
-        claim_msgs_key = utils.scope_claim_messages(claim_id,
-                                                    CLAIM_MESSAGES_SUFFIX)
+        tag = self.driver.key_tag(queue, project)
+        claim_msgs_key = self._claim_msgs_key(claim_id, tag)
 
         # basic_messages
-        msg_keys = self._get_claimed_message_keys(claim_msgs_key)
+        msg_keys = [tag + encodeutils.safe_decode(mid) for mid in
+                    self._get_claimed_message_keys(claim_msgs_key)]
         claimed_msgs = messages.Message.from_redis_bulk(msg_keys,
                                                         self._client)
         now = timeutils.utcnow_ts()
@@ -233,7 +217,7 @@ class ClaimController(storage.Claim, scripting.Mixin):
 
         # claim_meta
         now = timeutils.utcnow_ts()
-        expires, ttl = self._get_claim_info(claim_id, [b'e', b't'])
+        expires, ttl = self._get_claim_info(tag + claim_id, [b'e', b't'])
         update_time = expires - ttl
         age = now - update_time
 
@@ -262,20 +246,21 @@ class ClaimController(storage.Claim, scripting.Mixin):
         claimed_msgs = []
 
         # NOTE(kgriffs): Claim some messages
-        msgset_key = utils.msgset_key(queue, project)
-        claimed_ids = self._claim_messages(msgset_key, now, limit,
+        self._message_ctrl._ensure_migrated(queue, project)
+        claimed_ids = self._claim_messages(queue, project, now, limit,
                                            claim_id, claim_expires,
                                            msg_ttl, msg_expires)
 
         if claimed_ids:
-            claimed_msgs = messages.Message.from_redis_bulk(claimed_ids,
-                                                            self._client)
+            tag = self.driver.key_tag(queue, project)
+            claimed_msgs = messages.Message.from_redis_bulk(
+                [tag + encodeutils.safe_decode(mid) for mid in claimed_ids],
+                self._client)
             claimed_msgs = [msg.to_basic(now) for msg in claimed_msgs]
 
             # NOTE(kgriffs): Perist claim records
             with self._client.pipeline() as pipe:
-                claim_msgs_key = utils.scope_claim_messages(
-                    claim_id, CLAIM_MESSAGES_SUFFIX)
+                claim_msgs_key = self._claim_msgs_key(claim_id, tag)
 
                 for mid in claimed_ids:
                     pipe.rpush(claim_msgs_key, mid)
@@ -289,8 +274,8 @@ class ClaimController(storage.Claim, scripting.Mixin):
                     'n': len(claimed_ids),
                 }
 
-                pipe.hmset(claim_id, claim_info)
-                pipe.expire(claim_id, claim_ttl)
+                pipe.hmset(tag + claim_id, claim_info)
+                pipe.expire(tag + claim_id, claim_ttl)
 
                 # NOTE(kgriffs): Add the claim ID to a set so that
                 # existence checks can be performed quickly. This
@@ -299,8 +284,8 @@ class ClaimController(storage.Claim, scripting.Mixin):
                 #
                 # A sorted set is used to facilitate cleaning
                 # up the IDs of expired claims.
-                claims_set_key = utils.scope_claims_set(queue, project,
-                                                        QUEUE_CLAIMS_SUFFIX)
+                claims_set_key = tag + utils.scope_claims_set(
+                    queue, project, QUEUE_CLAIMS_SUFFIX)
 
                 pipe.zadd(claims_set_key, claim_expires, claim_id)
                 pipe.execute()
@@ -309,99 +294,85 @@ class ClaimController(storage.Claim, scripting.Mixin):
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
-    def update(self, queue, claim_id, metadata, project=None):
-        if not self._exists(queue, claim_id, project):
-            raise errors.ClaimDoesNotExist(claim_id, queue, project)
-
-        now = timeutils.utcnow_ts()
+    def wait(self, queue, timeout, project=None):
+        tag = self.driver.key_tag(queue, project)
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
 
-        claim_ttl = metadata['ttl']
-        claim_expires = now + claim_ttl
+        try:
+            pubsub.subscribe(tag + utils.signal_channel(queue, project))
 
-        grace = metadata['grace']
-        msg_ttl = claim_ttl + grace
-        msg_expires = claim_expires + grace
+            # NOTE: Messages may have been posted since the caller's
+            # last claim, but before the subscription took effect.
+            active_key = tag + utils.active_key(queue, project)
+            if self._client.zcard(active_key):
+                return True
 
-        claim_msgs_key = utils.scope_claim_messages(claim_id,
-                                                    CLAIM_MESSAGES_SUFFIX)
+            deadline = time.time() + timeout
+            remaining = timeout
 
-        msg_keys = self._get_claimed_message_keys(claim_msgs_key)
-        claimed_msgs = messages.MessageEnvelope.from_redis_bulk(msg_keys,
-                                                                self._client)
-        claim_info = {
-            't': claim_ttl,
-            'e': claim_expires,
-        }
+            while remaining > 0:
+                if pubsub.get_message(timeout=remaining):
+                    return True
 
-        with self._client.pipeline() as pipe:
-            for msg in claimed_msgs:
-                if msg:
-                    msg.claim_id = claim_id
-                    msg.claim_expires = claim_expires
+                remaining = deadline - time.time()
 
-                    if _msg_would_expire(msg, claim_expires):
-                        msg.ttl = msg_ttl
-                        msg.expires = msg_expires
+            return False
 
-                    # TODO(kgriffs): Rather than writing back the
-                    # entire message, only set the fields that
-                    # have changed.
-                    #
-                    # When this change is made, don't forget to
-                    # also call pipe.expire with the new TTL value.
-                    msg.to_redis(pipe)
+        finally:
+            pubsub.close()
 
-            # Update the claim id and claim expiration info
-            # for all the messages.
-            pipe.hmset(claim_id, claim_info)
-            pipe.expire(claim_id, claim_ttl)
+    @utils.raises_conn_error
+    @utils.retries_on_connection_error
+    def update(self, queue, claim_id, metadata, project=None):
+        if not uuidutils.is_uuid_like(claim_id):
+            raise errors.ClaimDoesNotExist(claim_id, queue, project)
 
-            pipe.expire(claim_msgs_key, claim_ttl)
+        now = timeutils.utcnow_ts()
 
-            claims_set_key = utils.scope_claims_set(queue, project,
-                                                    QUEUE_CLAIMS_SUFFIX)
+        claim_ttl = metadata['ttl']
+        claim_expires = now + claim_ttl
 
-            pipe.zadd(claims_set_key, claim_expires, claim_id)
+        grace = metadata['grace']
+        msg_ttl = claim_ttl + grace
+        msg_expires = claim_expires + grace
 
-            pipe.execute()
+        # NOTE: The script checks that the claim exists and then only
+        # touches the claim fields of each message (plus the TTL, if
+        # it has to be extended), so that messages do not have to be
+        # read back and rewritten in their entirety.
+        func = self._scripts['renew_claim']
+        tag = self.driver.key_tag(queue, project)
+        keys = [tag + utils.scope_claims_set(queue, project,
+                                             QUEUE_CLAIMS_SUFFIX),
+                tag + claim_id,
+                self._claim_msgs_key(claim_id, tag),
+                tag + utils.claimed_key(queue, project)]
+
+        args = [claim_id, now, claim_ttl, claim_expires,
+                msg_ttl, msg_expires, tag]
+
+        if not func(keys=keys, args=args):
+            raise errors.ClaimDoesNotExist(claim_id, queue, project)
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def delete(self, queue, claim_id, project=None):
         # NOTE(prashanthr_): Return silently when the claim
         # does not exist
-        if not self._exists(queue, claim_id, project):
+        if not uuidutils.is_uuid_like(claim_id):
             return
 
-        now = timeutils.utcnow_ts()
-        claim_msgs_key = utils.scope_claim_messages(claim_id,
-                                                    CLAIM_MESSAGES_SUFFIX)
-
-        msg_keys = self._get_claimed_message_keys(claim_msgs_key)
-        claimed_msgs = messages.MessageEnvelope.from_redis_bulk(msg_keys,
-                                                                self._client)
-        # Update the claim id and claim expiration info
-        # for all the messages.
-        claims_set_key = utils.scope_claims_set(queue, project,
-                                                QUEUE_CLAIMS_SUFFIX)
-
-        with self._client.pipeline() as pipe:
-            pipe.zrem(claims_set_key, claim_id)
-            pipe.delete(claim_id)
-            pipe.delete(claim_msgs_key)
-
-            for msg in claimed_msgs:
-                if msg:
-                    msg.claim_id = None
-                    msg.claim_expires = now
-
-                    # TODO(kgriffs): Rather than writing back the
-                    # entire message, only set the fields that
-                    # have changed.
-                    msg.to_redis(pipe)
-
-            pipe.execute()
+        func = self._scripts['release_claim']
+        tag = self.driver.key_tag(queue, project)
+        keys = [tag + utils.scope_claims_set(queue, project,
+                                             QUEUE_CLAIMS_SUFFIX),
+                tag + claim_id,
+                self._claim_msgs_key(claim_id, tag),
+                tag + utils.msgset_key(queue, project),
+                tag + utils.active_key(queue, project),
+                tag + utils.claimed_key(queue, project)]
 
+        args = [claim_id, timeutils.utcnow_ts(), tag,
+                tag + utils.signal_channel(queue, project)]
 
-def _msg_would_expire(message, now):
-    return message.expires <= now
+        func(keys=keys, args=args)
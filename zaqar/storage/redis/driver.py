@@ -17,12 +17,18 @@ import redis
 import redis.sentinel
 from six.moves import urllib
 
+try:
+    import rediscluster
+except ImportError:
+    rediscluster = None
+
 from zaqar.common import decorators
 from zaqar.common import errors
 from zaqar.i18n import _
 from zaqar import storage
 from zaqar.storage.redis import controllers
 from zaqar.storage.redis import options
+from zaqar.storage.redis import utils
 
 LOG = logging.getLogger(__name__)
 REDIS_DEFAULT_PORT = 6379
@@ -32,6 +38,7 @@ DEFAULT_SOCKET_TIMEOUT = 0.1
 STRATEGY_TCP = 1
 STRATEGY_UNIX = 2
 STRATEGY_SENTINEL = 3
+STRATEGY_CLUSTER = 4
 
 
 class ConnectionURI(object):
@@ -72,7 +79,35 @@ class ConnectionURI(object):
         self.master = None
         self.sentinels = []
 
-        if 'master' in query_params:
+        # Cluster
+        self.startup_nodes = []
+
+        if query_params.get('cluster', '').lower() in ('1', 'true', 'yes'):
+            self.strategy = STRATEGY_CLUSTER
+
+            for each_host in parsed_url.netloc.split(','):
+                name, sep, port = each_host.partition(':')
+
+                if port:
+                    try:
+                        port = int(port)
+                    except ValueError:
+                        msg = _('The Redis configuration URI contains an '
+                                'invalid port')
+                        raise errors.ConfigurationError(msg)
+
+                else:
+                    port = REDIS_DEFAULT_PORT
+
+                if name:
+                    self.startup_nodes.append({'host': name, 'port': port})
+
+            if not self.startup_nodes:
+                msg = _('The Redis configuration URI does not define any '
+                        'cluster nodes')
+                raise errors.ConfigurationError(msg)
+
+        elif 'master' in query_params:
             # NOTE(prashanthr_): Configure redis driver in sentinel mode
             self.strategy = STRATEGY_SENTINEL
             self.master = query_params['master']
@@ -105,11 +140,13 @@ class ConnectionURI(object):
                 # NOTE(kgriffs): They probably were specifying
                 # a list of sentinel hostnames, but forgot to
                 # add 'master' to the query string.
-                msg = _('The Redis URI specifies multiple sentinel hosts, '
-                        'but is missing the "master" query string '
-                        'parameter. Please set "master" to the name of '
-                        'the Redis master server as specified in the '
-                        'sentinel configuration file.')
+                msg = _('The Redis URI specifies multiple hosts, but is '
+                        'missing either the "master" query string '
+                        'parameter for sentinel hosts, or the "cluster" '
+                        'parameter for cluster nodes. Please set "master" '
+                        'to the name of the Redis master server as '
+                        'specified in the sentinel configuration file, '
+                        'or set "cluster" to "true".')
                 raise errors.ConfigurationError(msg)
 
             self.strategy = STRATEGY_TCP
@@ -136,7 +173,7 @@ class ConnectionURI(object):
             self.unix_socket_path = path
 
         assert self.strategy in (STRATEGY_TCP, STRATEGY_UNIX,
-                                 STRATEGY_SENTINEL)
+                                 STRATEGY_SENTINEL, STRATEGY_CLUSTER)
 
 
 class DataDriver(storage.DataDriverBase):
@@ -154,12 +191,27 @@ class DataDriver(storage.DataDriverBase):
         super(DataDriver, self).__init__(conf, cache, control_driver)
         self.redis_conf = self.conf[options.MESSAGE_REDIS_GROUP]
 
-        server_version = self.connection.info()['redis_version']
-        if tuple(map(int, server_version.split('.'))) < (2, 6):
-            msg = _('The Redis driver requires redis-server>=2.6, '
-                    '%s found') % server_version
+        connection_uri = ConnectionURI(self.redis_conf.uri)
+
+        # NOTE: In cluster mode, the keys of each queue are hash
+        # tagged so that the Lua scripts only ever touch a single slot.
+        self.hash_tag_keys = connection_uri.strategy == STRATEGY_CLUSTER
+
+        server_info = self.connection.info()
+        if self.hash_tag_keys:
+            # NOTE: The cluster client returns the info of every
+            # node, keyed by node name.
+            server_versions = [info['redis_version']
+                               for info in server_info.values()]
+        else:
+            server_versions = [server_info['redis_version']]
+
+        for server_version in server_versions:
+            if tuple(map(int, server_version.split('.'))) < (2, 6):
+                msg = _('The Redis driver requires redis-server>=2.6, '
+                        '%s found') % server_version
 
-            raise RuntimeError(msg)
+                raise RuntimeError(msg)
 
         # FIXME(flaper87): Make this dynamic
         self._capabilities = self.BASE_CAPABILITIES
@@ -183,13 +235,24 @@ class DataDriver(storage.DataDriverBase):
         return KPI
 
     def gc(self):
-        # TODO(kgriffs): Check time since last run, and if
-        # it hasn't been very long, skip. This allows for
-        # running the GC script on multiple boxes for HA,
-        # without having them all attempting to GC at the
-        # same moment.
         self.message_controller.gc()
 
+    def reconcile(self):
+        self.message_controller.reconcile()
+
+    def key_tag(self, queue, project=None):
+        """Returns the prefix for the keys that hold a queue's data.
+
+        In cluster mode, this is a hash tag that maps all of the
+        queue's keys to the same slot. Otherwise, keys are not
+        prefixed, so that existing data remains accessible.
+        """
+
+        if self.hash_tag_keys:
+            return utils.queue_hash_tag(queue, project)
+
+        return ''
+
     @decorators.lazy_property(write=False)
     def connection(self):
         """Redis client connection instance."""
@@ -244,7 +307,17 @@ def _get_redis_client(driver):
     conf = driver.redis_conf
     connection_uri = ConnectionURI(conf.uri)
 
-    if connection_uri.strategy == STRATEGY_SENTINEL:
+    if connection_uri.strategy == STRATEGY_CLUSTER:
+        if rediscluster is None:
+            msg = _('The Redis URI specifies a cluster, but the '
+                    'redis-py-cluster library is not installed')
+            raise errors.ConfigurationError(msg)
+
+        return rediscluster.StrictRedisCluster(
+            startup_nodes=connection_uri.startup_nodes,
+            socket_timeout=connection_uri.socket_timeout)
+
+    elif connection_uri.strategy == STRATEGY_SENTINEL:
         sentinel = redis.sentinel.Sentinel(
             connection_uri.sentinels,
             socket_timeout=connection_uri.socket_timeout)
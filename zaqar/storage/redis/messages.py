@@ -12,9 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import functools
+import threading
+import time
 import uuid
 
+from oslo_log import log as logging
 from oslo_utils import encodeutils
 from oslo_utils import timeutils
 import redis
@@ -26,12 +30,41 @@ from zaqar.storage.redis import models
 from zaqar.storage.redis import scripting
 from zaqar.storage.redis import utils
 
+LOG = logging.getLogger(__name__)
+
 Message = models.Message
 MessageEnvelope = models.MessageEnvelope
 
 
 MSGSET_INDEX_KEY = 'msgset_index'
 
+# NOTE: Each msgset is registered in the index with a score
+# that records the layout version of the message ID sets for that
+# queue. Queues created before the active and claimed sets were
+# introduced have a score of 1, and those created before messages
+# were indexed by expiration time have a score of 2. Both are
+# migrated on first use, or by the GC.
+MSGSET_FORMAT_VERSION = 3
+
+# NOTE: Maximum number of msgsets that each process remembers to have
+# been migrated already. The least recently used ones are forgotten
+# first, and their version is simply read from the index again.
+MIGRATED_MSGSETS_CACHE_SIZE = 10000
+
+# NOTE: Msgsets scored by the earliest time at which one of their
+# messages may expire, so that the GC only visits queues that have
+# something to collect, most overdue first.
+MSGSET_GC_INDEX_KEY = 'msgset_gc_index'
+
+# NOTE: Persisted state of the GC, shared by every zaqar-gc process
+GC_CURSOR_KEY = 'gc_cursor'
+GC_LOCK_KEY = 'gc_lock'
+GC_METRICS_KEY = 'gc_metrics'
+
+# NOTE: Seconds, in addition to the time budget, after which the
+# lock held by a GC run is released in case the process died.
+GC_LOCK_GRACE = 10
+
 # The rank counter is an atomic index to rank messages
 # in a FIFO manner.
 MESSAGE_RANK_COUNTER_SUFFIX = 'rank_counter'
@@ -51,6 +84,11 @@ class MessageController(storage.Message, scripting.Mixin):
 
     Messages are scoped by project + queue.
 
+    When the driver is connected to a Redis Cluster, every key below
+    that belongs to a single queue (including the message hashes) is
+    prefixed with the queue's hash tag, `{<project_id>.<queue_name>}`,
+    so that all of them are stored in the same slot.
+
     Redis Data Structures:
 
     1. Message id's list (Redis sorted set)
@@ -70,7 +108,38 @@ class MessageController(storage.Message, scripting.Mixin):
 
         Key: msgset_index
 
-    3. Messages(Redis Hash):
+    3. Active message id's list (Redis sorted set)
+
+        The subset of message ids in the queue that are not currently
+        claimed, scored by the same rank as in the queue's message id
+        list. Claiming moves ids out of this set, so claims never have
+        to scan past messages that are already in flight.
+
+        Key: <project_id>.<queue_name>.active
+
+    4. Claimed message id's list (Redis sorted set)
+
+        Message ids that have been claimed, scored by the claim
+        expiration time. Ids whose claims have expired are returned
+        to the active set the next time messages are claimed.
+
+        Key: <project_id>.<queue_name>.claimed
+
+    5. Expiring message id's list (Redis sorted set)
+
+        Message ids scored by message expiration time, so that the
+        GC can find expired messages without checking each one.
+
+        Key: <project_id>.<queue_name>.expires
+
+    6. GC schedule (Redis sorted set)
+
+        Msgset keys scored by the earliest expiration time in the
+        corresponding queue's expiring message id's list.
+
+        Key: msgset_gc_index
+
+    7. Messages(Redis Hash):
 
         Scoped by the UUID of the message, the redis datastructure
         has the following information.
@@ -95,17 +164,40 @@ class MessageController(storage.Message, scripting.Mixin):
         |  created time       |  cr     |
         +---------------------+---------+
 
-    4. Messages rank counter (Redis Hash):
+        When the message_encoding option is set to "compact", the
+        id, created time, client uuid and body are instead packed
+        together into a single field, `p`, and optionally compressed.
+        The remaining fields are kept as-is for use by the scripts.
+
+    8. Messages rank counter (Redis Hash):
 
         Key: <project_id>.<queue_name>.rank_counter
+
+    Whenever messages are posted to a queue, or returned to it by
+    releasing a claim, their number is also published to the queue's
+    signal channel, so that consumers that are waiting for messages
+    to claim are woken right away.
+
+        Channel: <project_id>.<queue_name>.signal
     """
 
-    script_names = ['index_messages']
+    script_names = ['post_messages', 'delete_messages',
+                    'index_active_messages', 'gc_messages', 'schedule_gc',
+                    'release_lock']
 
     def __init__(self, *args, **kwargs):
         super(MessageController, self).__init__(*args, **kwargs)
         self._client = self.driver.connection
 
+        # NOTE: Msgset keys that are known to have been migrated to
+        # the current format version, least recently used first.
+        self._migrated_msgsets = collections.OrderedDict()
+        self._migrated_msgsets_lock = threading.Lock()
+
+        redis_conf = self.driver.redis_conf
+        self._compact = redis_conf.message_encoding == 'compact'
+        self._compression_threshold = redis_conf.compression_threshold
+
     @decorators.lazy_property(write=False)
     def _queue_ctrl(self):
         return self.driver.queue_controller
@@ -114,13 +206,178 @@ class MessageController(storage.Message, scripting.Mixin):
     def _claim_ctrl(self):
         return self.driver.claim_controller
 
-    def _index_messages(self, msgset_key, counter_key, message_ids):
+    @property
+    def _script_gc_index_key(self):
+        """Name of the GC index, for scripts that may update it.
+
+        In cluster mode, the GC index is stored in a different slot
+        than the keys of any given queue, so it can not be updated by
+        the scripts that operate on a queue. In that case, this is an
+        empty string, and the caller updates the index instead.
+        """
+
+        return '' if self.driver.hash_tag_keys else MSGSET_GC_INDEX_KEY
+
+    def _schedule_gc(self, msgset_key, expires):
+        """Schedule the GC of a queue no later than the given time."""
+
+        func = self._scripts['schedule_gc']
+        func(keys=[MSGSET_GC_INDEX_KEY], args=[msgset_key, expires])
+
+    def _post_messages(self, queue, project, messages):
+        """Write and index the given messages in a single round trip.
+
+        Since the message hashes are written by the same script that
+        ranks them and adds them to the msgset, either all of them
+        are posted, or none are.
+        """
+
         # NOTE(kgriffs): A watch on a pipe could also be used to ensure
         # messages are inserted in order, but that would be less efficient.
-        func = self._scripts['index_messages']
+        func = self._scripts['post_messages']
+
+        tag = self.driver.key_tag(queue, project)
+        msgset_key = tag + utils.msgset_key(queue, project)
+        gc_index_key = self._script_gc_index_key
+
+        keys = [msgset_key,
+                tag + utils.scope_queue_index(queue, project,
+                                              MESSAGE_RANK_COUNTER_SUFFIX),
+                tag + utils.active_key(queue, project),
+                tag + utils.expires_key(queue, project)]
+
+        arguments = [tag, gc_index_key,
+                     tag + utils.signal_channel(queue, project)]
+
+        for msg in messages:
+            keys.append(tag + msg.id)
+
+            hmap = msg.to_hmap(self._compact, self._compression_threshold)
+            arguments.extend([msg.ttl, msg.expires, 2 * len(hmap)])
+
+            for field, value in hmap.items():
+                arguments.extend([field, value])
+
+        func(keys=keys, args=arguments)
+
+        if not gc_index_key:
+            self._schedule_gc(msgset_key,
+                              min(msg.expires for msg in messages))
+
+    def _delete_messages(self, queue, project, message_ids=(),
+                         claim_id=None, pop_limit=0):
+        """Delete messages and their claim records in one round trip.
+
+        :param message_ids: IDs of the messages to delete
+        :param claim_id: If given, only messages that are currently
+            claimed by this claim are deleted.
+        :param pop_limit: If greater than zero, `message_ids` is
+            ignored, and up to this many messages are deleted from
+            the head of the queue instead.
+        :returns: The deleted messages as hmaps when popping;
+            otherwise, the IDs of the messages that were not deleted
+            because they are not claimed by `claim_id`.
+        """
+
+        func = self._scripts['delete_messages']
 
-        arguments = [len(message_ids)] + message_ids
-        func(keys=[msgset_key, counter_key], args=arguments)
+        tag = self.driver.key_tag(queue, project)
+        keys = [tag + utils.msgset_key(queue, project),
+                tag + utils.active_key(queue, project),
+                tag + utils.claimed_key(queue, project),
+                tag + utils.expires_key(queue, project)]
+        keys.extend(tag + mid for mid in message_ids)
+
+        # NOTE: The script derives the key of the list of messages
+        # for each claim by appending the claim ID to this prefix.
+        claim_msgs_prefix = self._claim_ctrl._claim_msgs_key('', tag)
+
+        args = [timeutils.utcnow_ts(), tag, claim_msgs_prefix,
+                claim_id or '', pop_limit]
+
+        results = func(keys=keys, args=args)
+
+        if pop_limit:
+            return results
+
+        return [encodeutils.safe_decode(mid) for mid in results]
+
+    def _migrate_msgset(self, queue, project):
+        """Build the derived ID sets for a legacy msgset.
+
+        Queues created by older versions of the driver lack some
+        of the sets derived from the msgset. This method sorts the
+        IDs in the msgset into the active, claimed and expiring
+        sets, in batches so as not to block other operations for
+        too long, and then bumps the format version recorded in
+        the msgset index.
+        """
+
+        func = self._scripts['index_active_messages']
+        tag = self.driver.key_tag(queue, project)
+        msgset_key = tag + utils.msgset_key(queue, project)
+        expires_key = tag + utils.expires_key(queue, project)
+        gc_index_key = self._script_gc_index_key
+
+        keys = [msgset_key,
+                tag + utils.active_key(queue, project),
+                tag + utils.claimed_key(queue, project),
+                expires_key]
+
+        # NOTE: Ranks start at 1, so the first batch
+        # will begin with the head of the queue.
+        cursor = 0
+
+        while cursor is not None:
+            now = timeutils.utcnow_ts()
+            cursor = func(keys=keys, args=[now, cursor, GC_BATCH_SIZE,
+                                           tag, gc_index_key])
+
+            if cursor is not None:
+                cursor = encodeutils.safe_decode(cursor)
+
+        if not gc_index_key:
+            head = self._client.zrange(expires_key, 0, 0, withscores=True)
+            if head:
+                self._schedule_gc(msgset_key, int(head[0][1]))
+
+        self._client.zadd(MSGSET_INDEX_KEY, MSGSET_FORMAT_VERSION,
+                          msgset_key)
+
+    def _ensure_migrated(self, queue, project):
+        """Migrate the queue's msgset if it predates the current format."""
+
+        msgset_key = (self.driver.key_tag(queue, project) +
+                      utils.msgset_key(queue, project))
+
+        with self._migrated_msgsets_lock:
+            try:
+                # NOTE: Re-insert the key to mark it as the most
+                # recently used one.
+                self._migrated_msgsets[msgset_key] = (
+                    self._migrated_msgsets.pop(msgset_key))
+                return
+            except KeyError:
+                pass
+
+        version = self._client.zscore(MSGSET_INDEX_KEY, msgset_key)
+        if version is None:
+            # NOTE: The queue does not exist (yet)
+            return
+
+        if version < MSGSET_FORMAT_VERSION:
+            self._migrate_msgset(queue, project)
+
+        self._mark_migrated(msgset_key)
+
+    def _mark_migrated(self, msgset_key):
+        """Remember that a msgset has been migrated."""
+
+        with self._migrated_msgsets_lock:
+            self._migrated_msgsets[msgset_key] = True
+
+            while len(self._migrated_msgsets) > MIGRATED_MSGSETS_CACHE_SIZE:
+                self._migrated_msgsets.popitem(last=False)
 
     def _count(self, queue, project):
         """Return total number of messages in a queue.
@@ -129,13 +386,22 @@ class MessageController(storage.Message, scripting.Mixin):
             they haven't been GC'd yet. This is done for performance.
         """
 
-        return self._client.zcard(utils.msgset_key(queue, project))
+        msgset_key = (self.driver.key_tag(queue, project) +
+                      utils.msgset_key(queue, project))
+
+        return self._client.zcard(msgset_key)
 
     def _create_msgset(self, queue, project, pipe):
-        pipe.zadd(MSGSET_INDEX_KEY, 1, utils.msgset_key(queue, project))
+        msgset_key = (self.driver.key_tag(queue, project) +
+                      utils.msgset_key(queue, project))
+
+        pipe.zadd(MSGSET_INDEX_KEY, MSGSET_FORMAT_VERSION, msgset_key)
 
     def _delete_msgset(self, queue, project, pipe):
-        pipe.zrem(MSGSET_INDEX_KEY, utils.msgset_key(queue, project))
+        msgset_key = (self.driver.key_tag(queue, project) +
+                      utils.msgset_key(queue, project))
+        pipe.zrem(MSGSET_INDEX_KEY, msgset_key)
+        pipe.zrem(MSGSET_GC_INDEX_KEY, msgset_key)
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
@@ -147,41 +413,60 @@ class MessageController(storage.Message, scripting.Mixin):
         executing the operation.
         """
         client = self._client
-        msgset_key = utils.msgset_key(queue, project)
+        tag = self.driver.key_tag(queue, project)
+        msgset_key = tag + utils.msgset_key(queue, project)
         message_ids = client.zrange(msgset_key, 0, -1)
 
         pipe.delete(msgset_key)
+        pipe.delete(tag + utils.active_key(queue, project))
+        pipe.delete(tag + utils.claimed_key(queue, project))
+        pipe.delete(tag + utils.expires_key(queue, project))
+
         for msg_id in message_ids:
-            pipe.delete(msg_id)
+            pipe.delete(tag + encodeutils.safe_decode(msg_id))
 
-    # TODO(prashanthr_): Look for better ways to solve the issue.
-    def _find_first_unclaimed(self, queue, project, limit):
+    def _find_first_unclaimed(self, queue, project):
         """Find the first unclaimed message in the queue."""
 
-        msgset_key = utils.msgset_key(queue, project)
+        self._ensure_migrated(queue, project)
+
+        tag = self.driver.key_tag(queue, project)
+        msgset_key = tag + utils.msgset_key(queue, project)
         now = timeutils.utcnow_ts()
 
-        # TODO(kgriffs): Generalize this paging pattern (DRY)
-        offset = 0
+        with self._client.pipeline() as pipe:
+            pipe.zrange(tag + utils.active_key(queue, project), 0, 0,
+                        withscores=True)
 
-        while True:
-            msg_keys = self._client.zrange(msgset_key, offset,
-                                           offset + limit - 1)
-            if not msg_keys:
-                return None
+            # NOTE: Messages whose claims have expired are not
+            # returned to the active set until the next claim is made,
+            # so they must be considered as well.
+            pipe.zrangebyscore(tag + utils.claimed_key(queue, project),
+                               '-inf', now)
+
+            head, expired_ids = pipe.execute()
+
+        candidates = list(head)
+
+        if expired_ids:
+            with self._client.pipeline() as pipe:
+                for mid in expired_ids:
+                    pipe.zscore(msgset_key, mid)
 
-            offset += len(msg_keys)
+                ranks = pipe.execute()
 
-            messages = [MessageEnvelope.from_redis(msg_key, self._client)
-                        for msg_key in msg_keys]
+            candidates.extend((mid, rank)
+                              for mid, rank in zip(expired_ids, ranks)
+                              if rank is not None)
 
-            for msg in messages:
-                if msg and not utils.msg_claimed_filter(msg, now):
-                    return msg.id
+        if not candidates:
+            return None
+
+        return min(candidates, key=lambda c: c[1])[0]
 
-    def _exists(self, message_id):
+    def _exists(self, message_key):
         """Check if message exists in the Queue."""
-        return self._client.exists(message_id)
+        return self._client.exists(message_key)
 
     def _get_first_message_id(self, queue, project, sort):
         """Fetch head/tail of the Queue.
@@ -189,23 +474,44 @@ class MessageController(storage.Message, scripting.Mixin):
         Helper function to get the first message in the queue
         sort > 0 get from the left else from the right.
         """
-        msgset_key = utils.msgset_key(queue, project)
+        msgset_key = (self.driver.key_tag(queue, project) +
+                      utils.msgset_key(queue, project))
 
         zrange = self._client.zrange if sort == 1 else self._client.zrevrange
         message_ids = zrange(msgset_key, 0, 0)
         return message_ids[0] if message_ids else None
 
-    def _get_claim(self, message_id):
+    def _client_uuids(self, queue, message_ids, project=None):
+        """Returns the UUIDs of the clients that posted some messages.
+
+        :returns: A dict that maps the ID of each message that
+            exists to the UUID of the client that posted it.
+        """
+
+        tag = self.driver.key_tag(queue, project)
+
+        # NOTE: Read the whole hash, since the client UUID is packed
+        # along with the body in compact messages.
+        with self._client.pipeline() as pipe:
+            for mid in message_ids:
+                pipe.hgetall(tag + mid)
+
+            messages = pipe.execute()
+
+        return dict((msg.id, msg.client_uuid) for msg in
+                    (Message.from_hmap(hmap) for hmap in messages if hmap))
+
+    def _get_claim(self, message_key):
         """Gets minimal claim doc for a message.
 
         :returns: {'id': cid, 'expires': ts} IFF the message is claimed,
             and that claim has not expired.
         """
 
-        claim = self._client.hmget(message_id, 'c', 'c.e')
+        claim = self._client.hmget(message_key, 'c', 'c.e')
 
         if claim == [None, None]:
-            # NOTE(kgriffs): message_id was not found
+            # NOTE(kgriffs): message_key was not found
             return None
 
         info = {
@@ -232,14 +538,15 @@ class MessageController(storage.Message, scripting.Mixin):
             raise errors.QueueDoesNotExist(queue,
                                            project)
 
-        msgset_key = utils.msgset_key(queue, project)
+        tag = self.driver.key_tag(queue, project)
+        msgset_key = tag + utils.msgset_key(queue, project)
         client = self._client
 
         if not marker and not include_claimed:
             # NOTE(kgriffs): Skip claimed messages at the head
             # of the queue; otherwise we would just filter them all
             # out and likely end up with an empty list to return.
-            marker = self._find_first_unclaimed(queue, project, limit)
+            marker = self._find_first_unclaimed(queue, project)
             start = client.zrank(msgset_key, marker) or 0
         else:
             rank = client.zrank(msgset_key, marker)
@@ -248,7 +555,9 @@ class MessageController(storage.Message, scripting.Mixin):
         message_ids = client.zrange(msgset_key, start,
                                     start + (limit - 1))
 
-        messages = Message.from_redis_bulk(message_ids, client)
+        messages = Message.from_redis_bulk(
+            [tag + encodeutils.safe_decode(mid) for mid in message_ids],
+            client)
 
         # NOTE(prashanthr_): Build a list of filters for checking
         # the following:
@@ -279,18 +588,180 @@ class MessageController(storage.Message, scripting.Mixin):
         """Garbage-collect expired message data.
 
         Not all message data can be automatically expired. This method
-        cleans up the remainder.
+        cleans up the remainder, within the time and work budgets given
+        by the gc_time_budget and gc_work_budget options, so that it can
+        be run every few seconds without blocking other operations.
+
+        Each run first removes expired messages from the queues that
+        are most overdue. Any remaining budget is then used to sweep
+        the next slice of queues for expired claims and legacy msgsets,
+        resuming from where the previous run left off. Metrics for the
+        run are logged, and saved under the gc_metrics key.
 
         :returns: Number of messages removed
         """
         client = self._client
+        conf = self.driver.redis_conf
+
+        # NOTE: Only one GC may run at a time, so that zaqar-gc
+        # can be scheduled on several boxes for HA. The lock expires on
+        # its own in case this process dies before releasing it.
+        lock_ttl = int(conf.gc_time_budget) + GC_LOCK_GRACE
+        token = str(uuid.uuid4())
+        if not client.set(GC_LOCK_KEY, token, nx=True, ex=lock_ttl):
+            LOG.debug(u'Skipping GC run; another one is in progress')
+            return 0
+
+        try:
+            metrics = self._gc(conf.gc_time_budget, conf.gc_work_budget)
+        finally:
+            # NOTE: Leave the lock alone if it expired, and another
+            # GC run took it in the meantime.
+            self._scripts['release_lock'](keys=[GC_LOCK_KEY],
+                                          args=[token])
+
+        client.hmset(GC_METRICS_KEY, metrics)
+        LOG.info(u'GC run finished in %(elapsed).3f seconds: '
+                 u'%(messages_removed)d messages removed from '
+                 u'%(queues_collected)d queues, %(queues_swept)d queues '
+                 u'swept, %(claims_removed)d claims removed, '
+                 u'%(msgsets_migrated)d msgsets migrated', metrics)
+
+        return metrics['messages_removed']
+
+    def _gc(self, time_budget, work_budget):
+        """Perform a single GC run within the given budgets.
+
+        :param time_budget: Time after which no new batch is started,
+            in seconds
+        :param work_budget: Maximum number of message IDs and queues
+            to examine
+        :returns: Metrics for the run
+        """
+        client = self._client
+        func = self._scripts['gc_messages']
+        gc_index_key = self._script_gc_index_key
+
+        started = time.time()
+        deadline = started + time_budget
+        work_left = work_budget
+
+        metrics = {
+            'queues_collected': 0,
+            'messages_removed': 0,
+            'queues_swept': 0,
+            'claims_removed': 0,
+            'msgsets_migrated': 0,
+        }
+
+        # NOTE: Remove expired messages first, visiting the
+        # queues that are most overdue first.
+        now = timeutils.utcnow_ts()
+
+        while work_left > 0 and time.time() < deadline:
+            msgset_keys = client.zrangebyscore(MSGSET_GC_INDEX_KEY,
+                                               '-inf', now,
+                                               start=0, num=GC_BATCH_SIZE)
+            if not msgset_keys:
+                break
+
+            for msgset_key in msgset_keys:
+                msgset_key = encodeutils.safe_decode(msgset_key)
+                queue, project = utils.descope_message_ids_set(msgset_key)
+                tag = self.driver.key_tag(queue, project)
+
+                keys = [msgset_key,
+                        tag + utils.active_key(queue, project),
+                        tag + utils.claimed_key(queue, project),
+                        tag + utils.expires_key(queue, project)]
+
+                metrics['queues_collected'] += 1
+
+                while True:
+                    batch_size = min(GC_BATCH_SIZE, work_left)
+                    args = [now, batch_size, tag, gc_index_key]
+                    num_removed, num_examined = func(keys=keys, args=args)
+
+                    metrics['messages_removed'] += num_removed
+                    work_left -= num_examined
+
+                    if (num_examined < batch_size or work_left <= 0 or
+                            time.time() >= deadline):
+                        break
+
+                if not gc_index_key:
+                    self._reschedule_gc(msgset_key, keys[3])
+
+                if work_left <= 0 or time.time() >= deadline:
+                    break
+
+        # NOTE: Use any remaining budget to sweep the next slice
+        # of queues. The cursor is persisted, so that successive runs
+        # eventually visit every queue, no matter how small the budget.
+        cursor = int(client.get(GC_CURSOR_KEY) or 0)
+
+        while work_left > 0 and time.time() < deadline:
+            cursor, msgset_keys = client.zscan(MSGSET_INDEX_KEY, cursor,
+                                               count=GC_BATCH_SIZE)
+
+            for msgset_key, version in msgset_keys:
+                msgset_key = encodeutils.safe_decode(msgset_key)
+                queue, project = utils.descope_message_ids_set(msgset_key)
+
+                metrics['claims_removed'] += self._claim_ctrl._gc(queue,
+                                                                  project)
+
+                # NOTE: Take the opportunity to migrate any
+                # legacy msgsets that have not been used since the
+                # driver was upgraded.
+                if version < MSGSET_FORMAT_VERSION:
+                    self._migrate_msgset(queue, project)
+                    self._mark_migrated(msgset_key)
+                    metrics['msgsets_migrated'] += 1
+
+                metrics['queues_swept'] += 1
+                work_left -= 1
+
+            client.set(GC_CURSOR_KEY, cursor)
+
+            # NOTE: Stop after completing a full pass
+            if cursor == 0:
+                break
+
+        metrics['elapsed'] = time.time() - started
+        metrics['finished_at'] = timeutils.utcnow_ts()
+
+        return metrics
+
+    def _reschedule_gc(self, msgset_key, expires_key):
+        """Schedule the GC of a queue for its next message to expire."""
+
+        head = self._client.zrange(expires_key, 0, 0, withscores=True)
+
+        if head:
+            self._client.zadd(MSGSET_GC_INDEX_KEY, head[0][1], msgset_key)
+        else:
+            self._client.zrem(MSGSET_GC_INDEX_KEY, msgset_key)
+
+    @utils.raises_conn_error
+    @utils.retries_on_connection_error
+    def reconcile(self):
+        """Rebuild the derived message ID sets of every queue.
+
+        The claimed, free and total counts reported by the queue
+        stats are derived from the cardinality of these sets, so
+        this repairs any drift between them and the messages that
+        are actually stored, e.g., after a failover to a replica
+        that missed some writes.
+
+        :returns: Number of stray IDs removed from the sets
+        """
+        client = self._client
 
         num_removed = 0
         offset_msgsets = 0
 
         while True:
-            # NOTE(kgriffs): Iterate across all message sets; there will
-            # be one set of message IDs per queue.
             msgset_keys = client.zrange(MSGSET_INDEX_KEY,
                                         offset_msgsets,
                                         offset_msgsets + GC_BATCH_SIZE - 1)
@@ -301,42 +772,51 @@ class MessageController(storage.Message, scripting.Mixin):
 
             for msgset_key in msgset_keys:
                 msgset_key = encodeutils.safe_decode(msgset_key)
-
-                # NOTE(kgriffs): Drive the claim controller GC from
-                # here, because we already know the queue and project
-                # scope.
                 queue, project = utils.descope_message_ids_set(msgset_key)
-                self._claim_ctrl._gc(queue, project)
 
-                offset_mids = 0
+                # NOTE: Re-sort every message in the msgset into
+                # the set that matches its claim fields.
+                self._migrate_msgset(queue, project)
+                self._mark_migrated(msgset_key)
 
-                while True:
-                    # NOTE(kgriffs): Look up each message in the message set,
-                    # see if it has expired, and if so, remove it from msgset.
-                    mids = client.zrange(msgset_key, offset_mids,
-                                         offset_mids + GC_BATCH_SIZE - 1)
+                tag = self.driver.key_tag(queue, project)
+                for key in (tag + utils.active_key(queue, project),
+                            tag + utils.claimed_key(queue, project),
+                            tag + utils.expires_key(queue, project)):
+                    num_removed += self._prune_id_set(msgset_key, key)
 
-                    if not mids:
-                        break
+        return num_removed
 
-                    offset_mids += len(mids)
+    def _prune_id_set(self, msgset_key, key):
+        """Remove IDs that are no longer in the msgset from a set."""
 
-                    # NOTE(kgriffs): If redis expired the message, it will
-                    # not exist, so all we have to do is remove mid from
-                    # the msgset collection.
-                    with client.pipeline() as pipe:
-                        for mid in mids:
-                            pipe.exists(mid)
+        client = self._client
 
-                        mid_exists_flags = pipe.execute()
+        num_removed = 0
+        offset_mids = 0
 
-                    with client.pipeline() as pipe:
-                        for mid, exists in zip(mids, mid_exists_flags):
-                            if not exists:
-                                pipe.zrem(msgset_key, mid)
-                                num_removed += 1
+        while True:
+            mids = client.zrange(key, offset_mids,
+                                 offset_mids + GC_BATCH_SIZE - 1)
+
+            if not mids:
+                break
 
-                        pipe.execute()
+            with client.pipeline() as pipe:
+                for mid in mids:
+                    pipe.zscore(msgset_key, mid)
+
+                ranks = pipe.execute()
+
+            stray_ids = [mid for mid, rank in zip(mids, ranks)
+                         if rank is None]
+
+            if stray_ids:
+                client.zrem(key, *stray_ids)
+                num_removed += len(stray_ids)
+
+            # NOTE: Removed IDs shift the remaining ones down
+            offset_mids += len(mids) - len(stray_ids)
 
         return num_removed
 
@@ -361,7 +841,9 @@ class MessageController(storage.Message, scripting.Mixin):
         if not message_id:
             raise errors.QueueIsEmpty(queue, project)
 
-        message = Message.from_redis(message_id, self._client)
+        message_key = (self.driver.key_tag(queue, project) +
+                       encodeutils.safe_decode(message_id))
+        message = Message.from_redis(message_key, self._client)
         if message is None:
             raise errors.QueueIsEmpty(queue, project)
 
@@ -374,7 +856,8 @@ class MessageController(storage.Message, scripting.Mixin):
         if not self._queue_ctrl.exists(queue, project):
             raise errors.QueueDoesNotExist(queue, project)
 
-        message = Message.from_redis(message_id, self._client)
+        message_key = self.driver.key_tag(queue, project) + message_id
+        message = Message.from_redis(message_key, self._client)
         now = timeutils.utcnow_ts()
 
         if message and not utils.msg_expired_filter(message, now):
@@ -388,11 +871,13 @@ class MessageController(storage.Message, scripting.Mixin):
         if not self._queue_ctrl.exists(queue, project):
             raise errors.QueueDoesNotExist(queue, project)
 
+        tag = self.driver.key_tag(queue, project)
+
         # NOTE(prashanthr_): Pipelining is used here purely
         # for performance.
         with self._client.pipeline() as pipe:
             for mid in message_ids:
-                    pipe.hgetall(mid)
+                    pipe.hgetall(tag + mid)
 
             messages = pipe.execute()
 
@@ -407,37 +892,24 @@ class MessageController(storage.Message, scripting.Mixin):
         if not self._queue_ctrl.exists(queue, project):
             raise errors.QueueDoesNotExist(queue, project)
 
-        msgset_key = utils.msgset_key(queue, project)
-        counter_key = utils.scope_queue_index(queue, project,
-                                              MESSAGE_RANK_COUNTER_SUFFIX)
-
-        message_ids = []
         now = timeutils.utcnow_ts()
 
-        with self._client.pipeline() as pipe:
-            for msg in messages:
-                prepared_msg = Message(
-                    ttl=msg['ttl'],
-                    created=now,
-                    client_uuid=client_uuid,
-                    claim_id=None,
-                    claim_expires=now,
-                    body=msg.get('body', {}),
-                )
-
-                prepared_msg.to_redis(pipe)
-                message_ids.append(prepared_msg.id)
+        prepared_msgs = [
+            Message(
+                ttl=msg['ttl'],
+                created=now,
+                client_uuid=client_uuid,
+                claim_id=None,
+                claim_expires=now,
+                body=msg.get('body', {}),
+            )
 
-            pipe.execute()
+            for msg in messages
+        ]
 
-        # NOTE(kgriffs): If this call fails, we will return
-        # an error to the client and the messages will be
-        # orphaned, but Redis will remove them when they
-        # expire, so we will just pretend they don't exist
-        # in that case.
-        self._index_messages(msgset_key, counter_key, message_ids)
+        self._post_messages(queue, project, prepared_msgs)
 
-        return message_ids
+        return [msg.id for msg in prepared_msgs]
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
@@ -445,9 +917,12 @@ class MessageController(storage.Message, scripting.Mixin):
         if not self._queue_ctrl.exists(queue, project):
             raise errors.QueueDoesNotExist(queue, project)
 
+        tag = self.driver.key_tag(queue, project)
+        message_key = tag + message_id
+
         # NOTE(kgriffs): The message does not exist, so
         # it is essentially "already" deleted.
-        if not self._exists(message_id):
+        if not self._exists(message_key):
             return
 
         # TODO(kgriffs): Create decorator for validating claim and message
@@ -459,7 +934,7 @@ class MessageController(storage.Message, scripting.Mixin):
             except ValueError:
                 raise errors.ClaimDoesNotExist(queue, project, claim)
 
-        msg_claim = self._get_claim(message_id)
+        msg_claim = self._get_claim(message_key)
         is_claimed = (msg_claim is not None)
 
         # Authorize the request based on having the correct claim ID
@@ -476,11 +951,14 @@ class MessageController(storage.Message, scripting.Mixin):
 
             raise errors.MessageNotClaimedBy(message_id, claim)
 
-        msgset_key = utils.msgset_key(queue, project)
+        msgset_key = tag + utils.msgset_key(queue, project)
 
         with self._client.pipeline() as pipe:
-            pipe.delete(message_id)
+            pipe.delete(message_key)
             pipe.zrem(msgset_key, message_id)
+            pipe.zrem(tag + utils.active_key(queue, project), message_id)
+            pipe.zrem(tag + utils.claimed_key(queue, project), message_id)
+            pipe.zrem(tag + utils.expires_key(queue, project), message_id)
 
             if is_claimed:
                 self._claim_ctrl._del_message(queue, project,
@@ -491,46 +969,35 @@ class MessageController(storage.Message, scripting.Mixin):
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
-    def bulk_delete(self, queue, message_ids, project=None):
+    def bulk_delete(self, queue, message_ids, project=None, claim=None):
         if not self._queue_ctrl.exists(queue, project):
             raise errors.QueueDoesNotExist(queue,
                                            project)
 
-        msgset_key = utils.msgset_key(queue, project)
-
-        with self._client.pipeline() as pipe:
-            for mid in message_ids:
-                if not self._exists(mid):
-                    continue
-
-                pipe.delete(mid)
-                pipe.zrem(msgset_key, mid)
-
-                msg_claim = self._get_claim(mid)
-                if msg_claim is not None:
-                    self._claim_ctrl._del_message(queue, project,
-                                                  msg_claim['id'], mid,
-                                                  pipe)
-            pipe.execute()
+        # NOTE: Existence and claim checks are done server-side
+        # by the script, so that deleting a batch of messages costs a
+        # single round trip regardless of the batch size.
+        return self._delete_messages(queue, project, message_ids,
+                                     claim_id=claim)
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def pop(self, queue, limit, project=None):
-        # Pop is implemented as a chain of the following operations:
-        # 1. Create a claim.
-        # 2. Delete the messages claimed.
-        # 3. Delete the claim.
-
-        claim_id, messages = self._claim_ctrl.create(
-            queue, dict(ttl=1, grace=0), project, limit=limit)
-
-        message_ids = [message['id'] for message in messages]
-        self.bulk_delete(queue, message_ids, project)
-        # NOTE(prashanthr_): Creating a claim controller reference
-        # causes a recursive reference. Hence, using the reference
-        # from the driver.
-        self._claim_ctrl.delete(queue, claim_id, project)
-        return messages
+        # NOTE: Rather than creating a claim, deleting the claimed
+        # messages, and then deleting the claim, the messages at the
+        # head of the queue are read and deleted by a single script.
+        self._ensure_migrated(queue, project)
+        popped = self._delete_messages(queue, project, pop_limit=limit)
+
+        now = timeutils.utcnow_ts()
+        return [Message.from_hmap(_flat_list_to_hmap(msg)).to_basic(now)
+                for msg in popped]
+
+
+def _flat_list_to_hmap(values):
+    """Converts a flat list of names and values to a dict."""
+
+    return dict(zip(values[::2], values[1::2]))
 
 
 def _filter_messages(messages, filters, to_basic, marker):
@@ -16,6 +16,7 @@
 
 import functools
 import uuid
+import zlib
 
 import msgpack
 from oslo_utils import encodeutils
@@ -67,20 +68,20 @@ class MessageEnvelope(object):
 
     @staticmethod
     def from_redis(mid, client):
-        values = client.hmget(mid, MSGENV_FIELD_KEYS)
+        values = client.hmget(mid, _MSGENV_FETCH_KEYS)
 
         # NOTE(kgriffs): If the key does not exist, redis-py returns
         # an array of None values.
-        if values[0] is None:
+        if values[0] is None and values[-1] is None:
             return None
 
-        return _hmap_kv_to_msgenv(MSGENV_FIELD_KEYS, values)
+        return _hmap_kv_to_msgenv(_MSGENV_FETCH_KEYS, values)
 
     @staticmethod
     def from_redis_bulk(message_ids, client):
         with client.pipeline() as pipe:
             for mid in message_ids:
-                pipe.hmget(mid, MSGENV_FIELD_KEYS)
+                pipe.hmget(mid, _MSGENV_FETCH_KEYS)
 
             results = pipe.execute()
 
@@ -89,7 +90,7 @@ class MessageEnvelope(object):
             if value_list is None:
                 env = None
             else:
-                env = _hmap_kv_to_msgenv(MSGENV_FIELD_KEYS, value_list)
+                env = _hmap_kv_to_msgenv(_MSGENV_FETCH_KEYS, value_list)
 
             message_envs.append(env)
 
@@ -184,7 +185,9 @@ class Message(MessageEnvelope):
     @staticmethod
     def from_hmap(hmap):
         kwargs = _hmap_to_msgenv_kwargs(hmap)
-        kwargs['body'] = _unpack(hmap[b'b'])
+
+        if b'p' not in hmap:
+            kwargs['body'] = _unpack(hmap[b'b'])
 
         return Message(**kwargs)
 
@@ -206,14 +209,32 @@ class Message(MessageEnvelope):
 
         return messages
 
-    def to_redis(self, pipe, include_body=True):
-        if not include_body:
-            super(Message, self).to_redis(pipe)
+    def to_hmap(self, compact=False, compression_threshold=0):
+        """Returns the hash fields under which to store the message.
+
+        :param compact: Whether to pack the fields that are never
+            updated once the message is posted, including the body,
+            into a single field. Only the fields that are needed by
+            the Lua scripts are stored separately.
+        :param compression_threshold: Size, in bytes, above which the
+            packed field is compressed, or 0 to never compress it.
+            Ignored unless `compact` is True.
+        """
+
+        if compact:
+            return _msg_to_compact_hmap(self, compression_threshold)
 
         hmap = _msgenv_to_hmap(self)
         hmap['b'] = _pack(self.body)
 
-        pipe.hmset(self.id, hmap)
+        return hmap
+
+    def to_redis(self, pipe, include_body=True, compact=False,
+                 compression_threshold=0):
+        if not include_body:
+            super(Message, self).to_redis(pipe)
+
+        pipe.hmset(self.id, self.to_hmap(compact, compression_threshold))
         pipe.expire(self.id, self.ttl)
 
     def to_basic(self, now, include_created=False):
@@ -240,10 +261,20 @@ class Message(MessageEnvelope):
 _pack = msgpack.Packer(encoding='utf-8', use_bin_type=True).pack
 _unpack = functools.partial(msgpack.unpackb, encoding='utf-8')
 
+# NOTE: The packed field of compact messages starts with one of these
+# markers, so that compressed and uncompressed messages can be mixed.
+_PACKED_PLAIN = b'\x00'
+_PACKED_ZLIB = b'\x01'
+
+# NOTE: Fetch the fields of both layouts, so that envelopes can be
+# read regardless of how each message was encoded.
+_MSGENV_FETCH_KEYS = MSGENV_FIELD_KEYS + (b'p',)
+
 
 def _hmap_kv_to_msgenv(keys, values):
-    hmap = dict(zip(keys, values))
+    hmap = dict((k, v) for k, v in zip(keys, values) if v is not None)
     kwargs = _hmap_to_msgenv_kwargs(hmap)
+    kwargs.pop('body', None)
     return MessageEnvelope(**kwargs)
 
 
@@ -254,6 +285,9 @@ def _hmap_to_msgenv_kwargs(hmap):
     else:
         claim_id = None
 
+    if b'p' in hmap:
+        return _compact_hmap_to_msg_kwargs(hmap, claim_id)
+
     # NOTE(kgriffs): Under Py3K, redis-py converts all strings
     # into binary. Woohoo!
     return {
@@ -269,6 +303,47 @@ def _hmap_to_msgenv_kwargs(hmap):
     }
 
 
+def _compact_hmap_to_msg_kwargs(hmap, claim_id):
+    packed = hmap[b'p']
+    marker, packed = packed[:1], packed[1:]
+
+    if marker == _PACKED_ZLIB:
+        packed = zlib.decompress(packed)
+
+    msg_id, created, client_uuid, body = _unpack(packed)
+
+    return {
+        'id': msg_id,
+        'ttl': int(hmap[b't']),
+        'created': created,
+        'expires': int(hmap[b'e']),
+
+        'client_uuid': client_uuid,
+
+        'claim_id': claim_id,
+        'claim_expires': int(hmap[b'c.e']),
+
+        'body': body,
+    }
+
+
+def _msg_to_compact_hmap(msg, compression_threshold):
+    packed = _pack([msg.id, msg.created, msg.client_uuid, msg.body])
+
+    if compression_threshold and len(packed) > compression_threshold:
+        packed = _PACKED_ZLIB + zlib.compress(packed)
+    else:
+        packed = _PACKED_PLAIN + packed
+
+    return {
+        'p': packed,
+        't': msg.ttl,
+        'e': msg.expires,
+        'c': msg.claim_id or '',
+        'c.e': msg.claim_expires,
+    }
+
+
 def _msgenv_to_hmap(msg):
     return {
         'id': msg.id,
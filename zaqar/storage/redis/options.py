@@ -23,7 +23,7 @@ _COMMON_REDIS_OPTIONS = (
                deprecated_opts=[cfg.DeprecatedOpt(
                                 'uri',
                                 group=_deprecated_group), ],
-               help=('Redis connection URI, taking one of three forms. '
+               help=('Redis connection URI, taking one of four forms. '
                      'For a direct connection to a Redis server, use '
                      'the form "redis://host[:port][?options]", where '
                      'port defaults to 6379 if not specified. For an '
@@ -34,9 +34,14 @@ _COMMON_REDIS_OPTIONS = (
                      'instance of redis-sentinel. In this form, the '
                      'name of the Redis master used in the Sentinel '
                      'configuration must be included in the query '
-                     'string as "master=<name>". Finally, to connect '
-                     'to a local instance of Redis over a unix socket, '
-                     'you may use the form '
+                     'string as "master=<name>". For a Redis Cluster, '
+                     'use the same form as for Sentinel, with "cluster='
+                     'true" in the query string, where each host '
+                     'specified corresponds to a cluster node used to '
+                     'discover the rest of the cluster. This form '
+                     'requires the redis-py-cluster library. Finally, '
+                     'to connect to a local instance of Redis over a '
+                     'unix socket, you may use the form '
                      '"redis:/path/to/redis.sock[?options]". In all '
                      'forms, the "socket_timeout" option may be '
                      'specified in the query string. Its value is '
@@ -55,12 +60,48 @@ _COMMON_REDIS_OPTIONS = (
                                   'reconnect_sleep',
                                   group=_deprecated_group), ],
                  help=('Base sleep interval between attempts to reconnect '
-                       'after a redis node failover. '))
+                       'after a redis node failover. ')),
+
+    cfg.BoolOpt('cache_queue_lookups', default=False,
+                help=('Cache the result of checking whether a queue '
+                      'exists, so that most message operations do not '
+                      'need an extra round trip to Redis to do so. '
+                      'Since the cache is local to each process, a '
+                      'deleted queue may appear to exist to other '
+                      'processes for a few seconds.')),
 
 )
 
 MANAGEMENT_REDIS_OPTIONS = _COMMON_REDIS_OPTIONS
-MESSAGE_REDIS_OPTIONS = _COMMON_REDIS_OPTIONS
+MESSAGE_REDIS_OPTIONS = _COMMON_REDIS_OPTIONS + (
+    cfg.FloatOpt('gc_time_budget', default=1.0,
+                 help=('Maximum time, in seconds, that a single garbage '
+                       'collection run may spend before yielding. Runs '
+                       'resume from where the previous one left off.')),
+
+    cfg.IntOpt('gc_work_budget', default=10000,
+               help=('Maximum number of expired message IDs and queues '
+                     'that a single garbage collection run may '
+                     'examine.')),
+
+    cfg.StrOpt('message_encoding', default='hash',
+               choices=['hash', 'compact'],
+               help=('How new messages are stored. "hash" stores each '
+                     'message field, including the body, as a separate '
+                     'hash field. "compact" packs the message ID, '
+                     'creation time, client UUID and body into a single '
+                     'msgpack field, keeping only the TTL, expiration '
+                     'and claim fields separate, which reduces memory '
+                     'usage for small messages. Messages stored with '
+                     'either encoding can always be read, so this '
+                     'option may be changed at any time.')),
+
+    cfg.IntOpt('compression_threshold', default=0,
+               help=('Size, in bytes, above which the packed field of '
+                     'compact messages is compressed with zlib, or 0 '
+                     'to disable compression. Only applies when '
+                     'message_encoding is "compact".')),
+)
 
 MANAGEMENT_REDIS_GROUP = 'drivers:management_store:redis'
 MESSAGE_REDIS_GROUP = 'drivers:message_store:redis'
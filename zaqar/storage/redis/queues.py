@@ -29,6 +29,28 @@ LOG = logging.getLogger(__name__)
 QUEUES_SET_STORE_NAME = 'queues_set'
 MESSAGE_IDS_SUFFIX = 'messages'
 
+# NOTE: E.g.: 'redis.queuecontroller:exists:5083853/my-queue'
+_QUEUE_CACHE_PREFIX = 'redis.queuecontroller:'
+
+# NOTE: As with the MongoDB driver, a queue that was deleted
+# may still be reported as existing for up to this many seconds
+# by other processes, in which case messages posted to it will be
+# orphaned until they expire.
+_QUEUE_CACHE_TTL = 5
+
+# NOTE: Queues that don't exist are only cached very briefly,
+# since creating a queue only purges the cached lookup in the
+# process that created it.
+_QUEUE_CACHE_NEGATIVE_TTL = 1
+
+
+def _queue_exists_key(queue, project=None):
+    return _QUEUE_CACHE_PREFIX + 'exists:' + str(project) + '/' + queue
+
+
+def _queue_exists_ttl(exists):
+    return _QUEUE_CACHE_TTL if exists else _QUEUE_CACHE_NEGATIVE_TTL
+
 
 class QueueController(storage.Queue):
     """Implements queue resource operations using Redis.
@@ -66,6 +88,14 @@ class QueueController(storage.Queue):
     def __init__(self, *args, **kwargs):
         super(QueueController, self).__init__(*args, **kwargs)
         self._client = self.driver.connection
+
+        # NOTE: Queue lookups are only cached when enabled, since
+        # the cache is local to each process.
+        if self.driver.redis_conf.cache_queue_lookups:
+            self._cache = self.driver.cache
+        else:
+            self._cache = None
+
         self._packer = msgpack.Packer(encoding='utf-8',
                                       use_bin_type=True).pack
         self._unpacker = functools.partial(msgpack.unpackb, encoding='utf-8')
@@ -119,7 +149,9 @@ class QueueController(storage.Queue):
         queue_key = utils.scope_queue_name(name, project)
         qset_key = utils.scope_queue_name(QUEUES_SET_STORE_NAME, project)
 
-        # Check if the queue already exists.
+        # Check if the queue already exists, bypassing any cached
+        # result of a previous lookup.
+        self._purge_exists(name, project)
         if self._exists(name, project):
             return False
 
@@ -138,13 +170,15 @@ class QueueController(storage.Queue):
                 pipe.execute()
             except redis.exceptions.ResponseError:
                 return False
+            finally:
+                self._purge_exists(name, project)
 
         return True
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
+    @decorators.caches(_queue_exists_key, _queue_exists_ttl)
     def _exists(self, name, project=None):
-        # TODO(prashanthr_): Cache this lookup
         queue_key = utils.scope_queue_name(name, project)
         qset_key = utils.scope_queue_name(QUEUES_SET_STORE_NAME, project)
 
@@ -172,8 +206,13 @@ class QueueController(storage.Queue):
 
         return self._unpacker(metadata)
 
+    def _purge_exists(self, name, project=None):
+        if self._cache is not None:
+            del self._cache[_queue_exists_key(name, project)]
+
     @utils.raises_conn_error
     @utils.retries_on_connection_error
+    @_exists.purges
     def _delete(self, name, project=None):
         queue_key = utils.scope_queue_name(name, project)
         qset_key = utils.scope_queue_name(QUEUES_SET_STORE_NAME, project)
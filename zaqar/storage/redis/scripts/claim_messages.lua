@@ -19,6 +19,8 @@ limitations under the License.
 
 -- Read params
 local msgset_key = KEYS[1]
+local active_key = KEYS[2]
+local claimed_key = KEYS[3]
 
 local now = tonumber(ARGV[1])
 local limit = tonumber(ARGV[2])
@@ -26,61 +28,64 @@ local claim_id = ARGV[3]
 local claim_expires = tonumber(ARGV[4])
 local msg_ttl = tonumber(ARGV[5])
 local msg_expires = tonumber(ARGV[6])
+local key_tag = ARGV[7]
 
--- Scan for up to 'limit' unclaimed messages
-local BATCH_SIZE = 100
+-- Return messages whose claims have expired to the active set,
+-- restoring their original rank so that FIFO order is preserved.
+local expired_ids = redis.call('ZRANGEBYSCORE', claimed_key, '-inf', now)
 
-local start = 0
-local claimed_msgs = {}
+for i, mid in ipairs(expired_ids) do
+    local rank = redis.call('ZSCORE', msgset_key, mid)
+
+    -- NOTE: The message may have been deleted or GC'd
+    -- since it was claimed, in which case it is simply dropped.
+    if rank then
+        redis.call('ZADD', active_key, rank, mid)
+    end
+end
 
-local found_unclaimed = false
+if #expired_ids > 0 then
+    redis.call('ZREMRANGEBYSCORE', claimed_key, '-inf', now)
+end
+
+-- Claim up to 'limit' messages from the head of the active set. Since
+-- claimed messages are moved out of this set, there is no need to
+-- scan past them, so the cost is proportional to 'limit' rather than
+-- to the number of in-flight messages in the queue.
+local claimed_msgs = {}
 
 while (#claimed_msgs < limit) do
-    local stop = (start + BATCH_SIZE - 1)
-    local msg_ids = redis.call('ZRANGE', msgset_key, start, stop)
+    local stop = limit - #claimed_msgs - 1
+    local msg_ids = redis.call('ZRANGE', active_key, 0, stop)
 
     if (#msg_ids == 0) then
         break
     end
 
-    start = start + BATCH_SIZE
-
-    -- TODO(kgriffs): Try moving claimed IDs to a different set
-    -- to avoid scanning through already-claimed messages.
     for i, mid in ipairs(msg_ids) do
-        -- NOTE(kgriffs): Since execution of this script can not
-        -- happen in parallel, once we find the first unclaimed
-        -- message, the remaining messages will always be
-        -- unclaimed as well.
+        local msg_key = key_tag .. mid
+        redis.call('ZREM', active_key, mid)
 
-        if not found_unclaimed then
-            local msg = redis.call('HMGET', mid, 'c', 'c.e')
+        -- NOTE: If redis already expired the message, skip
+        -- it; the GC will remove the ID from the msgset.
+        local msg_expires_prev = redis.call('HGET', msg_key, 'e')
 
-            if msg[1] == '' or tonumber(msg[2]) <= now then
-                found_unclaimed = true
-            end
-        end
-
-        if found_unclaimed then
-            local msg_expires_prev = redis.call('HGET', mid, 'e')
-
-            -- Found an unclaimed message, so claim it
-            redis.call('HMSET', mid,
+        if msg_expires_prev then
+            redis.call('HMSET', msg_key,
                        'c', claim_id,
                        'c.e', claim_expires)
 
             -- Will the message expire early?
             if tonumber(msg_expires_prev) < claim_expires then
-                redis.call('HMSET', mid,
+                redis.call('HMSET', msg_key,
                            't', msg_ttl,
                            'e', msg_expires)
+
+                redis.call('EXPIRE', msg_key, msg_ttl)
             end
 
+            redis.call('ZADD', claimed_key, claim_expires, mid)
             claimed_msgs[#claimed_msgs + 1] = mid
-
-            if (#claimed_msgs == limit) then
-                break
-            end
         end
     end
 end
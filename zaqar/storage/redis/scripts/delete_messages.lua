@@ -0,0 +1,116 @@
+--[[
+
+Copyright (c) 2014 Rackspace Hosting, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local msgset_key = KEYS[1]
+local active_key = KEYS[2]
+local claimed_key = KEYS[3]
+local expires_key = KEYS[4]
+
+local now = tonumber(ARGV[1])
+local key_tag = ARGV[2]
+local claim_msgs_prefix = ARGV[3]
+local claim_id = ARGV[4]
+local pop_limit = tonumber(ARGV[5])
+
+-- NOTE: When popping, the messages to delete are taken from the
+-- head of the active set. Otherwise, the keys of the messages to
+-- delete, i.e., their IDs prefixed with the key tag, are given as
+-- the remaining keys.
+local msg_ids = {}
+
+if pop_limit > 0 then
+    -- Return messages whose claims have expired to the active set
+    local expired_ids = redis.call('ZRANGEBYSCORE', claimed_key,
+                                   '-inf', now)
+
+    for i, mid in ipairs(expired_ids) do
+        local rank = redis.call('ZSCORE', msgset_key, mid)
+        if rank then
+            redis.call('ZADD', active_key, rank, mid)
+        end
+    end
+
+    if #expired_ids > 0 then
+        redis.call('ZREMRANGEBYSCORE', claimed_key, '-inf', now)
+    end
+
+    msg_ids = redis.call('ZRANGE', active_key, 0, pop_limit - 1)
+else
+    for i = 5, #KEYS do
+        msg_ids[#msg_ids + 1] = string.sub(KEYS[i], #key_tag + 1)
+    end
+end
+
+-- When popping, the deleted messages are returned. Otherwise, the
+-- IDs of any messages that could not be deleted because they are
+-- not claimed by the given claim are returned.
+local results = {}
+
+for i, mid in ipairs(msg_ids) do
+    local msg_key = key_tag .. mid
+    local msg
+    local msg_claim_id
+    local msg_claim_expires
+
+    if pop_limit > 0 then
+        msg = redis.call('HGETALL', msg_key)
+
+        for j = 1, #msg, 2 do
+            if msg[j] == 'c' then
+                msg_claim_id = msg[j + 1]
+            elseif msg[j] == 'c.e' then
+                msg_claim_expires = msg[j + 1]
+            end
+        end
+    else
+        msg = redis.call('HMGET', msg_key, 'c', 'c.e')
+        msg_claim_id = msg[1]
+        msg_claim_expires = msg[2]
+    end
+
+    -- NOTE: A missing message is essentially "already" deleted
+    local exists = msg_claim_expires and true or false
+
+    local is_claimed = exists and msg_claim_id ~= '' and
+                       tonumber(msg_claim_expires) > now
+
+    if exists and claim_id ~= '' and
+            not (is_claimed and msg_claim_id == claim_id) then
+        results[#results + 1] = mid
+    else
+        if is_claimed then
+            -- Remove the message from the claim's records
+            redis.call('LREM', claim_msgs_prefix .. msg_claim_id, 1, mid)
+            redis.call('HINCRBY', key_tag .. msg_claim_id, 'n', -1)
+        end
+
+        redis.call('DEL', msg_key)
+        redis.call('ZREM', msgset_key, mid)
+        redis.call('ZREM', active_key, mid)
+        redis.call('ZREM', claimed_key, mid)
+        redis.call('ZREM', expires_key, mid)
+
+        if exists and pop_limit > 0 then
+            results[#results + 1] = msg
+        end
+    end
+end
+
+return results
@@ -0,0 +1,69 @@
+--[[
+
+Copyright (c) 2014 Rackspace Hosting, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local msgset_key = KEYS[1]
+local active_key = KEYS[2]
+local claimed_key = KEYS[3]
+local expires_key = KEYS[4]
+
+local now = tonumber(ARGV[1])
+local batch_size = tonumber(ARGV[2])
+local key_tag = ARGV[3]
+local gc_index_key = ARGV[4]
+
+-- Remove the IDs of up to 'batch_size' expired messages from the
+-- queue's message ID sets. Since the IDs are indexed by expiration
+-- time, only messages that are actually due are examined.
+local msg_ids = redis.call('ZRANGEBYSCORE', expires_key, '-inf', now,
+                           'LIMIT', 0, batch_size)
+
+local num_removed = 0
+
+for i, mid in ipairs(msg_ids) do
+    local msg_key = key_tag .. mid
+    local expires = redis.call('HGET', msg_key, 'e')
+
+    if expires and tonumber(expires) > now then
+        -- NOTE: The message's lifetime was extended by a claim
+        -- after it was indexed, so just reschedule it.
+        redis.call('ZADD', expires_key, expires, mid)
+    else
+        redis.call('DEL', msg_key)
+        redis.call('ZREM', msgset_key, mid)
+        redis.call('ZREM', active_key, mid)
+        redis.call('ZREM', claimed_key, mid)
+        redis.call('ZREM', expires_key, mid)
+
+        num_removed = num_removed + 1
+    end
+end
+
+-- Reschedule the queue according to the next message to expire
+if gc_index_key ~= '' then
+    local next_msg = redis.call('ZRANGE', expires_key, 0, 0, 'WITHSCORES')
+
+    if #next_msg == 0 then
+        redis.call('ZREM', gc_index_key, msgset_key)
+    else
+        redis.call('ZADD', gc_index_key, next_msg[2], msgset_key)
+    end
+end
+
+return {num_removed, #msg_ids}
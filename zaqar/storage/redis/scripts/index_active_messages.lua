@@ -0,0 +1,88 @@
+--[[
+
+Copyright (c) 2014 Rackspace Hosting, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local msgset_key = KEYS[1]
+local active_key = KEYS[2]
+local claimed_key = KEYS[3]
+local expires_key = KEYS[4]
+
+local now = tonumber(ARGV[1])
+local min_rank = ARGV[2]
+local batch_size = tonumber(ARGV[3])
+local key_tag = ARGV[4]
+local gc_index_key = ARGV[5]
+
+-- Sort the next batch of messages in the msgset into the active and
+-- claimed sets, according to the claim fields stored in each message,
+-- and index them by expiration time.
+-- Ranks are used as the cursor rather than offsets, so that messages
+-- removed concurrently do not cause any to be skipped.
+local msg_ids = redis.call('ZRANGEBYSCORE', msgset_key,
+                           '(' .. min_rank, '+inf',
+                           'WITHSCORES', 'LIMIT', 0, batch_size)
+
+if (#msg_ids == 0) then
+    return false
+end
+
+local rank
+local min_expires
+
+for i = 1, #msg_ids, 2 do
+    local mid = msg_ids[i]
+    rank = msg_ids[i + 1]
+
+    local msg = redis.call('HMGET', key_tag .. mid, 'c', 'c.e', 'e')
+    local expires
+
+    if msg[2] then
+        if msg[1] ~= '' and tonumber(msg[2]) > now then
+            redis.call('ZREM', active_key, mid)
+            redis.call('ZADD', claimed_key, msg[2], mid)
+        else
+            redis.call('ZREM', claimed_key, mid)
+            redis.call('ZADD', active_key, rank, mid)
+        end
+
+        expires = tonumber(msg[3])
+    else
+        -- NOTE: The message has already expired; schedule it
+        -- for the GC to remove from the msgset right away.
+        redis.call('ZREM', active_key, mid)
+        redis.call('ZREM', claimed_key, mid)
+        expires = now
+    end
+
+    redis.call('ZADD', expires_key, expires, mid)
+
+    if not min_expires or expires < min_expires then
+        min_expires = expires
+    end
+end
+
+if min_expires and gc_index_key ~= '' then
+    local gc_after = redis.call('ZSCORE', gc_index_key, msgset_key)
+    if not gc_after or min_expires < tonumber(gc_after) then
+        redis.call('ZADD', gc_index_key, min_expires, msgset_key)
+    end
+end
+
+-- Return the cursor for the next batch
+return rank
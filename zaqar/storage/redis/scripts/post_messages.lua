@@ -0,0 +1,99 @@
+--[[
+
+Copyright (c) 2014 Rackspace Hosting, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local msgset_key = KEYS[1]
+local counter_key = KEYS[2]
+local active_key = KEYS[3]
+local expires_key = KEYS[4]
+
+-- NOTE: The GC index is given as an argument rather than as a key,
+-- since it is not stored in the queue's slot in cluster mode, in
+-- which case it is empty and the caller schedules the GC instead.
+local key_tag = ARGV[1]
+local gc_index_key = ARGV[2]
+local signal_channel = ARGV[3]
+
+-- NOTE: The remaining keys are the keys of the messages to post,
+-- which are the message IDs prefixed with the key tag. For each
+-- message, ARGV contains its TTL and expiration time, followed by the
+-- number of hash field names and values to set, followed by the
+-- names and values themselves.
+local num_messages = #KEYS - 4
+
+-- Get next rank value
+local rank_counter = tonumber(redis.call('GET', counter_key) or 1)
+
+local zadd_args = {'ZADD', msgset_key}
+local zadd_expires_args = {'ZADD', expires_key}
+local min_expires
+local argi = 4
+
+for i = 1, num_messages do
+    local msg_key = KEYS[4 + i]
+    local mid = string.sub(msg_key, #key_tag + 1)
+    local ttl = ARGV[argi]
+    local expires = tonumber(ARGV[argi + 1])
+    local num_fields = tonumber(ARGV[argi + 2])
+
+    local hmset_args = {'HMSET', msg_key}
+    for j = (argi + 3), (argi + 2 + num_fields) do
+        hmset_args[#hmset_args+1] = ARGV[j]
+    end
+
+    redis.call(unpack(hmset_args))
+    redis.call('EXPIRE', msg_key, ttl)
+
+    argi = argi + 3 + num_fields
+
+    zadd_args[#zadd_args+1] = rank_counter + i - 1
+    zadd_args[#zadd_args+1] = mid
+
+    zadd_expires_args[#zadd_expires_args+1] = expires
+    zadd_expires_args[#zadd_expires_args+1] = mid
+
+    if not min_expires or expires < min_expires then
+        min_expires = expires
+    end
+end
+
+-- Add ranked message IDs to both the msgset and the set of
+-- active (unclaimed) messages.
+redis.call(unpack(zadd_args))
+
+zadd_args[2] = active_key
+redis.call(unpack(zadd_args))
+
+-- Index the messages by expiration time, and make sure the queue
+-- is scheduled for garbage collection no later than the earliest
+-- of them expires.
+redis.call(unpack(zadd_expires_args))
+
+if gc_index_key ~= '' then
+    local gc_after = redis.call('ZSCORE', gc_index_key, msgset_key)
+    if not gc_after or min_expires < tonumber(gc_after) then
+        redis.call('ZADD', gc_index_key, min_expires, msgset_key)
+    end
+end
+
+-- Wake any consumers that are waiting for messages to claim
+redis.call('PUBLISH', signal_channel, num_messages)
+
+-- Set next rank value
+return redis.call('SET', counter_key, rank_counter + num_messages)
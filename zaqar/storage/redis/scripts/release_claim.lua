@@ -0,0 +1,76 @@
+--[[
+
+Copyright (c) 2014 Rackspace Hosting, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local claims_set_key = KEYS[1]
+local claim_key = KEYS[2]
+local claim_msgs_key = KEYS[3]
+local msgset_key = KEYS[4]
+local active_key = KEYS[5]
+local claimed_key = KEYS[6]
+
+local claim_id = ARGV[1]
+local now = tonumber(ARGV[2])
+local key_tag = ARGV[3]
+local signal_channel = ARGV[4]
+
+-- Make sure the claim exists and has not expired
+local claim_expires = redis.call('ZSCORE', claims_set_key, claim_id)
+if not claim_expires then
+    return 0
+end
+
+redis.call('ZREM', claims_set_key, claim_id)
+
+if tonumber(claim_expires) <= now then
+    -- NOTE: The messages will be returned to the active set the
+    -- next time messages are claimed from the queue.
+    return 0
+end
+
+-- Release each message, returning it to its original position in
+-- the active set.
+local msg_ids = redis.call('LRANGE', claim_msgs_key, 0, -1)
+
+for i, mid in ipairs(msg_ids) do
+    local msg_key = key_tag .. mid
+
+    -- NOTE: Skip messages that have already expired
+    if redis.call('EXISTS', msg_key) == 1 then
+        redis.call('HMSET', msg_key,
+                   'c', '',
+                   'c.e', now)
+
+        redis.call('ZREM', claimed_key, mid)
+
+        local rank = redis.call('ZSCORE', msgset_key, mid)
+        if rank then
+            redis.call('ZADD', active_key, rank, mid)
+        end
+    end
+end
+
+redis.call('DEL', claim_key, claim_msgs_key)
+
+-- Wake any consumers that are waiting for messages to claim
+if #msg_ids > 0 then
+    redis.call('PUBLISH', signal_channel, #msg_ids)
+end
+
+return 1
@@ -18,22 +18,14 @@ limitations under the License.
 --]]
 
 -- Read params
-local msgset_key = KEYS[1]
-local counter_key = KEYS[2]
+local lock_key = KEYS[1]
 
-local num_message_ids = tonumber(ARGV[1])
+local token = ARGV[1]
 
--- Get next rank value
-local rank_counter = tonumber(redis.call('GET', counter_key) or 1)
-
--- Add ranked message IDs
-local zadd_args = {'ZADD', msgset_key}
-for i = 0, (num_message_ids - 1) do
-    zadd_args[#zadd_args+1] = rank_counter + i
-    zadd_args[#zadd_args+1] = ARGV[2 + i]
+-- NOTE: Only release the lock if it is still held by the caller, since
+-- it may have expired and been taken by another process in the meantime.
+if redis.call('GET', lock_key) == token then
+    return redis.call('DEL', lock_key)
 end
 
-redis.call(unpack(zadd_args))
-
--- Set next rank value
-return redis.call('SET', counter_key, rank_counter + num_message_ids)
+return 0
@@ -0,0 +1,82 @@
+--[[
+
+Copyright (c) 2014 Rackspace Hosting, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local claims_set_key = KEYS[1]
+local claim_key = KEYS[2]
+local claim_msgs_key = KEYS[3]
+local claimed_key = KEYS[4]
+
+local claim_id = ARGV[1]
+local now = tonumber(ARGV[2])
+local claim_ttl = tonumber(ARGV[3])
+local claim_expires = tonumber(ARGV[4])
+local msg_ttl = tonumber(ARGV[5])
+local msg_expires = tonumber(ARGV[6])
+local key_tag = ARGV[7]
+
+-- Make sure the claim exists and has not expired
+local prev_claim_expires = redis.call('ZSCORE', claims_set_key, claim_id)
+if not prev_claim_expires then
+    return 0
+end
+
+if tonumber(prev_claim_expires) <= now then
+    -- NOTE: Redis will expire the other claim records on its own,
+    -- but the entry in the claims set has to be removed manually.
+    redis.call('ZREM', claims_set_key, claim_id)
+    return 0
+end
+
+-- Update only the claim fields of each message, extending the
+-- message's lifetime if it would otherwise expire before the claim.
+local msg_ids = redis.call('LRANGE', claim_msgs_key, 0, -1)
+
+for i, mid in ipairs(msg_ids) do
+    local msg_key = key_tag .. mid
+    local msg_expires_prev = redis.call('HGET', msg_key, 'e')
+
+    -- NOTE: Skip messages that have already expired
+    if msg_expires_prev then
+        redis.call('HMSET', msg_key,
+                   'c', claim_id,
+                   'c.e', claim_expires)
+
+        if tonumber(msg_expires_prev) <= claim_expires then
+            redis.call('HMSET', msg_key,
+                       't', msg_ttl,
+                       'e', msg_expires)
+
+            redis.call('EXPIRE', msg_key, msg_ttl)
+        end
+
+        redis.call('ZADD', claimed_key, claim_expires, mid)
+    end
+end
+
+-- Update the claim itself
+redis.call('HMSET', claim_key,
+           't', claim_ttl,
+           'e', claim_expires)
+
+redis.call('EXPIRE', claim_key, claim_ttl)
+redis.call('EXPIRE', claim_msgs_key, claim_ttl)
+redis.call('ZADD', claims_set_key, claim_expires, claim_id)
+
+return 1
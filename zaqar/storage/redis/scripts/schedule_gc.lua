@@ -0,0 +1,31 @@
+--[[
+
+Copyright (c) 2014 Rackspace Hosting, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local gc_index_key = KEYS[1]
+
+local msgset_key = ARGV[1]
+local expires = tonumber(ARGV[2])
+
+-- Make sure the queue is scheduled for garbage collection no later
+-- than the given time, without postponing an earlier run.
+local gc_after = redis.call('ZSCORE', gc_index_key, msgset_key)
+if not gc_after or expires < tonumber(gc_after) then
+    redis.call('ZADD', gc_index_key, expires, msgset_key)
+end
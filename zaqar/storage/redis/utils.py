@@ -28,6 +28,10 @@ from zaqar.storage import errors
 
 LOG = logging.getLogger(__name__)
 MESSAGE_IDS_SUFFIX = 'messages'
+ACTIVE_IDS_SUFFIX = 'active'
+CLAIMED_IDS_SUFFIX = 'claimed'
+EXPIRES_IDS_SUFFIX = 'expires'
+SIGNAL_CHANNEL_SUFFIX = 'signal'
 SUBSCRIPTION_IDS_SUFFIX = 'subscriptions'
 
 
@@ -89,9 +93,14 @@ def scope_message_ids_set(queue=None, project=None, message_suffix=''):
 def descope_message_ids_set(msgset_key):
     """Descope messages set with '.'
 
+    Any hash tag prefixed to the key (see `queue_hash_tag`) is ignored.
+
     :returns: (queue, project)
     """
 
+    if msgset_key.startswith('{'):
+        msgset_key = msgset_key[msgset_key.index('}') + 1:]
+
     tokens = msgset_key.split('.')
 
     return tokens[1] or None, tokens[0] or None
@@ -128,10 +137,38 @@ scope_queue_catalogue = scope_claims_set = scope_message_ids_set
 scope_queue_index = scope_message_ids_set
 
 
+def queue_hash_tag(queue, project=None):
+    """Returns a Redis Cluster hash tag for the given queue.
+
+    Keys that start with the same hash tag are stored in the same
+    cluster slot, so that they can be used together by a Lua script.
+
+    :returns: '{project.queue}'
+    """
+
+    return '{' + scope_queue_name(queue, project) + '}'
+
+
 def msgset_key(queue, project=None):
     return scope_message_ids_set(queue, project, MESSAGE_IDS_SUFFIX)
 
 
+def active_key(queue, project=None):
+    return scope_message_ids_set(queue, project, ACTIVE_IDS_SUFFIX)
+
+
+def claimed_key(queue, project=None):
+    return scope_message_ids_set(queue, project, CLAIMED_IDS_SUFFIX)
+
+
+def expires_key(queue, project=None):
+    return scope_message_ids_set(queue, project, EXPIRES_IDS_SUFFIX)
+
+
+def signal_channel(queue, project=None):
+    return scope_message_ids_set(queue, project, SIGNAL_CHANNEL_SUFFIX)
+
+
 def subset_key(queue, project=None):
     return scope_subscription_ids_set(queue, project, SUBSCRIPTION_IDS_SUFFIX)
 
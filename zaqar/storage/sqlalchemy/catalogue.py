@@ -20,6 +20,14 @@ Serves to construct an association between a project + queue -> pool
 name: string -> Pools.name
 project: string
 queue: string
+The pool that a queue is being migrated to is kept in a separate table:
+
+project: string
+queue: string
+destination: string -> Pools.name
+
+Changes to the catalogue are logged in a separate table, keyed by the
+catalogue version that each change produced.
 """
 
 import sqlalchemy as sa
@@ -29,14 +37,36 @@ from zaqar.storage import errors
 from zaqar.storage.sqlalchemy import tables
 
 
-def _match(project, queue):
+def _match(project, queue, table=tables.Catalogue):
     clauses = [
-        tables.Catalogue.c.project == project,
-        tables.Catalogue.c.queue == queue
+        table.c.project == project,
+        table.c.queue == queue
     ]
     return sa.sql.and_(*clauses)
 
 
+def _select(*clauses):
+    catalogue = tables.Catalogue
+    migrations = tables.CatalogueMigrations
+
+    # NOTE: Projects may be NULL, which never compares equal.
+    same_project = sa.sql.or_(
+        catalogue.c.project == migrations.c.project,
+        sa.sql.and_(catalogue.c.project.is_(None),
+                    migrations.c.project.is_(None))
+    )
+
+    join = catalogue.outerjoin(migrations, sa.sql.and_(
+        same_project, catalogue.c.queue == migrations.c.queue))
+
+    return sa.sql.select([
+        catalogue.c.pool,
+        catalogue.c.project,
+        catalogue.c.queue,
+        migrations.c.destination,
+    ]).select_from(join).where(sa.sql.and_(*clauses))
+
+
 class CatalogueController(base.CatalogueBase):
 
     def __init__(self, *args, **kwargs):
@@ -44,17 +74,24 @@ class CatalogueController(base.CatalogueBase):
 
         self._conn = self.driver.connection
 
-    def list(self, project):
-        stmt = sa.sql.select([tables.Catalogue]).where(
-            tables.Catalogue.c.project == project
-        )
+    def list(self, project, marker=None, limit=None):
+        clauses = [tables.Catalogue.c.project == project]
+        if marker is not None:
+            clauses.append(tables.Catalogue.c.queue > marker)
+
+        stmt = _select(*clauses)
+
+        if marker is not None or limit is not None:
+            stmt = stmt.order_by(tables.Catalogue.c.queue)
+
+        if limit is not None:
+            stmt = stmt.limit(limit)
+
         cursor = self._conn.execute(stmt)
         return (_normalize(v) for v in cursor)
 
     def get(self, project, queue):
-        stmt = sa.sql.select([tables.Catalogue]).where(
-            _match(project, queue)
-        )
+        stmt = _select(_match(project, queue))
         entry = self._conn.execute(stmt).fetchone()
 
         if entry is None:
@@ -78,11 +115,16 @@ class CatalogueController(base.CatalogueBase):
         except sa.exc.IntegrityError:
             self.update(project, queue, pool)
 
+        else:
+            self._record_change(project, queue)
+
     def delete(self, project, queue):
         stmt = sa.sql.delete(tables.Catalogue).where(
             _match(project, queue)
         )
         self._conn.execute(stmt)
+        self._clear_destination(project, queue)
+        self._record_change(project, queue)
 
     def update(self, project, queue, pool=None):
         if pool is None:
@@ -95,16 +137,79 @@ class CatalogueController(base.CatalogueBase):
             _match(project, queue)
         ).values(pool=pool)
         self._conn.execute(stmt)
+        self._clear_destination(project, queue)
+        self._record_change(project, queue)
+
+    def set_destination(self, project, queue, destination):
+        if not self.exists(project, queue):
+            raise errors.QueueNotMapped(queue, project)
+
+        # NOTE: The unique constraint does not cover NULL projects, so
+        # replace any existing destination rather than relying on it.
+        self._clear_destination(project, queue)
+
+        if destination is not None:
+            stmt = sa.sql.insert(tables.CatalogueMigrations).values(
+                project=project, queue=queue, destination=destination
+            )
+            self._conn.execute(stmt)
+
+        self._record_change(project, queue)
+
+    def _clear_destination(self, project, queue):
+        stmt = sa.sql.delete(tables.CatalogueMigrations).where(
+            _match(project, queue, tables.CatalogueMigrations)
+        )
+        self._conn.execute(stmt)
+
+    def _record_change(self, project, queue):
+        stmt = sa.sql.insert(tables.CatalogueChanges).values(
+            project=project, queue=queue
+        )
+        version = self._conn.execute(stmt).inserted_primary_key[0]
+
+        stmt = sa.sql.delete(tables.CatalogueChanges).where(
+            tables.CatalogueChanges.c.version <=
+            version - base.CATALOGUE_CHANGE_LOG_SIZE
+        )
+        self._conn.execute(stmt)
+
+    def changes(self, since=None):
+        stmt = sa.sql.select([
+            sa.func.max(tables.CatalogueChanges.c.version)
+        ])
+        version = self._conn.execute(stmt).scalar() or 0
+
+        if since is None or since >= version:
+            return version, []
+
+        stmt = sa.sql.select([
+            tables.CatalogueChanges.c.project,
+            tables.CatalogueChanges.c.queue,
+        ]).where(sa.sql.and_(
+            tables.CatalogueChanges.c.version > since,
+            tables.CatalogueChanges.c.version <= version
+        ))
+
+        return version, [(project, queue)
+                         for project, queue in self._conn.execute(stmt)]
 
     def drop_all(self):
         stmt = sa.sql.expression.delete(tables.Catalogue)
         self._conn.execute(stmt)
 
+        stmt = sa.sql.expression.delete(tables.CatalogueMigrations)
+        self._conn.execute(stmt)
+
+        stmt = sa.sql.expression.delete(tables.CatalogueChanges)
+        self._conn.execute(stmt)
+
 
 def _normalize(entry):
-    name, project, queue = entry
+    name, project, queue, destination = entry
     return {
         'queue': queue,
         'project': project,
-        'pool': name
+        'pool': name,
+        'destination': destination
     }
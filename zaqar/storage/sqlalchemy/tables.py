@@ -43,3 +43,24 @@ Catalogue = sa.Table('Catalogue', metadata,
                      sa.Column('project', sa.String(64)),
                      sa.Column('queue', sa.String(64), nullable=False),
                      sa.UniqueConstraint('project', 'queue'))
+
+
+# NOTE: Destinations are kept out of the Catalogue table, so that
+# create_all() adds them to existing deployments.
+CatalogueMigrations = sa.Table('CatalogueMigrations', metadata,
+                               sa.Column('project', sa.String(64)),
+                               sa.Column('queue', sa.String(64),
+                                         nullable=False),
+                               sa.Column('destination', sa.String(64),
+                                         sa.ForeignKey('Pools.name',
+                                                       ondelete='CASCADE'),
+                                         nullable=False),
+                               sa.UniqueConstraint('project', 'queue'))
+
+
+CatalogueChanges = sa.Table('CatalogueChanges', metadata,
+                            sa.Column('version', sa.INTEGER,
+                                      primary_key=True),
+                            sa.Column('project', sa.String(64)),
+                            sa.Column('queue', sa.String(64),
+                                      nullable=False))
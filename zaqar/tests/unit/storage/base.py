@@ -498,6 +498,34 @@ class MessageControllerTest(ControllerBaseTest):
                                               project=self.project)
             next(result)
 
+    def test_bulk_delete_with_claim(self):
+        ids = _insert_fixtures(self.controller, self.queue_name,
+                               project=self.project,
+                               client_uuid=uuid.uuid4(), num=5)
+
+        claim_id, messages = self.claim_controller.create(
+            self.queue_name, {'ttl': 60, 'grace': 0}, project=self.project,
+            limit=3)
+        claimed = [msg['id'] for msg in messages]
+
+        failed = self.controller.bulk_delete(self.queue_name, ids,
+                                             project=self.project,
+                                             claim=claim_id)
+
+        self.assertEqual(sorted(failed),
+                         sorted(set(ids) - set(claimed)))
+
+        remaining = self.controller.bulk_get(self.queue_name, ids,
+                                             project=self.project)
+        self.assertEqual(sorted(msg['id'] for msg in remaining),
+                         sorted(failed))
+
+        # NOTE: Messages that were already deleted do not fail
+        failed = self.controller.bulk_delete(self.queue_name, claimed,
+                                             project=self.project,
+                                             claim=claim_id)
+        self.assertEqual(failed, [])
+
     def test_claim_effects(self):
         client_uuid = uuid.uuid4()
 
@@ -1310,6 +1338,16 @@ class CatalogueControllerTest(ControllerBaseTest):
                 self._check_structure(e)
                 self._check_value(e, xqueue=q, xproject=p, xpool=s)
 
+    def test_list_with_marker_and_limit(self):
+        with helpers.pool_entries(self.controller, 10) as expect:
+            names = sorted(q for _, q, _ in expect)
+
+            entries = list(self.controller.list(u'_', limit=4))
+            self.assertEqual([e['queue'] for e in entries], names[:4])
+
+            entries = list(self.controller.list(u'_', marker=names[3]))
+            self.assertEqual([e['queue'] for e in entries], names[4:])
+
     def test_update(self):
         with helpers.pool_entry(self.controller, self.project,
                                 self.queue, u'a') as expect:
@@ -1324,6 +1362,27 @@ class CatalogueControllerTest(ControllerBaseTest):
                               'p', 'q', 'a')
         self.assertIn('queue q for project p', str(e))
 
+    def test_set_destination(self):
+        with helpers.pool_entry(self.controller, self.project,
+                                self.queue, u'a') as expect:
+            p, q, s = expect
+            self.assertIsNone(self.controller.get(p, q)['destination'])
+
+            self.controller.set_destination(p, q, u'b')
+            entry = self.controller.get(p, q)
+            self._check_value(entry, xqueue=q, xproject=p, xpool=s)
+            self.assertEqual(entry['destination'], u'b')
+
+            # NOTE: Assigning the queue a new pool ends the migration
+            self.controller.update(p, q, pool=u'b')
+            entry = self.controller.get(p, q)
+            self._check_value(entry, xqueue=q, xproject=p, xpool=u'b')
+            self.assertIsNone(entry['destination'])
+
+        self.assertRaises(errors.QueueNotMapped,
+                          self.controller.set_destination,
+                          'p', 'q', 'a')
+
     def test_get(self):
         with helpers.pool_entry(self.controller,
                                 self.project,
@@ -1332,6 +1391,21 @@ class CatalogueControllerTest(ControllerBaseTest):
             e = self.controller.get(p, q)
             self._check_value(e, xqueue=q, xproject=p, xpool=s)
 
+    def test_changes(self):
+        version, changed = self.controller.changes()
+        self.assertEqual(changed, [])
+
+        with helpers.pool_entry(self.controller, self.project,
+                                self.queue, u'a'):
+            self.controller.update(self.project, self.queue, pool=u'b')
+
+        # NOTE: One change each for the insert, update and delete
+        latest, changed = self.controller.changes(version)
+        self.assertEqual(latest, version + 3)
+        self.assertEqual(changed, [(self.project, self.queue)] * 3)
+
+        self.assertEqual(self.controller.changes(latest), (latest, []))
+
     def test_get_raises_if_does_not_exist(self):
         with helpers.pool_entry(self.controller,
                                 self.project,
@@ -52,6 +52,21 @@ class QueueLifecycleBaseTest(base.V1_1Base):
             msg_mock.side_effect = validator
             self.protocol.onMessage(req, False)
 
+    def test_failed_blocking_request_returns_503(self):
+        future = mock.Mock()
+        future.result.side_effect = RuntimeError
+
+        def validator(resp, isBinary):
+            resp = json.loads(resp)
+            self.assertEqual(resp['headers']['status'], 503)
+
+        with mock.patch.object(self.protocol, 'sendMessage') as msg_mock:
+            msg_mock.side_effect = validator
+            self.protocol._on_response(self.protocol._dummy_request(),
+                                       False, future)
+
+        self.assertTrue(msg_mock.called)
+
     @ddt.data('480924', 'foo')
     def test_basics_thoroughly(self, project_id):
         # Stats are empty - queue not created yet
@@ -97,6 +97,27 @@ class TestClaimsMongoDB(base.V2Base):
 
         self.assertEqual(self.srmock.status, falcon.HTTP_400)
 
+    @ddt.data('-1', '31', 'soon')
+    def test_unacceptable_wait(self, wait):
+        self.simulate_post(self.claims_path,
+                           body='{"ttl": 100, "grace": 60}',
+                           query_string='wait=' + wait, headers=self.headers)
+
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+    def test_wait_on_empty_queue(self):
+        doc = '{"ttl": 100, "grace": 60}'
+        self.simulate_post(self.claims_path, body=doc,
+                           query_string='limit=10', headers=self.headers)
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+
+        with mock.patch.object(self.boot.storage.claim_controller, 'wait',
+                               return_value=False) as wait:
+            self.simulate_post(self.claims_path, body=doc,
+                               query_string='wait=5', headers=self.headers)
+            self.assertEqual(self.srmock.status, falcon.HTTP_204)
+            self.assertEqual(wait.call_count, 1)
+
     @ddt.data(-1, 59, 43201)
     def test_unacceptable_new_ttl(self, ttl):
         href = self._get_a_claim()
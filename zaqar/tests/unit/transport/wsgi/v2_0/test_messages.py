@@ -515,6 +515,43 @@ class TestMessagesMongoDB(base.V2Base):
         self.simulate_get(location, headers=self.headers)
         self.assertEqual(self.srmock.status, falcon.HTTP_200)
 
+    def test_bulk_delete_with_claim(self):
+        self._post_messages(self.messages_path, repeat=5)
+        msg_ids = self._get_msg_ids(self.srmock.headers_dict)
+
+        body = self.simulate_post(self.queue_path + '/claims',
+                                  body='{"ttl": 100, "grace": 100}',
+                                  query_string='limit=3',
+                                  headers=self.headers)
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+
+        claim_id = self.srmock.headers_dict['location'].rsplit('/', 1)[-1]
+        claimed = [msg['id'] for msg in jsonutils.loads(body[0])['messages']]
+        unclaimed = [mid for mid in msg_ids if mid not in claimed]
+
+        # NOTE: Only the messages owned by the claim are deleted
+        query_string = 'ids={0}&claim_id={1}'.format(','.join(msg_ids),
+                                                     claim_id)
+        self.simulate_delete(self.messages_path, query_string=query_string,
+                             headers=self.headers)
+        self.assertEqual(self.srmock.status, falcon.HTTP_403)
+
+        for mid in claimed:
+            self.simulate_get(self.messages_path + '/' + mid,
+                              headers=self.headers)
+            self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
+        for mid in unclaimed:
+            self.simulate_get(self.messages_path + '/' + mid,
+                              headers=self.headers)
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        query_string = 'ids={0}&claim_id={1}'.format(','.join(claimed),
+                                                     claim_id)
+        self.simulate_delete(self.messages_path, query_string=query_string,
+                             headers=self.headers)
+        self.assertEqual(self.srmock.status, falcon.HTTP_204)
+
     def test_no_duplicated_messages_path_in_href(self):
         """Test for bug 1240897."""
 
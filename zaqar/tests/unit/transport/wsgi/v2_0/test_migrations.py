@@ -0,0 +1,134 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import uuid
+
+import ddt
+import falcon
+import mock
+from oslo_serialization import jsonutils
+
+from zaqar import tests as testing
+from zaqar.tests.unit.transport.wsgi import base
+from zaqar.transport.wsgi.v2_0 import migrations
+
+
+@ddt.ddt
+class TestMigrationsMongoDB(base.V2Base):
+
+    config_file = 'wsgi_mongodb_pooled.conf'
+
+    @testing.requires_mongodb
+    def setUp(self):
+        super(TestMigrationsMongoDB, self).setUp()
+        self.project_id = '518b51ea133c4facadae42c328d6b77b'
+        self.pools = [str(uuid.uuid1()) for i in range(3)]
+
+        # NOTE: Create the queue while there is only one pool, so
+        # that it is placed in that pool.
+        self._create_pool(self.pools[0])
+
+        self.queue_name = str(uuid.uuid1())
+        self.queue_path = self.url_prefix + '/queues/' + self.queue_name
+        self.simulate_put(self.queue_path)
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+
+        for name in self.pools[1:]:
+            self._create_pool(name)
+
+        self.pool_path = self.queue_path + '/pool'
+
+        # NOTE: Migrations are not run in the background here
+        patcher = mock.patch.object(migrations.threading, 'Thread')
+        self.thread = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.simulate_delete(self.queue_path)
+        super(TestMigrationsMongoDB, self).tearDown()
+
+    def _create_pool(self, name):
+        doc = {'weight': 100, 'uri': 'mongodb://127.0.0.1:27017'}
+        self.simulate_put(self.url_prefix + '/pools/' + name,
+                          body=jsonutils.dumps(doc))
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+
+    def _get_pool(self):
+        result = self.simulate_get(self.pool_path)
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        return jsonutils.loads(result[0])
+
+    def test_get_returns_pool(self):
+        self.assertEqual(self._get_pool(), {'pool': self.pools[0]})
+
+    def test_get_unmapped_queue_returns_404(self):
+        self.simulate_get(self.url_prefix + '/queues/nonexisting/pool')
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
+    def test_put_unmapped_queue_returns_404(self):
+        self.simulate_put(self.url_prefix + '/queues/nonexisting/pool',
+                          body=jsonutils.dumps({'pool': self.pools[1]}))
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
+    @ddt.data({}, {'pool': 1}, {'pool': 'a', 'weight': 1})
+    def test_put_raises_if_invalid_body(self, doc):
+        self.simulate_put(self.pool_path, body=jsonutils.dumps(doc))
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+    def test_put_raises_if_pool_does_not_exist(self):
+        self.simulate_put(self.pool_path,
+                          body=jsonutils.dumps({'pool': 'nonexisting'}))
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+    def test_put_current_pool_is_noop(self):
+        self.simulate_put(self.pool_path,
+                          body=jsonutils.dumps({'pool': self.pools[0]}))
+        self.assertEqual(self.srmock.status, falcon.HTTP_204)
+        self.assertFalse(self.thread.called)
+
+    def test_put_starts_migration(self):
+        doc = {'pool': self.pools[1]}
+        self.simulate_put(self.pool_path, body=jsonutils.dumps(doc))
+        self.assertEqual(self.srmock.status, falcon.HTTP_202)
+
+        self.assertEqual(self.thread.call_args[1]['args'],
+                         (self.queue_name, self.pools[1], self.project_id))
+        self.assertTrue(self.thread.return_value.start.called)
+
+        self.assertEqual(self._get_pool(),
+                         {'pool': self.pools[0],
+                          'destination': self.pools[1]})
+
+        # NOTE: Assigning the same pool again resumes the migration
+        self.simulate_put(self.pool_path, body=jsonutils.dumps(doc))
+        self.assertEqual(self.srmock.status, falcon.HTTP_202)
+        self.assertEqual(self.thread.call_count, 2)
+
+    def test_put_another_pool_while_migrating_returns_409(self):
+        self.simulate_put(self.pool_path,
+                          body=jsonutils.dumps({'pool': self.pools[1]}))
+        self.assertEqual(self.srmock.status, falcon.HTTP_202)
+
+        self.simulate_put(self.pool_path,
+                          body=jsonutils.dumps({'pool': self.pools[2]}))
+        self.assertEqual(self.srmock.status, falcon.HTTP_409)
+
+    def test_migration_failure_is_logged(self):
+        resource = migrations.Resource(mock.Mock())
+        resource._catalog.migrate.side_effect = RuntimeError
+
+        with mock.patch.object(migrations, 'LOG') as log:
+            resource._migrate(self.queue_name, self.pools[1],
+                              self.project_id)
+
+        self.assertTrue(log.error.called)
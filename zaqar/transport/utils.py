@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import json
+import time
 
 from oslo_utils import encodeutils
 
@@ -58,3 +59,43 @@ def to_json(obj):
     :param obj: a JSON-serializable object
     """
     return json.dumps(obj, ensure_ascii=False)
+
+
+def create_claim(claim_controller, queue, metadata, project=None,
+                 wait=None, **claim_options):
+    """Creates a claim, optionally waiting for messages to claim.
+
+    :param claim_controller: Storage claim controller
+    :param queue: Name of the queue to claim messages from
+    :param metadata: Claim metadata
+    :param project: Project id
+    :param wait: If the queue is empty, the time to wait for
+        messages to arrive, in seconds
+    :param claim_options: Additional options passed to the
+        controller, e.g., the limit on the number of messages
+
+    :returns: (Claim ID, list of claimed messages)
+    """
+    cid, msgs = claim_controller.create(queue, metadata=metadata,
+                                        project=project, **claim_options)
+    msgs = list(msgs)
+
+    if not wait:
+        return cid, msgs
+
+    deadline = time.time() + wait
+
+    while not msgs:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+
+        if not claim_controller.wait(queue, remaining, project=project):
+            break
+
+        cid, msgs = claim_controller.create(queue, metadata=metadata,
+                                            project=project,
+                                            **claim_options)
+        msgs = list(msgs)
+
+    return cid, msgs
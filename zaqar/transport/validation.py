@@ -72,6 +72,10 @@ _TRANSPORT_LIMITS_OPTIONS = (
                deprecated_group='limits:transport',
                help='Defines the maximum message grace period in seconds.'),
 
+    cfg.IntOpt('max_claim_wait', default=30,
+               help='Maximum time, in seconds, that a claim request may '
+                    'wait for messages to arrive when the queue is empty.'),
+
     cfg.ListOpt('subscriber_types', default=['http'],
                 help='Defines supported subscriber types.'),
 )
@@ -245,13 +249,15 @@ class Validator(object):
 
             raise ValidationFailed(msg, delete_uplimit)
 
-    def claim_creation(self, metadata, limit=None):
+    def claim_creation(self, metadata, limit=None, wait=None):
         """Restrictions on the claim parameters upon creation.
 
         :param metadata: The claim metadata
         :param limit: The number of messages to claim
-        :raises: ValidationFailed if either TTL or grace is out of range,
-            or the expected number of messages exceed the limit.
+        :param wait: The time to wait for messages, in seconds
+        :raises: ValidationFailed if either TTL, grace or wait is out
+            of range, or the expected number of messages exceed the
+            limit.
         """
 
         self.claim_updating(metadata)
@@ -273,6 +279,13 @@ class Validator(object):
             raise ValidationFailed(
                 msg, self._limits_conf.max_claim_grace, MIN_CLAIM_GRACE)
 
+        wait_uplimit = self._limits_conf.max_claim_wait
+        if wait is not None and not (0 <= wait <= wait_uplimit):
+            msg = _(u'Wait value may not be negative or greater '
+                    'than {0} seconds.')
+
+            raise ValidationFailed(msg, wait_uplimit)
+
     def claim_updating(self, metadata):
         """Restrictions on the claim TTL.
 
@@ -16,8 +16,14 @@
 from autobahn.asyncio import websocket
 from oslo_log import log as logging
 
+import functools
 import json
 
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
 from zaqar.api.v1_1 import request as schema_validator
 from zaqar.common.api import request
 from zaqar.common.api import response
@@ -54,8 +60,20 @@ class MessagingProtocol(websocket.WebSocketServerProtocol):
                       format(payload.decode('utf8')))
                 pl = json.loads(payload)
                 req = self._create_request(pl)
-                resp = (self._validate_request(pl, req) or
-                        self._handler.process_request(req))
+                resp = self._validate_request(pl, req)
+
+                if resp is None and self._may_block(req):
+                    # NOTE: Process requests that may wait for a
+                    # while in a worker thread, so that the event loop
+                    # keeps serving other connections in the meantime.
+                    loop = asyncio.get_event_loop()
+                    future = loop.run_in_executor(
+                        None, self._handler.process_request, req)
+                    future.add_done_callback(
+                        functools.partial(self._on_response, req, isBinary))
+                    return
+
+                resp = resp or self._handler.process_request(req)
             except ValueError as ex:
                 LOG.exception(ex)
                 req = self._dummy_request()
@@ -67,9 +85,25 @@ class MessagingProtocol(websocket.WebSocketServerProtocol):
         resp_json = json.dumps(resp.get_response())
         self.sendMessage(resp_json, isBinary)
 
+    def _on_response(self, req, isBinary, future):
+        try:
+            resp = future.result()
+        except Exception as ex:
+            LOG.exception(ex)
+            body = {'error': 'Request could not be processed.'}
+            headers = {'status': 503}
+            resp = response.Response(req, body, headers)
+
+        resp_json = json.dumps(resp.get_response())
+        self.sendMessage(resp_json, isBinary)
+
     def onClose(self, wasClean, code, reason):
         print("WebSocket connection closed: {0}".format(reason))
 
+    @staticmethod
+    def _may_block(req):
+        return req._action == 'claim_create' and bool(req._body.get('wait'))
+
     @staticmethod
     def _create_request(pl):
         action = pl.get('action')
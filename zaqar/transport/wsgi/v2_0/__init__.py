@@ -17,6 +17,7 @@ from zaqar.transport.wsgi.v2_0 import flavors
 from zaqar.transport.wsgi.v2_0 import health
 from zaqar.transport.wsgi.v2_0 import homedoc
 from zaqar.transport.wsgi.v2_0 import messages
+from zaqar.transport.wsgi.v2_0 import migrations
 from zaqar.transport.wsgi.v2_0 import ping
 from zaqar.transport.wsgi.v2_0 import pools
 from zaqar.transport.wsgi.v2_0 import queues
@@ -118,6 +119,10 @@ def private_endpoints(driver, conf):
         pools_controller = driver._control.pools_controller
         flavors_controller = driver._control.flavors_controller
 
+        # NOTE: Share the catalog of the pooled data driver, rather
+        # than keeping a second cache of the same mappings.
+        catalog = driver._storage.pool_catalog
+
         catalogue.extend([
             ('/pools',
              pools.Listing(pools_controller)),
@@ -127,6 +132,8 @@ def private_endpoints(driver, conf):
              flavors.Listing(flavors_controller, pools_controller)),
             ('/flavors/{flavor}',
              flavors.Resource(flavors_controller, pools_controller)),
+            ('/queues/{queue_name}/pool',
+             migrations.Resource(catalog)),
         ])
 
     return catalogue
@@ -62,6 +62,10 @@ class CollectionResource(object):
         limit = req.get_param_as_int('limit')
         claim_options = {} if limit is None else {'limit': limit}
 
+        # NOTE: If the queue is empty, optionally wait for
+        # messages to arrive rather than returning right away.
+        wait = req.get_param_as_int('wait')
+
         # NOTE(kgriffs): Clients may or may not actually include the
         # Content-Length header when the body is empty; the following
         # check works for both 0 and None.
@@ -76,18 +80,17 @@ class CollectionResource(object):
 
         # Claim some messages
         try:
-            self._validate.claim_creation(metadata, limit=limit)
+            self._validate.claim_creation(metadata, limit=limit, wait=wait)
 
-            cid, msgs = self._claim_controller.create(
+            # NOTE: Claimed messages are buffered by the helper
+            cid, resp_msgs = utils.create_claim(
+                self._claim_controller,
                 queue_name,
                 metadata=metadata,
                 project=project_id,
+                wait=wait,
                 **claim_options)
 
-            # Buffer claimed messages
-            # TODO(kgriffs): optimize, along with serialization (below)
-            resp_msgs = list(msgs)
-
         except validation.ValidationFailed as ex:
             LOG.debug(ex)
             raise wsgi_errors.HTTPBadRequestAPI(six.text_type(ex))
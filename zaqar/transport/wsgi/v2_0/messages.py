@@ -248,26 +248,42 @@ class CollectionResource(object):
             raise wsgi_errors.HTTPBadRequestAPI(six.text_type(ex))
 
         if ids:
-            resp.status = self._delete_messages_by_id(queue_name, ids,
-                                                      project_id)
+            resp.status = self._delete_messages_by_id(
+                queue_name, ids, project_id, req.get_param('claim_id'))
 
         elif pop_limit:
             resp.status, resp.body = self._pop_messages(queue_name,
                                                         project_id,
                                                         pop_limit)
 
-    def _delete_messages_by_id(self, queue_name, ids, project_id):
+    def _delete_messages_by_id(self, queue_name, ids, project_id,
+                               claim_id=None):
+        error_title = _(u'Unable to delete')
+
         try:
-            self._message_controller.bulk_delete(
+            failed = self._message_controller.bulk_delete(
                 queue_name,
                 message_ids=ids,
-                project=project_id)
+                project=project_id,
+                claim=claim_id)
+
+        except storage_errors.ClaimDoesNotExist as ex:
+            LOG.debug(ex)
+            description = _(u'The specified claim does not exist or '
+                            u'has expired.')
+            raise falcon.HTTPBadRequest(error_title, description)
 
         except Exception as ex:
             LOG.exception(ex)
             description = _(u'Messages could not be deleted.')
             raise wsgi_errors.HTTPServiceUnavailable(description)
 
+        if failed:
+            description = _(u'The following messages are not claimed by '
+                            u'the specified claim, and were not deleted: '
+                            u'{0}').format(u', '.join(failed))
+            raise falcon.HTTPForbidden(error_title, description)
+
         return falcon.HTTP_204
 
     def _pop_messages(self, queue_name, project_id, pop_limit):
@@ -0,0 +1,150 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""migrations: a resource to move queues between storage pools
+
+An operator migrates a queue by assigning it a new pool:
+
+::
+
+    {
+        "pool": string
+    }
+
+The queue remains available while its messages are moved to the new
+pool, in the background. If moving them fails, the failure is logged,
+and the queue keeps being served from both pools. The migration is
+resumed by assigning the same pool again, or by running zaqar-migrate.
+"""
+
+import threading
+
+import falcon
+import jsonschema
+from oslo_log import log
+import six
+
+from zaqar.common.api.schemas import migrations as schema
+from zaqar.i18n import _
+from zaqar.storage import errors
+from zaqar.transport import utils as transport_utils
+from zaqar.transport.wsgi import errors as wsgi_errors
+from zaqar.transport.wsgi import utils as wsgi_utils
+
+LOG = log.getLogger(__name__)
+
+
+class Resource(object):
+    """A handler for the pool of an individual queue.
+
+    :param catalog: catalog of the available pools
+    :type catalog: zaqar.storage.pooling.Catalog
+    """
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+        self._validator = jsonschema.Draft4Validator(schema.create)
+
+    def on_get(self, request, response, project_id, queue_name):
+        """Returns the pool of a queue, along with the pool it is
+        being migrated to, if any:
+
+        ::
+
+            {"pool": "", "destination": ""}
+
+        :returns: HTTP | [200, 404]
+        """
+
+        LOG.debug(u'GET queue pool - queue: %(queue)s, '
+                  u'project: %(project)s',
+                  {'queue': queue_name, 'project': project_id})
+
+        try:
+            entry = self._catalog._catalogue_ctrl.get(project_id,
+                                                      queue_name)
+
+        except errors.QueueNotMapped as ex:
+            LOG.debug(ex)
+            raise falcon.HTTPNotFound()
+
+        data = {'pool': entry['pool']}
+        if entry.get('destination') is not None:
+            data['destination'] = entry['destination']
+
+        response.body = transport_utils.to_json(data)
+
+    def on_put(self, request, response, project_id, queue_name):
+        """Migrates a queue to another pool. Expects the following
+        input:
+
+        ::
+
+            {"pool": ""}
+
+        :returns: HTTP | [202, 204, 400, 404, 409]
+        """
+
+        LOG.debug(u'PUT queue pool - queue: %(queue)s, '
+                  u'project: %(project)s',
+                  {'queue': queue_name, 'project': project_id})
+
+        data = wsgi_utils.load(request)
+        wsgi_utils.validate(self._validator, data)
+        pool = data['pool']
+
+        try:
+            started = self._catalog.start_migration(queue_name, pool,
+                                                    project_id)
+
+        except errors.QueueNotMapped as ex:
+            LOG.debug(ex)
+            raise falcon.HTTPNotFound()
+
+        except errors.PoolDoesNotExist as ex:
+            LOG.debug(ex)
+            raise wsgi_errors.HTTPBadRequestBody(
+                'pool %s does not exist' % pool)
+
+        except errors.QueueIsMigrating as ex:
+            LOG.debug(ex)
+            title = _(u'Unable to migrate')
+            raise falcon.HTTPConflict(title, six.text_type(ex))
+
+        if not started:
+            response.status = falcon.HTTP_204
+            return
+
+        thread = threading.Thread(target=self._migrate,
+                                  args=(queue_name, pool, project_id))
+        thread.daemon = True
+        thread.start()
+
+        response.status = falcon.HTTP_202
+        response.location = request.path
+
+    def _migrate(self, queue, pool, project):
+        try:
+            for _count in self._catalog.migrate(queue, pool, project):
+                pass
+
+        except Exception as ex:
+            LOG.exception(ex)
+
+            msgtmpl = _(u'Migration of queue %(queue)s under project '
+                        u'%(project)s to pool %(pool)s failed. Run '
+                        u'zaqar-migrate, or assign the same pool '
+                        u'again, to resume it.')
+
+            LOG.error(msgtmpl,
+                      dict(queue=queue, project=project, pool=pool))